@@ -0,0 +1,70 @@
+import copy
+import sys
+from argparse import ArgumentParser
+from typing import Dict, List
+
+import torch
+from pytorch_lightning import Trainer, Callback
+
+from imipnet.lightning_module import IMIPLightning
+
+
+class ValidationHistory(Callback):
+    def __init__(self):
+        self.history: List[Dict[str, float]] = []
+
+    def on_validation_end(self, trainer, pl_module):
+        self.history.append({
+            key: float(value) for key, value in trainer.callback_metrics.items()
+            if isinstance(value, (float, int, torch.Tensor)) and (
+                    not isinstance(value, torch.Tensor) or value.numel() == 1)
+        })
+
+
+def overfit(args, bf16: bool, max_steps: int) -> List[Dict[str, float]]:
+    args = copy.deepcopy(args)
+    args.bf16 = bf16
+    imip_module = IMIPLightning(args)  # calls seed everything, so both runs start from the same weights
+
+    history = ValidationHistory()
+    trainer = Trainer(logger=False, checkpoint_callback=False, gpus=None, max_steps=max_steps,
+                      val_check_interval=args.overfit_n, limit_train_batches=1.0,
+                      accumulate_grad_batches=args.accumulate_grad_batches,
+                      callbacks=[history])
+    trainer.fit(imip_module)
+    return history.history
+
+
+def main():
+    parser = ArgumentParser(description="Compare bf16 autocast training against fp32 on a small overfit run")
+    parser = IMIPLightning.add_model_specific_args(parser)
+    parser.add_argument('--max_steps', type=int, default=2000)
+    parser.add_argument('--metric', type=str, default="eval_true_inliers")
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help="largest allowed relative difference between the final fp32 and bf16 metric")
+    args = parser.parse_args()
+
+    if args.overfit_n < 1:
+        raise ValueError("the convergence check requires an overfit run, set --overfit_n")
+
+    fp32_history = overfit(args, False, args.max_steps)
+    bf16_history = overfit(args, True, args.max_steps)
+
+    print("validation\tfp32\tbf16")
+    for i, (fp32_metrics, bf16_metrics) in enumerate(zip(fp32_history, bf16_history)):
+        print("%d\t%f\t%f" % (i, fp32_metrics[args.metric], bf16_metrics[args.metric]))
+
+    fp32_final = fp32_history[-1][args.metric]
+    bf16_final = bf16_history[-1][args.metric]
+    relative_difference = abs(bf16_final - fp32_final) / max(abs(fp32_final), 1.0)
+    print("Final %s: fp32 %f, bf16 %f, relative difference %f" % (
+        args.metric, fp32_final, bf16_final, relative_difference))
+
+    if relative_difference > args.tolerance:
+        print("bf16 did not converge to within %f of fp32" % args.tolerance)
+        sys.exit(1)
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+import scipy.stats
+import torch
+import tqdm
+
+from imipnet.data.image import load_image_for_torch
+from imipnet.datasets.shuffle import ShuffledDataset
+from imipnet.lightning_module import IMIPLightning, test_dataset_registry
+from imipnet.metrics.epipolar import count_epipolar_inliers
+
+parser = ArgumentParser(description="Correlate the epipolar inlier proxy with the true inlier count, "
+                                    "per pair and per checkpoint")
+parser.add_argument("checkpoints", type=str, nargs="+",
+                    help="checkpoints to score, e.g. the snapshots of one run, so the ranking can be compared")
+parser.add_argument('eval_set', choices=test_dataset_registry.keys())
+parser.add_argument('--data_root', default="./data")
+parser.add_argument('--n_eval_samples', type=int, default=200)
+params = parser.parse_args()
+
+device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+
+pair_true_inliers = []
+pair_epipolar_inliers = []
+checkpoint_true_inliers = []
+checkpoint_epipolar_inliers = []
+true_seconds = 0.0
+epipolar_seconds = 0.0
+
+for checkpoint in params.checkpoints:
+    checkpoint_net = IMIPLightning.load_from_checkpoint(checkpoint, strict=False)  # calls seed everything
+    checkpoint_net.freeze()
+    checkpoint_net.to(device)
+    eval_set = ShuffledDataset(
+        test_dataset_registry[params.eval_set](params.data_root),
+        None if params.n_eval_samples < 1 else params.n_eval_samples
+    )
+
+    true_inliers = []
+    epipolar_inliers = []
+    for pair in tqdm.tqdm(eval_set, desc=checkpoint):
+        img_1 = checkpoint_net.preprocess(load_image_for_torch(pair.image_1, device))
+        img_2 = checkpoint_net.preprocess(load_image_for_torch(pair.image_2, device))
+        img_1_kp_candidates, _ = checkpoint_net.network.extract_top_k_keypoints(img_1, 1)
+        img_2_kp_candidates, _ = checkpoint_net.network.extract_top_k_keypoints(img_2, 1)
+
+        start = time.perf_counter()
+        _, num_true_inliers, _ = IMIPLightning.count_inliers(
+            pair.correspondences_torch, img_1_kp_candidates, img_2_kp_candidates,
+            img_1.shape, img_2.shape, checkpoint_net.hparams.inlier_radius
+        )
+        true_inliers.append(float(num_true_inliers))
+        true_seconds += time.perf_counter() - start
+
+        start = time.perf_counter()
+        num_epipolar_inliers = count_epipolar_inliers(
+            torch.tensor(pair.f_matrix_forward, device=device),
+            img_1_kp_candidates[:, :, 0], img_2_kp_candidates[:, :, 0], checkpoint_net.hparams.inlier_radius
+        )
+        epipolar_inliers.append(float(num_epipolar_inliers))
+        epipolar_seconds += time.perf_counter() - start
+
+    pair_true_inliers.extend(true_inliers)
+    pair_epipolar_inliers.extend(epipolar_inliers)
+    checkpoint_true_inliers.append(np.mean(true_inliers))
+    checkpoint_epipolar_inliers.append(np.mean(epipolar_inliers))
+    print("{}: true inliers {:.2f}, epipolar inliers {:.2f}".format(
+        checkpoint, checkpoint_true_inliers[-1], checkpoint_epipolar_inliers[-1]))
+
+print("Pairs: {}, checkpoints: {}".format(len(pair_true_inliers), len(checkpoint_true_inliers)))
+print("Per pair Pearson r {:.3f}, Spearman rho {:.3f}".format(
+    scipy.stats.pearsonr(pair_true_inliers, pair_epipolar_inliers)[0],
+    scipy.stats.spearmanr(pair_true_inliers, pair_epipolar_inliers)[0]))
+if len(checkpoint_true_inliers) > 2:
+    # the ranking of checkpoints is what matters for choosing the best model
+    print("Per checkpoint Pearson r {:.3f}, Spearman rho {:.3f}, Kendall tau {:.3f}".format(
+        scipy.stats.pearsonr(checkpoint_true_inliers, checkpoint_epipolar_inliers)[0],
+        scipy.stats.spearmanr(checkpoint_true_inliers, checkpoint_epipolar_inliers)[0],
+        scipy.stats.kendalltau(checkpoint_true_inliers, checkpoint_epipolar_inliers)[0]))
+print("Seconds per pair: true inliers {:.4f}, epipolar inliers {:.4f}".format(
+    true_seconds / len(pair_true_inliers), epipolar_seconds / len(pair_true_inliers)))
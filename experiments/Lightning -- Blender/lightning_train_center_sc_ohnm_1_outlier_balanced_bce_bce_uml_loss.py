@@ -1,11 +1,12 @@
 import os
+import sys
 from argparse import ArgumentParser
 
 from pytorch_lightning import Trainer, seed_everything
 from pytorch_lightning.callbacks import ModelCheckpoint
 from pytorch_lightning.loggers import TensorBoardLogger
 
-from imipnet.lightning_module import IMIPLightning
+from imipnet.lightning_module import IMIPLightning, trainer_device_kwargs
 
 parser = ArgumentParser()
 parser = IMIPLightning.add_model_specific_args(parser)
@@ -13,7 +14,7 @@ args = parser.parse_args([
     "--loss", "outlier-balanced-bce-bce-uml", "--n_top_patches", "1",
     "--train_set", "blender-livingroom-gray", "--eval_set", "blender-livingroom-gray",
     "--test_set", "blender-livingroom-gray", "--preprocess", "center"
-])
+] + sys.argv[1:])
 
 imip_module = IMIPLightning(args)
 name = imip_module.get_new_run_name()
@@ -33,7 +34,7 @@ checkpoint_callback = ModelCheckpoint(
 
 overfit_val = args.overfit_n
 
-trainer = Trainer(logger=logger, gpus=[0], val_check_interval=250 if overfit_val == 0 else overfit_val,
+trainer = Trainer(logger=logger, **trainer_device_kwargs(args), val_check_interval=250 if overfit_val == 0 else overfit_val,
                   max_steps=20000 * 5, limit_train_batches=20000 if overfit_val == 0 else 1.0,
                   max_epochs=2000, reload_dataloaders_every_epoch=False,
                   checkpoint_callback=checkpoint_callback)
@@ -1,3 +1,4 @@
+import time
 import timeit
 from argparse import ArgumentParser
 from typing import List, Tuple
@@ -8,6 +9,7 @@ import torch
 
 from imipnet.data.image import load_image_for_torch
 from imipnet.lightning_module import test_dataset_registry, IMIPLightning
+from imipnet.perf_log import append_record, config_hash, peak_rss_bytes
 
 
 class SIFT:
@@ -48,6 +50,7 @@ class IMIPNet:
 
         checkpoint_net = IMIPLightning.load_from_checkpoint(checkpoint_path, strict=False)  # calls seed everything
         checkpoint_net.freeze()
+        self.hparams = checkpoint_net.hparams
         self.network = checkpoint_net.network.to(device=self.device)
 
     # kitti-gray-0.5[0] 304s / 1000
@@ -73,6 +76,9 @@ def main():
     parser.add_argument('test_set', choices=test_dataset_registry.keys())
     parser.add_argument('--data_root', default="./data")
     parser.add_argument("--output_dir", type=str, default="./test_results")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs of each engine, after one warm up run")
+    parser.add_argument("--perf_log", type=str, default=None,
+                        help="append the images per second of each engine to this JSONL file")
     params = parser.parse_args()
 
     test_set = test_dataset_registry[params.test_set](params.data_root)
@@ -86,13 +92,31 @@ def main():
 
     print("Loaded")
 
-    sift_seconds = timeit.timeit(lambda: sift_corr_engine.correspondences_np(images), number=1)
+    def imip_correspondences():
+        imip_corr_engine.correspondences_torch(image_batch)
+        if imip_corr_engine.device != "cpu":
+            torch.cuda.synchronize()
 
-    image_batch = torch.stack([load_image_for_torch(img, device=imip_corr_engine.device) for img in images], dim=0)
-    imip_seconds = timeit.timeit(lambda: imip_corr_engine.correspondences_torch(image_batch), number=1)
+    # the first run of each engine warms up caches, cuDNN autotuning and lazy initialization
+    sift_seconds = timeit.repeat(lambda: sift_corr_engine.correspondences_np(images), number=1,
+                                 repeat=params.repeat + 1)[1:]
 
-    print("SIFT: %f" % sift_seconds)
-    print("IMIP: %f" % imip_seconds)
+    image_batch = torch.stack([load_image_for_torch(img, device=imip_corr_engine.device) for img in images], dim=0)
+    imip_seconds = timeit.repeat(imip_correspondences, number=1, repeat=params.repeat + 1)[1:]
+
+    print("SIFT: min %f, median %f" % (min(sift_seconds), float(np.median(sift_seconds))))
+    print("IMIP: min %f, median %f" % (min(imip_seconds), float(np.median(imip_seconds))))
+
+    if params.perf_log is not None:
+        append_record(params.perf_log, {
+            "phase": "inference",
+            "time": time.time(),
+            "config_hash": config_hash(imip_corr_engine.hparams),
+            "test_set": params.test_set,
+            "sift_images_per_second": len(images) / float(np.median(sift_seconds)),
+            "imip_images_per_second": len(images) / float(np.median(imip_seconds)),
+            **peak_rss_bytes()
+        })
     return
 
 
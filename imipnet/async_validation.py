@@ -0,0 +1,202 @@
+import glob
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+from typing import Dict, List, Optional
+
+import torch
+from pytorch_lightning import Callback
+from pytorch_lightning.utilities import move_data_to_device
+
+SNAPSHOT_PATTERN = re.compile(r"snapshot-(\d+)\.ckpt$")
+DONE_FILE = "done"
+
+
+def snapshot_path(spool_dir: str, step: int) -> str:
+    return os.path.join(spool_dir, "snapshot-%08d.ckpt" % step)
+
+
+def scores_path(snapshot: str) -> str:
+    return os.path.splitext(snapshot)[0] + ".json"
+
+
+def snapshot_step(snapshot: str) -> int:
+    return int(SNAPSHOT_PATTERN.search(snapshot).group(1))
+
+
+def list_snapshots(spool_dir: str) -> List[str]:
+    return sorted(path for path in glob.glob(os.path.join(spool_dir, "snapshot-*.ckpt"))
+                  if SNAPSHOT_PATTERN.search(path) is not None)
+
+
+def write_atomically(path: str, write_fn):
+    # readers polling the spool never see a partially written file
+    temp_path = path + ".tmp"
+    write_fn(temp_path)
+    os.replace(temp_path, path)
+
+
+class AsyncValidation(Callback):
+    """
+    AsyncValidation replaces the trainer's validation loop with a separate evaluator process,
+    so training never pauses to validate. Every snapshot_interval steps the trainer spools a
+    checkpoint, which the evaluator scores with the module's own validation_step and
+    validation_epoch_end. Scores are logged at the snapshot's step as they arrive, and the
+    best snapshot by monitor is kept in checkpoint_dir alongside last.ckpt.
+    The evaluator always scores the newest snapshot, skipping any it has fallen behind on.
+    """
+
+    def __init__(self, spool_dir: str, checkpoint_dir: str, snapshot_interval: int,
+                 evaluator_device: str = "cpu", monitor: str = "eval_true_inliers", mode: str = "max"):
+        if mode not in ["min", "max"]:
+            raise ValueError("mode must be min or max")
+        self._spool_dir = spool_dir
+        self._checkpoint_dir = checkpoint_dir
+        self._snapshot_interval = snapshot_interval
+        self._evaluator_device = evaluator_device
+        self._monitor = monitor
+        self._mode = mode
+
+        self._evaluator: Optional[subprocess.Popen] = None
+        self._last_snapshot_step: Optional[int] = None
+        self._best_score: Optional[float] = None
+        self._best_checkpoint: Optional[str] = None
+
+    def on_train_start(self, trainer, pl_module):
+        if trainer.global_rank != 0:
+            return
+        os.makedirs(self._spool_dir, exist_ok=True)
+        os.makedirs(self._checkpoint_dir, exist_ok=True)
+        done_path = os.path.join(self._spool_dir, DONE_FILE)
+        if os.path.exists(done_path):
+            os.remove(done_path)
+        self._evaluator = subprocess.Popen([
+            sys.executable, "-m", "imipnet.async_validation", self._spool_dir, "--device", self._evaluator_device
+        ])
+
+    def on_batch_end(self, trainer, pl_module):
+        if trainer.global_step > 0 and trainer.global_step % self._snapshot_interval == 0:
+            self.save_snapshot(trainer)
+        if trainer.global_rank == 0:
+            self.collect_scores(trainer, pl_module)
+
+    def on_train_end(self, trainer, pl_module):
+        self.save_snapshot(trainer)
+        trainer.save_checkpoint(os.path.join(self._checkpoint_dir, "last.ckpt"))
+        if trainer.global_rank != 0:
+            return
+
+        # let the evaluator finish the final snapshot
+        with open(os.path.join(self._spool_dir, DONE_FILE), "w"):
+            pass
+        if self._evaluator is not None:
+            self._evaluator.wait()
+        self.collect_scores(trainer, pl_module)
+
+    def save_snapshot(self, trainer):
+        # decided from the step alone, which every rank agrees on, since saving is collective under DDP.
+        # With gradient accumulation several batches end on the same step
+        if trainer.global_step == self._last_snapshot_step:
+            return
+        self._last_snapshot_step = trainer.global_step
+        path = snapshot_path(self._spool_dir, trainer.global_step)
+        if trainer.global_rank == 0:
+            write_atomically(path, trainer.save_checkpoint)
+        else:
+            trainer.save_checkpoint(path)  # only rank zero writes, but every rank must take part
+
+    def collect_scores(self, trainer, pl_module):
+        snapshots = list_snapshots(self._spool_dir)
+        scored = [snapshot for snapshot in snapshots if os.path.exists(scores_path(snapshot))]
+        if len(scored) == 0:
+            return
+        newest_scored_step = snapshot_step(scored[-1])
+
+        # snapshots older than the newest score were skipped by the evaluator
+        for snapshot in snapshots:
+            if snapshot_step(snapshot) < newest_scored_step and snapshot not in scored:
+                os.remove(snapshot)
+
+        for snapshot in scored:
+            with open(scores_path(snapshot)) as scores_file:
+                scores: Dict[str, float] = json.load(scores_file)
+            step = snapshot_step(snapshot)
+            if pl_module.logger is not None:
+                pl_module.logger.log_metrics(scores["log"], step=step)
+
+            if self._monitor not in scores:
+                raise ValueError("the validation scores have no {}, only {}".format(
+                    self._monitor, ", ".join(key for key in scores if key != "log")
+                ))
+            score = scores[self._monitor]
+            is_better = self._best_score is None or (
+                score > self._best_score if self._mode == "max" else score < self._best_score
+            )
+            if is_better:
+                checkpoint = os.path.join(
+                    self._checkpoint_dir, "step=%d-%s=%.2f.ckpt" % (step, self._monitor, score)
+                )
+                shutil.copyfile(snapshot, checkpoint)
+                if self._best_checkpoint is not None:
+                    os.remove(self._best_checkpoint)
+                self._best_score, self._best_checkpoint = score, checkpoint
+                print("Step %d: %s reached %f, saved %s" % (step, self._monitor, score, checkpoint))
+            os.remove(scores_path(snapshot))
+            os.remove(snapshot)
+
+        # the newest scores stand in for the validation loop's metrics
+        trainer.callback_metrics.update({key: value for key, value in scores.items() if key != "log"})
+
+
+def score_snapshot(snapshot: str, device: torch.device) -> Dict[str, float]:
+    from imipnet.lightning_module import IMIPLightning
+
+    module = IMIPLightning.load_from_checkpoint(snapshot, strict=False)  # calls seed everything
+    module.freeze()
+    module.to(device)
+
+    outputs = []
+    for dataloader_index, loader in enumerate(module.val_dataloader()):
+        outputs.append([
+            module.validation_step(move_data_to_device(batch, device), batch_idx, dataloader_index)
+            for batch_idx, batch in enumerate(loader)
+        ])
+    results = module.validation_epoch_end(outputs)
+    scores = {key: float(value) for key, value in results.items() if key != "log"}
+    scores["log"] = {key: float(value) for key, value in results["log"].items()}
+    return scores
+
+
+def write_scores(path: str, scores: Dict[str, float]):
+    with open(path, "w") as scores_file:
+        json.dump(scores, scores_file)
+
+
+def main():
+    parser = ArgumentParser(description="Score the snapshots spooled by AsyncValidation until training is done")
+    parser.add_argument("spool_dir", type=str)
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--poll_interval", type=float, default=5.0)
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    while True:
+        # check for the done file first so the final snapshot is never missed
+        done = os.path.exists(os.path.join(args.spool_dir, DONE_FILE))
+        snapshots = list_snapshots(args.spool_dir)
+        if len(snapshots) > 0 and not os.path.exists(scores_path(snapshots[-1])):
+            scores = score_snapshot(snapshots[-1], device)
+            write_atomically(scores_path(snapshots[-1]), lambda path: write_scores(path, scores))
+        elif done:
+            return
+        else:
+            time.sleep(args.poll_interval)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,9 @@
-from typing import Tuple
+from typing import Tuple, Dict
 
 import numpy as np
+import torch
 
+from imipnet import timing
 from imipnet.data.pairs import CorrespondencePair
 
 
@@ -20,6 +22,7 @@ class AbsoluteFlowPair(CorrespondencePair):
         self.__name = name
         self.__forward_flow = absolute_forward_flow
         self.__backward_flow = absolute_backward_flow
+        self.__flow_tensors: Dict[Tuple[bool, torch.device], torch.Tensor] = {}
 
     def correspondences(self, pixels_xy: np.ndarray, inverse: bool = False) -> Tuple[np.ndarray, np.ndarray]:
         flow = self.__forward_flow if not inverse else self.__backward_flow
@@ -37,6 +40,28 @@ class AbsoluteFlowPair(CorrespondencePair):
 
         return corr_pixels_xy, tracked_indices
 
+    def correspondences_torch(self, pixels_xy: torch.Tensor, inverse: bool = False) \
+            -> Tuple[torch.Tensor, torch.Tensor]:
+        flow = self.__flow_tensor(inverse, pixels_xy.device)
+
+        pixels_xy = torch.round(pixels_xy).to(torch.long)
+        pixels_xy[0, pixels_xy[0] == flow.shape[2]] -= 1
+        pixels_xy[1, pixels_xy[1] == flow.shape[1]] -= 1
+
+        corr_pixels_xy = flow[:, pixels_xy[1], pixels_xy[0]]
+        mask = ~torch.isnan(corr_pixels_xy[0])
+        corr_pixels_xy[:, ~mask] = 0
+
+        return corr_pixels_xy, mask
+
+    def __flow_tensor(self, inverse: bool, device: torch.device) -> torch.Tensor:
+        # the flow is only copied to a device once, since each pair is queried several times
+        key = (inverse, device)
+        if key not in self.__flow_tensors:
+            flow = self.__forward_flow if not inverse else self.__backward_flow
+            self.__flow_tensors[key] = torch.from_numpy(flow).to(device=device)
+        return self.__flow_tensors[key]
+
     @property
     def image_1(self) -> np.ndarray:
         return self.__image_1
@@ -64,17 +89,19 @@ class CalibratedDepthPair(AbsoluteFlowPair):
                  ):
         image_1_shape = image_1.shape[:2]
         image_2_shape = image_2.shape[:2]
-        abs_flow_forward = CalibratedDepthPair._calculate_absolute_flow(
-            image_1_camera_matrix, image_2_camera_matrix, image_1_depth_map,
-            image_1_shape, image_2_shape
-        )
-        abs_flow_backward = CalibratedDepthPair._calculate_absolute_flow(
-            image_2_camera_matrix, image_1_camera_matrix, image_2_depth_map,
-            image_2_shape, image_1_shape
-        )
-        abs_flow_forward, abs_flow_backward = CalibratedDepthPair._refine_pairwise_absolute_flow(
-            abs_flow_forward, abs_flow_backward,
-        )
+        with timing.stage("data/flow"):
+            abs_flow_forward = CalibratedDepthPair._calculate_absolute_flow(
+                image_1_camera_matrix, image_2_camera_matrix, image_1_depth_map,
+                image_1_shape, image_2_shape
+            )
+            abs_flow_backward = CalibratedDepthPair._calculate_absolute_flow(
+                image_2_camera_matrix, image_1_camera_matrix, image_2_depth_map,
+                image_2_shape, image_1_shape
+            )
+        with timing.stage("data/flow_refine"):
+            abs_flow_forward, abs_flow_backward = CalibratedDepthPair._refine_pairwise_absolute_flow(
+                abs_flow_forward, abs_flow_backward,
+            )
         super(CalibratedDepthPair, self).__init__(
             image_1, image_2, name, abs_flow_forward, abs_flow_backward
         )
@@ -1,5 +1,6 @@
 import numpy as np
 
+from imipnet import timing
 from imipnet.data.pairs import FundamentalMatrixPair
 
 PINV_F_MAT_ALGORITHM = 0
@@ -14,12 +15,13 @@ class PinvFundamentalMatrixPair(FundamentalMatrixPair):
         self._image_2 = image_2
         self._name = name
 
-        self._F_mat_forward = PinvFundamentalMatrixPair.calc_f_matrix(
-            image_1_camera_center, image_1_camera_matrix, image_2_camera_matrix
-        )
-        self._F_mat_backward = PinvFundamentalMatrixPair.calc_f_matrix(
-            image_2_camera_center, image_2_camera_matrix, image_1_camera_matrix
-        )
+        with timing.stage("data/f_matrix"):
+            self._F_mat_forward = PinvFundamentalMatrixPair.calc_f_matrix(
+                image_1_camera_center, image_1_camera_matrix, image_2_camera_matrix
+            )
+            self._F_mat_backward = PinvFundamentalMatrixPair.calc_f_matrix(
+                image_2_camera_center, image_2_camera_matrix, image_1_camera_matrix
+            )
 
     @property
     def f_matrix_forward(self) -> np.ndarray:
@@ -66,12 +68,13 @@ class StdStereoFundamentalMatrixPair(FundamentalMatrixPair):
         self.baseline_1_2 = image_1_extrinsic_matrix @ np.vstack((image_2_pose_matrix[:, -1, np.newaxis], 1))
         self.rotation_rad = np.arccos((np.trace(image_1_pose_matrix[:, 0:3] @ image_2_pose_matrix[:, 0:3].T) - 1) / 2)
 
-        self._F_mat_forward = StdStereoFundamentalMatrixPair.calc_f_matrix(
-            image_1_intrinsic_matrix_inv, image_1_pose_matrix, image_2_intrinsic_matrix, image_2_extrinsic_matrix
-        )
-        self._F_mat_backward = StdStereoFundamentalMatrixPair.calc_f_matrix(
-            image_2_intrinsic_matrix_inv, image_2_pose_matrix, image_1_intrinsic_matrix, image_1_extrinsic_matrix
-        )
+        with timing.stage("data/f_matrix"):
+            self._F_mat_forward = StdStereoFundamentalMatrixPair.calc_f_matrix(
+                image_1_intrinsic_matrix_inv, image_1_pose_matrix, image_2_intrinsic_matrix, image_2_extrinsic_matrix
+            )
+            self._F_mat_backward = StdStereoFundamentalMatrixPair.calc_f_matrix(
+                image_2_intrinsic_matrix_inv, image_2_pose_matrix, image_1_intrinsic_matrix, image_1_extrinsic_matrix
+            )
 
     @property
     def f_matrix_forward(self) -> np.ndarray:
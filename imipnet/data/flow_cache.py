@@ -0,0 +1,186 @@
+import os
+import socket
+from typing import Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from imipnet import timing
+from .pairs import CorrespondencePair
+
+# the flow is stored as int16 in 1/flow_scale pixel steps, flow_invalid marks pixels without consistent flow
+flow_scale = 8
+flow_invalid = np.iinfo(np.int16).min
+
+
+def adjacent_flow(img_1: np.ndarray, img_2: np.ndarray, consistency_threshold: float = 1.0,
+                  border_margin: int = 15) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Computes the dense optical flow from img_1 to img_2 and back, keeping the flow of a pixel only
+    where the flow back from where it lands returns within consistency_threshold pixels of it, like
+    the forward backward check of klt.Tracker.track, and where it lands clear of the border.
+    :return: the forward and backward flow as 2xHxW float32 arrays of x, y displacements, NaN where invalid
+    """
+    if img_1.ndim == 3:
+        img_1, img_2 = cv2.cvtColor(img_1, cv2.COLOR_RGB2GRAY), cv2.cvtColor(img_2, cv2.COLOR_RGB2GRAY)
+    forward = cv2.calcOpticalFlowFarneback(img_1, img_2, None, 0.5, 3, 15, 3, 5, 1.2, 0).transpose((2, 0, 1))
+    backward = cv2.calcOpticalFlowFarneback(img_2, img_1, None, 0.5, 3, 15, 3, 5, 1.2, 0).transpose((2, 0, 1))
+    return _consistent_flow(forward, backward, consistency_threshold, border_margin), \
+        _consistent_flow(backward, forward, consistency_threshold, border_margin)
+
+
+def _consistent_flow(flow: np.ndarray, reverse_flow: np.ndarray, consistency_threshold: float,
+                     border_margin: int) -> np.ndarray:
+    height, width = flow.shape[1:]
+    pixels_y, pixels_x = np.mgrid[0:height, 0:width]
+    landed_x, landed_y = pixels_x + flow[0], pixels_y + flow[1]
+    in_bounds = (landed_x >= border_margin) & (landed_x < width - border_margin) & \
+                (landed_y >= border_margin) & (landed_y < height - border_margin)
+
+    landed_cols = np.clip(np.round(landed_x).astype(int), 0, width - 1)
+    landed_rows = np.clip(np.round(landed_y).astype(int), 0, height - 1)
+    round_trip = flow + reverse_flow[:, landed_rows, landed_cols]
+    consistent = np.linalg.norm(round_trip, axis=0) < consistency_threshold
+
+    flow = flow.astype(np.float32)
+    flow[:, ~(in_bounds & consistent)] = np.nan
+    return flow
+
+
+def quantize_flow(flow: np.ndarray) -> np.ndarray:
+    limit = np.iinfo(np.int16).max
+    quantized = np.clip(np.round(np.nan_to_num(flow) * flow_scale), -limit, limit).astype(np.int16)
+    quantized[:, np.isnan(flow[0])] = flow_invalid
+    return quantized
+
+
+def build_flow_cache(images: Sequence[np.ndarray], folder: str, stride: int = 1):
+    """
+    Computes the consistent flow between each pair of adjacent frames of images and stores it in
+    folder as forward_flow.npy and backward_flow.npy, each an (N - 1)x2xHxW int16 array, H and W
+    the image size divided by stride, which FlowCache memory maps. The backward flow of frame t
+    maps frame t + 1 back to frame t.
+    """
+    if stride < 1:
+        raise ValueError("stride must be positive")
+    os.makedirs(folder, exist_ok=True)
+
+    prev_img = images[0]
+    height, width = prev_img.shape[0:2]
+    shape = (len(images) - 1, 2, (height + stride - 1) // stride, (width + stride - 1) // stride)
+    # written under temporary names so an interrupted build isn't mistaken for a finished one, unique to
+    # the process so concurrent builds of the same cache, e.g. by every DDP rank, each replace whole files
+    forward_path, backward_path, stride_path = [
+        _temp_path(folder, name) for name in ("forward_flow.npy", "backward_flow.npy", "stride.txt")
+    ]
+    forward_file = np.lib.format.open_memmap(forward_path, "w+", np.int16, shape)
+    backward_file = np.lib.format.open_memmap(backward_path, "w+", np.int16, shape)
+    for i in range(1, len(images)):
+        curr_img = images[i]
+        forward, backward = adjacent_flow(prev_img, curr_img)
+        forward_file[i - 1] = quantize_flow(forward[:, ::stride, ::stride])
+        backward_file[i - 1] = quantize_flow(backward[:, ::stride, ::stride])
+        prev_img = curr_img
+
+    forward_file.flush()
+    backward_file.flush()
+    del forward_file, backward_file
+    with open(stride_path, "w") as stride_file:
+        stride_file.write(str(stride))
+    os.replace(stride_path, os.path.join(folder, "stride.txt"))
+    os.replace(forward_path, os.path.join(folder, "forward_flow.npy"))
+    os.replace(backward_path, os.path.join(folder, "backward_flow.npy"))
+
+
+def _temp_path(folder: str, name: str) -> str:
+    # the host as well as the process, since the data root may be shared between nodes
+    return os.path.join(folder, "{}.{}.{}.tmp".format(name, socket.gethostname(), os.getpid()))
+
+
+class FlowCache:
+    """
+    FlowCache memory maps the adjacent frame flow stored by build_flow_cache and tracks pixels
+    between any two frames of the sequence by composing it, gathering the flow at every pixel at
+    once for each frame stepped through. A pixel is lost where any step has no consistent flow.
+    The arrays are opened lazily, so the cache pickles without them.
+    """
+
+    def __init__(self, folder: str):
+        self._folder = folder
+        self._forward_flow: Optional[np.ndarray] = None
+        self._backward_flow: Optional[np.ndarray] = None
+        with open(os.path.join(folder, "stride.txt"), "r") as stride_file:
+            self._stride = int(stride_file.read())
+
+    @staticmethod
+    def exists(folder: str) -> bool:
+        return all([os.path.exists(os.path.join(folder, file))
+                    for file in ("forward_flow.npy", "backward_flow.npy", "stride.txt")])
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_forward_flow"], state["_backward_flow"] = None, None
+        return state
+
+    def _open(self):
+        if self._forward_flow is None:
+            self._forward_flow = np.load(os.path.join(self._folder, "forward_flow.npy"), mmap_mode="r")
+            self._backward_flow = np.load(os.path.join(self._folder, "backward_flow.npy"), mmap_mode="r")
+
+    def track(self, pixels_xy: np.ndarray, from_frame: int, to_frame: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: where the 2xN pixels_xy of from_frame land in to_frame, and an N boolean mask of
+                 the pixels tracked all the way
+        """
+        self._open()
+        if from_frame <= to_frame:
+            flows, steps = self._forward_flow, range(from_frame, to_frame)
+        else:
+            flows, steps = self._backward_flow, range(from_frame - 1, to_frame - 1, -1)
+
+        with timing.stage("data/flow_compose"):
+            positions_xy = pixels_xy.astype(np.float32)
+            tracked = np.ones(pixels_xy.shape[1], dtype=bool)
+            for step in steps:
+                flow = flows[step]
+                cols = np.clip(np.round(positions_xy[0] / self._stride).astype(int), 0, flow.shape[2] - 1)
+                rows = np.clip(np.round(positions_xy[1] / self._stride).astype(int), 0, flow.shape[1] - 1)
+                step_flow = flow[:, rows, cols]
+                tracked &= step_flow[0] != flow_invalid
+                positions_xy += step_flow.astype(np.float32) / flow_scale
+        return positions_xy, tracked
+
+
+class FlowCachePair(CorrespondencePair):
+    """
+    FlowCachePair is the counterpart of klt.KLTPair which finds the correspondences of its frames
+    in a FlowCache of their sequence, so it only needs the pair's own two images, not the frames
+    in between, and runs no optical flow.
+    """
+
+    def __init__(self, image_1: np.ndarray, image_2: np.ndarray, name: str, flow_cache: FlowCache,
+                 img_1_index: int, img_2_index: int):
+        self._image_1 = image_1
+        self._image_2 = image_2
+        self._name = name
+        self._flow_cache = flow_cache
+        self._img_1_index = img_1_index
+        self._img_2_index = img_2_index
+
+    def correspondences(self, pixels_xy: np.ndarray, inverse: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        from_frame, to_frame = (self._img_1_index, self._img_2_index) if not inverse else \
+            (self._img_2_index, self._img_1_index)
+        positions_xy, tracked = self._flow_cache.track(pixels_xy, from_frame, to_frame)
+        return positions_xy[:, tracked], np.arange(pixels_xy.shape[1])[tracked]
+
+    @property
+    def image_1(self) -> np.ndarray:
+        return self._image_1
+
+    @property
+    def image_2(self) -> np.ndarray:
+        return self._image_2
+
+    @property
+    def name(self) -> str:
+        return self._name
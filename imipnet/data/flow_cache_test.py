@@ -0,0 +1,59 @@
+import multiprocessing
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from imipnet.data.flow_cache import FlowCache, FlowCachePair, build_flow_cache, flow_invalid, quantize_flow
+
+
+class TestFlowCache(unittest.TestCase):
+
+    def write_cache(self, folder: str, forward: np.ndarray, backward: np.ndarray):
+        np.save(os.path.join(folder, "forward_flow.npy"), np.stack([quantize_flow(flow) for flow in forward]))
+        np.save(os.path.join(folder, "backward_flow.npy"), np.stack([quantize_flow(flow) for flow in backward]))
+        with open(os.path.join(folder, "stride.txt"), "w") as stride_file:
+            stride_file.write("1")
+
+    def test_quantize_flow(self):
+        flow = np.array([[[0.5, np.nan]], [[-1.25, np.nan]]], dtype=np.float32)
+        quantized = quantize_flow(flow)
+        self.assertEqual(quantized[0, 0, 1], flow_invalid)
+        np.testing.assert_array_equal(quantized[:, 0, 0], [4, -10])
+
+    def test_composes_flow(self):
+        # every frame moves 2 pixels right and 1 down, except where column 9 has no flow
+        forward = np.zeros((3, 2, 20, 20), dtype=np.float32)
+        forward[:, 0], forward[:, 1] = 2, 1
+        forward[1, :, :, 9] = np.nan
+        backward = -forward
+
+        with tempfile.TemporaryDirectory() as folder:
+            self.write_cache(folder, forward, backward)
+            self.assertTrue(FlowCache.exists(folder))
+            pair = FlowCachePair(None, None, "test", FlowCache(folder), 0, 3)
+
+            pixels_xy = np.array([[1.0, 7.0], [2.0, 2.0]])
+            corr_xy, indices = pair.correspondences(pixels_xy)
+            np.testing.assert_array_equal(indices, [0])  # 7 reaches column 9 on the second step
+            np.testing.assert_allclose(corr_xy, [[7.0], [5.0]])
+
+            corr_xy, indices = pair.correspondences(np.array([[7.0], [5.0]]), inverse=True)
+            np.testing.assert_array_equal(indices, [0])
+            np.testing.assert_allclose(corr_xy, [[1.0], [2.0]])
+
+    def test_concurrent_builds(self):
+        # every DDP rank may build the same cache at once
+        random_state = np.random.RandomState(0)
+        images = [(random_state.rand(40, 40) * 255).astype(np.uint8) for _ in range(3)]
+        with tempfile.TemporaryDirectory() as folder:
+            processes = [multiprocessing.Process(target=build_flow_cache, args=(images, folder)) for _ in range(2)]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+            self.assertEqual([process.exitcode for process in processes], [0, 0])
+            self.assertEqual(sorted(os.listdir(folder)), ["backward_flow.npy", "forward_flow.npy", "stride.txt"])
+            positions_xy, tracked = FlowCache(folder).track(np.array([[20.0], [20.0]]), 0, 2)
+            self.assertEqual(positions_xy.shape, (2, 1))
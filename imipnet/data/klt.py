@@ -6,6 +6,7 @@ import numpy as np
 import scipy.spatial.distance
 import sklearn.neighbors
 
+from .flow_cache import FlowCache, FlowCachePair
 from .pairs import CorrespondencePair
 
 
@@ -292,10 +293,12 @@ class KLTPair(CorrespondencePair):
 class KLTPairGenerator:
 
     def __init__(self: 'KLTPairGenerator', name: str, images: Sequence[np.ndarray],
-                 tracker: Tracker, sequence_overlap: SequenceOverlap, minimum_overlap: float):
+                 tracker: Tracker, sequence_overlap: SequenceOverlap, minimum_overlap: float,
+                 flow_cache: Optional[FlowCache] = None):
         self.name = name
         self.img_sequence = images
         self._tracker = tracker
+        self._flow_cache = flow_cache  # tracks the pairs' correspondences in place of the tracker
         self._min_overlap = minimum_overlap
         self._overlapped_frames_cum_sum = []
 
@@ -308,6 +311,23 @@ class KLTPairGenerator:
     def __len__(self):
         return self._overlapped_frames_cum_sum[-1]
 
+    def overlapped_frame_counts(self) -> np.ndarray:
+        """
+        :return: for each first frame of a pair, how many of the following frames form a pair with it
+        """
+        return np.diff(self._overlapped_frames_cum_sum, prepend=0)
+
+    @property
+    def frames(self) -> Sequence[np.ndarray]:
+        return self.img_sequence
+
+    def make_pair(self, img_1_index: int, img_2_index: int, images: Sequence[np.ndarray]) -> CorrespondencePair:
+        # images are the frames from img_1_index to img_2_index inclusive
+        pair_name = "{0}: {1} {2}".format(self.name, img_1_index, img_2_index)
+        if self._flow_cache is not None:
+            return FlowCachePair(images[0], images[-1], pair_name, self._flow_cache, img_1_index, img_2_index)
+        return KLTPair(images, self._tracker, pair_name)
+
     def __getitem__(self, index: int) -> CorrespondencePair:
         if index > len(self):
             raise IndexError()
@@ -321,6 +341,4 @@ class KLTPairGenerator:
 
         img_sequence = self.img_sequence[img_1_index:img_2_index + 1]  # Add 1 since the end of a slice is exclusive
 
-        pair_name = "{0}: {1} {2}".format(self.name, img_1_index, img_2_index)
-
-        return KLTPair(img_sequence, self._tracker, pair_name)
+        return self.make_pair(img_1_index, img_2_index, img_sequence)
@@ -31,6 +31,15 @@ class ImagePair(ABC):
 
         return torch.stack(image_1_tensors), torch.stack(image_2_tensors), names
 
+    @staticmethod
+    def collate_for_torch_unstacked(pairs: List['ImagePair']):
+        # Images of differing sizes can't be stacked, so the images are returned as lists
+        image_1_tensors = [load_image_for_torch(pair.image_1) for pair in pairs]
+        image_2_tensors = [load_image_for_torch(pair.image_2) for pair in pairs]
+        names = [pair.name for pair in pairs]
+
+        return image_1_tensors, image_2_tensors, names
+
     @staticmethod
     def mean_std_dev_dataset(dataset: torch.utils.data.Dataset, batch_size: int = 1, device="cuda"):
         loader = torch.utils.data.DataLoader(
@@ -77,14 +86,48 @@ class CorrespondencePair(ImagePair, ABC):
     def correspondences(self, pixels_xy: np.ndarray, inverse: bool = False) -> Tuple[np.ndarray, np.ndarray]:
         raise NotImplementedError()
 
+    def correspondences_torch(self, pixels_xy: torch.Tensor, inverse: bool = False) \
+            -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        correspondences_torch is the tensor counterpart of correspondences. Rather than packing
+        the tracked correspondences, it returns a 2xN tensor of correspondences, zeroed where
+        there is no correspondence, and an N boolean mask of the tracked pixels, both on the
+        device of pixels_xy.
+
+        This fallback round-trips through the numpy correspondences. Pairs which can
+        find correspondences on the tensor's device should override it.
+        """
+        pixels_xy_np = pixels_xy.cpu().numpy()
+        packed_correspondences_xy, correspondences_indices = self.correspondences(pixels_xy_np, inverse=inverse)
+
+        unpacked_correspondences_xy = np.zeros(pixels_xy_np.shape, dtype=packed_correspondences_xy.dtype)
+        unpacked_correspondences_xy[:, correspondences_indices] = packed_correspondences_xy
+
+        correspondences_mask = np.zeros(pixels_xy_np.shape[1], dtype=np.bool)
+        correspondences_mask[correspondences_indices] = True
+
+        return (torch.tensor(unpacked_correspondences_xy, device=pixels_xy.device),
+                torch.tensor(correspondences_mask, device=pixels_xy.device))
+
     @staticmethod
     def collate_for_torch(pairs: List['CorrespondencePair']):
         image_1_tensors, image_2_tensors, names = ImagePair.collate_for_torch(pairs)
         # Batch up the correspondence functions for each pair, this likely closes over the
         # original numpy images
-        correspondence_funcs = [pair.correspondences for pair in pairs]
+        correspondence_funcs = [pair.correspondences_torch for pair in pairs]
         return image_1_tensors, image_2_tensors, names, correspondence_funcs
 
+    @staticmethod
+    def collate_for_torch_unstacked(pairs: List['CorrespondencePair']):
+        image_1_tensors, image_2_tensors, names = ImagePair.collate_for_torch_unstacked(pairs)
+        correspondence_funcs = [pair.correspondences_torch for pair in pairs]
+        # pairs with known epipolar geometry can be scored without the correspondence functions
+        f_mats_forward = [
+            torch.tensor(pair.f_matrix_forward, dtype=torch.float32) if isinstance(pair, FundamentalMatrixPair)
+            else None for pair in pairs
+        ]
+        return image_1_tensors, image_2_tensors, names, correspondence_funcs, f_mats_forward
+
     def draw_gridded_matches(self, steps_per_axis: int = 10) -> Tuple[np.ndarray, np.ndarray]:
         steps = np.linspace(0, 1, steps_per_axis)[:-1]
         steps_x_1 = self.image_1.shape[1] * steps
@@ -197,6 +240,10 @@ class CorrespondenceFundamentalMatrixPair(CorrespondencePair, FundamentalMatrixP
     def correspondences(self, pixels_xy: np.ndarray, inverse: bool = False) -> Tuple[np.ndarray, np.ndarray]:
         return self._corr_pair.correspondences(pixels_xy, inverse)
 
+    def correspondences_torch(self, pixels_xy: torch.Tensor, inverse: bool = False) \
+            -> Tuple[torch.Tensor, torch.Tensor]:
+        return self._corr_pair.correspondences_torch(pixels_xy, inverse)
+
     @property
     def f_matrix_forward(self) -> np.ndarray:
         return self._f_pair.f_matrix_forward
@@ -222,7 +269,7 @@ class CorrespondenceFundamentalMatrixPair(CorrespondencePair, FundamentalMatrixP
         image_1_tensors, image_2_tensors, names = ImagePair.collate_for_torch(pairs)
         # Batch up the correspondence functions for each pair, this likely closes over the
         # original numpy images
-        correspondence_funcs = [pair.correspondences for pair in pairs]
+        correspondence_funcs = [pair.correspondences_torch for pair in pairs]
 
         f_mats_forward = [torch.tensor(pair.f_matrix_forward, dtype=torch.float32) for pair in pairs]
         f_mats_backward = [torch.tensor(pair.f_matrix_backward, dtype=torch.float32) for pair in pairs]
@@ -0,0 +1,69 @@
+import unittest
+from typing import Tuple
+
+import numpy as np
+import torch
+
+from imipnet.data.aflow import AbsoluteFlowPair
+from imipnet.data.pairs import CorrespondencePair
+from imipnet.data.planar import HomographyPair
+
+
+class NumpyOnlyFlowPair(CorrespondencePair):
+    # exercises the numpy fallback of correspondences_torch, as used by KLTPair
+    def __init__(self, flow_pair: AbsoluteFlowPair):
+        self._flow_pair = flow_pair
+
+    def correspondences(self, pixels_xy: np.ndarray, inverse: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        return self._flow_pair.correspondences(pixels_xy, inverse)
+
+
+class TestTorchCorrespondences(unittest.TestCase):
+
+    def _random_pixels(self, shape: Tuple[int, int], n: int) -> np.ndarray:
+        pixels_xy = np.random.rand(2, n)
+        pixels_xy[0] *= shape[1] - 1
+        pixels_xy[1] *= shape[0] - 1
+        # include the far borders, which are rounded back into the image
+        pixels_xy[:, 0] = (shape[1] - 0.5, shape[0] - 0.5)
+        return pixels_xy.astype(np.float32)
+
+    def _random_flow_pair(self, shape: Tuple[int, int]) -> AbsoluteFlowPair:
+        image = np.zeros(shape, dtype=np.uint8)
+        forward_flow = (np.random.rand(2, *shape) * 100).astype(np.float32)
+        backward_flow = (np.random.rand(2, *shape) * 100).astype(np.float32)
+        forward_flow[:, np.random.rand(*shape) < 0.3] = float('nan')
+        backward_flow[:, np.random.rand(*shape) < 0.3] = float('nan')
+        return AbsoluteFlowPair(image, image, "random flow", forward_flow, backward_flow)
+
+    def _assert_matches_numpy(self, pair: CorrespondencePair, pixels_xy: np.ndarray, inverse: bool):
+        packed_xy, indices = pair.correspondences(pixels_xy.copy(), inverse=inverse)
+        unpacked_xy, mask = pair.correspondences_torch(torch.from_numpy(pixels_xy.copy()), inverse=inverse)
+
+        self.assertEqual(mask.dtype, torch.bool)
+        np.testing.assert_array_equal(np.nonzero(mask.numpy())[0], indices)
+        np.testing.assert_allclose(unpacked_xy.numpy()[:, mask.numpy()], packed_xy, rtol=1e-6)
+        np.testing.assert_array_equal(unpacked_xy.numpy()[:, ~mask.numpy()], 0)
+
+    def test_absolute_flow_matches_numpy(self):
+        shape = (37, 53)
+        pair = self._random_flow_pair(shape)
+        for inverse in (False, True):
+            self._assert_matches_numpy(pair, self._random_pixels(shape, 500), inverse)
+
+    def test_homography_matches_numpy(self):
+        image = np.zeros((40, 60), dtype=np.uint8)
+        homography = np.eye(3) + np.random.rand(3, 3) * np.array([[0.1, 0.1, 5], [0.1, 0.1, 5], [1e-4, 1e-4, 0]])
+        pair = HomographyPair(image, image, homography, "random homography")
+        for inverse in (False, True):
+            self._assert_matches_numpy(pair, self._random_pixels(image.shape, 500), inverse)
+
+    def test_numpy_fallback(self):
+        shape = (37, 53)
+        pair = NumpyOnlyFlowPair(self._random_flow_pair(shape))
+        for inverse in (False, True):
+            self._assert_matches_numpy(pair, self._random_pixels(shape, 500), inverse)
+
+
+if __name__ == '__main__':
+    unittest.main()
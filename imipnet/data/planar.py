@@ -1,6 +1,7 @@
 from typing import Tuple
 
 import numpy as np
+import torch
 
 from imipnet.data.pairs import CorrespondencePair
 
@@ -32,6 +33,22 @@ class HomographyPair(CorrespondencePair):
         tracked_indices = np.arange(pixels_xy.shape[1])
         return corr_pixels_xy, tracked_indices
 
+    def correspondences_torch(self, pixels_xy: torch.Tensor, inverse: bool = False) \
+            -> Tuple[torch.Tensor, torch.Tensor]:
+        # transform in double precision to match the numpy correspondences
+        tx_h = torch.from_numpy(self._H if not inverse else self._inv_H).to(
+            device=pixels_xy.device, dtype=torch.float64
+        )
+
+        homogeneous_tx_points = tx_h @ torch.cat((
+            pixels_xy.to(torch.float64),
+            torch.ones((1, pixels_xy.shape[1]), device=pixels_xy.device, dtype=torch.float64)
+        ), dim=0)
+
+        corr_pixels_xy = homogeneous_tx_points[0:2, :] / homogeneous_tx_points[2, :]
+        tracked_mask = torch.ones(pixels_xy.shape[1], device=pixels_xy.device, dtype=torch.bool)
+        return corr_pixels_xy, tracked_mask
+
     @property
     def image_1(self) -> np.ndarray:
         return self.__image_1
@@ -0,0 +1,137 @@
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+
+class PatchReplayBuffer:
+    """
+    PatchReplayBuffer is a bounded store of mined training images, each a tuple of
+    (maxima patches, correspondence patches, inlier labels, outlier labels), so several
+    gradient steps can be taken per mining pass. Patches are quantized to uint8 with a
+    per channel affine transform and labels are bit packed, so a large buffer fits in RAM.
+    Entries older than max_staleness training steps are never replayed.
+    When full, either the oldest entry ("fifo") or the entry with the lowest loss ("priority") is evicted.
+    """
+
+    evictions = ["fifo", "priority"]
+    _state_keys = ["valid", "steps", "priorities", "maxima_patches", "maxima_affines",
+                   "correspondence_patches", "correspondence_affines", "labels"]
+
+    def __init__(self, capacity: int, max_staleness: int, eviction: str = "fifo"):
+        if capacity < 1:
+            raise ValueError("capacity must be positive")
+        if eviction not in PatchReplayBuffer.evictions:
+            raise ValueError("eviction must be one of " + ", ".join(PatchReplayBuffer.evictions))
+
+        self._capacity = capacity
+        self._max_staleness = max_staleness
+        self._eviction = eviction
+
+        self._valid = np.zeros(capacity, dtype=bool)
+        self._steps = np.zeros(capacity, dtype=np.int64)
+        self._priorities = np.zeros(capacity, dtype=np.float32)
+
+        # patch and label storage is allocated on the first add, once the shapes are known
+        self._maxima_patches: Optional[np.ndarray] = None
+        self._maxima_affines: Optional[np.ndarray] = None
+        self._correspondence_patches: Optional[np.ndarray] = None
+        self._correspondence_affines: Optional[np.ndarray] = None
+        self._labels: Optional[np.ndarray] = None
+        self._n_labels = 0
+
+    def __len__(self):
+        return int(self._valid.sum())
+
+    @staticmethod
+    def _quantize(patches: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # NxDxPxP -> uint8 NxDxPxP and the 2xD (offset, scale) needed to restore it
+        channels_first = patches.transpose(1, 0, 2, 3).reshape(patches.shape[1], -1)
+        offset = channels_first.min(axis=1)
+        scale = (channels_first.max(axis=1) - offset) / 255
+        scale[scale == 0] = 1
+        quantized = np.clip(np.round((patches - offset[None, :, None, None]) / scale[None, :, None, None]), 0, 255)
+        return quantized.astype(np.uint8), np.stack((offset, scale)).astype(np.float32)
+
+    @staticmethod
+    def _dequantize(quantized: np.ndarray, affine: np.ndarray) -> np.ndarray:
+        return quantized.astype(np.float32) * affine[1, None, :, None, None] + affine[0, None, :, None, None]
+
+    def _allocate(self, maxima_patches: np.ndarray, correspondence_patches: np.ndarray, n_labels: int):
+        self._maxima_patches = np.zeros((self._capacity, *maxima_patches.shape), dtype=np.uint8)
+        self._maxima_affines = np.zeros((self._capacity, 2, maxima_patches.shape[1]), dtype=np.float32)
+        self._correspondence_patches = np.zeros((self._capacity, *correspondence_patches.shape), dtype=np.uint8)
+        self._correspondence_affines = np.zeros((self._capacity, 2, correspondence_patches.shape[1]),
+                                                dtype=np.float32)
+        self._labels = np.zeros((self._capacity, 2, (n_labels + 7) // 8), dtype=np.uint8)
+        self._n_labels = n_labels
+
+    def _evict_stale(self, step: int):
+        self._valid &= (step - self._steps) <= self._max_staleness
+
+    def add(self, maxima_patches: torch.Tensor, correspondence_patches: torch.Tensor,
+            inlier_labels: torch.Tensor, outlier_labels: torch.Tensor, step: int, priority: float) -> int:
+        maxima_patches = maxima_patches.detach().cpu().to(torch.float32).numpy()
+        correspondence_patches = correspondence_patches.detach().cpu().to(torch.float32).numpy()
+        labels = torch.stack((inlier_labels, outlier_labels)).cpu().to(torch.bool).numpy()
+
+        if self._maxima_patches is None:
+            self._allocate(maxima_patches, correspondence_patches, labels.shape[1])
+
+        self._evict_stale(step)
+        free_slots = np.flatnonzero(~self._valid)
+        if len(free_slots) > 0:
+            slot = free_slots[0]
+        elif self._eviction == "fifo":
+            slot = np.argmin(self._steps)
+        else:
+            slot = np.argmin(self._priorities)
+
+        self._maxima_patches[slot], self._maxima_affines[slot] = self._quantize(maxima_patches)
+        self._correspondence_patches[slot], self._correspondence_affines[slot] = self._quantize(
+            correspondence_patches
+        )
+        self._labels[slot] = np.packbits(labels, axis=1)
+        self._valid[slot] = True
+        self._steps[slot] = step
+        self._priorities[slot] = priority
+        return int(slot)
+
+    def sample(self, n: int, step: int, device: torch.device = torch.device("cpu")) \
+            -> List[Tuple[int, Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]]]:
+        """
+        :return: up to n distinct fresh entries as (slot, (maxima patches, correspondence patches,
+                 inlier labels, outlier labels)), where slot may be passed to update_priority
+        """
+        self._evict_stale(step)
+        valid_slots = np.flatnonzero(self._valid)
+        slots = np.random.choice(valid_slots, min(n, len(valid_slots)), replace=False)
+
+        samples = []
+        for slot in slots:
+            labels = np.unpackbits(self._labels[slot], axis=1, count=self._n_labels).astype(bool)
+            samples.append((int(slot), (
+                torch.from_numpy(self._dequantize(self._maxima_patches[slot], self._maxima_affines[slot])).to(device),
+                torch.from_numpy(self._dequantize(self._correspondence_patches[slot],
+                                                  self._correspondence_affines[slot])).to(device),
+                torch.from_numpy(labels[0]).to(device),
+                torch.from_numpy(labels[1]).to(device),
+            )))
+        return samples
+
+    def update_priority(self, slot: int, priority: float):
+        self._priorities[slot] = priority
+
+    def state_dict(self) -> Dict:
+        # copies, since the buffer is updated in place while a checkpoint may still be writing
+        state = {key: getattr(self, "_" + key) for key in self._state_keys}
+        state = {key: None if value is None else np.copy(value) for key, value in state.items()}
+        state["n_labels"] = self._n_labels
+        return state
+
+    def load_state_dict(self, state: Dict):
+        if len(state["valid"]) != self._capacity:
+            raise ValueError("the saved buffer holds {} entries, not {}".format(len(state["valid"]), self._capacity))
+        for key in self._state_keys:
+            setattr(self, "_" + key, None if state[key] is None else np.copy(state[key]))
+        self._n_labels = state["n_labels"]
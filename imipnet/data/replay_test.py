@@ -0,0 +1,77 @@
+import unittest
+
+import torch
+
+from imipnet.data.replay import PatchReplayBuffer
+
+
+class TestPatchReplayBuffer(unittest.TestCase):
+
+    @staticmethod
+    def _random_entry(channels: int = 12, k: int = 3):
+        maxima_patches = torch.randn(channels * k, 2, 5, 5)
+        correspondence_patches = torch.randn(channels, 2, 5, 5) * 10
+        inlier_labels = torch.rand(channels) < 0.5
+        outlier_labels = ~inlier_labels & (torch.rand(channels) < 0.5)
+        return maxima_patches, correspondence_patches, inlier_labels, outlier_labels
+
+    def test_round_trip(self):
+        buffer = PatchReplayBuffer(4, max_staleness=10)
+        entry = self._random_entry()
+        buffer.add(*entry, step=0, priority=1.0)
+
+        [(_, sample)] = buffer.sample(4, step=0)
+        for original, restored in zip(entry[:2], sample[:2]):
+            self.assertEqual(original.shape, restored.shape)
+            # within half of a quantization step of each channel's range
+            channel_range = original.transpose(0, 1).reshape(original.shape[1], -1)
+            step = (channel_range.max(dim=1).values - channel_range.min(dim=1).values) / 255
+            error = (original - restored).abs().transpose(0, 1).reshape(original.shape[1], -1).max(dim=1).values
+            self.assertTrue((error <= step / 2 + 1e-5).all())
+        self.assertTrue(torch.equal(entry[2], sample[2]))
+        self.assertTrue(torch.equal(entry[3], sample[3]))
+
+    def test_staleness(self):
+        buffer = PatchReplayBuffer(4, max_staleness=2)
+        buffer.add(*self._random_entry(), step=0, priority=1.0)
+        self.assertEqual(len(buffer.sample(4, step=2)), 1)
+        self.assertEqual(len(buffer.sample(4, step=3)), 0)
+        self.assertEqual(len(buffer), 0)
+
+    def test_fifo_eviction(self):
+        buffer = PatchReplayBuffer(2, max_staleness=10, eviction="fifo")
+        first = buffer.add(*self._random_entry(), step=0, priority=10.0)
+        buffer.add(*self._random_entry(), step=1, priority=1.0)
+        self.assertEqual(buffer.add(*self._random_entry(), step=2, priority=1.0), first)
+        self.assertEqual(len(buffer), 2)
+
+    def test_priority_eviction(self):
+        buffer = PatchReplayBuffer(2, max_staleness=10, eviction="priority")
+        buffer.add(*self._random_entry(), step=0, priority=10.0)
+        easiest = buffer.add(*self._random_entry(), step=1, priority=1.0)
+        self.assertEqual(buffer.add(*self._random_entry(), step=2, priority=5.0), easiest)
+
+        buffer.update_priority(easiest, 100.0)
+        self.assertNotEqual(buffer.add(*self._random_entry(), step=3, priority=5.0), easiest)
+
+    def test_state_dict_round_trip(self):
+        buffer = PatchReplayBuffer(4, max_staleness=10)
+        entry = self._random_entry()
+        slot = buffer.add(*entry, step=3, priority=2.0)
+        state = buffer.state_dict()
+        buffer.add(*self._random_entry(), step=4, priority=1.0)  # the state is a copy
+
+        restored = PatchReplayBuffer(4, max_staleness=10)
+        restored.load_state_dict(state)
+        self.assertEqual(len(restored), 1)
+        [(restored_slot, sample)] = restored.sample(4, step=5)
+        self.assertEqual(restored_slot, slot)
+        self.assertTrue(torch.equal(entry[2], sample[2]))
+        self.assertTrue(torch.equal(entry[3], sample[3]))
+
+        with self.assertRaises(ValueError):
+            PatchReplayBuffer(8, max_staleness=10).load_state_dict(state)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+from typing import Tuple
+
+import torch
+import torch.nn.functional
+
+
+def rescale_image(image: torch.Tensor, scale: float) -> Tuple[torch.Tensor, Tuple[float, float]]:
+    """
+    Resizes a CxHxW image by scale, averaging over the covered area when downscaling.
+    :return: the resized image and its exact (x, y) scale after rounding to whole pixels
+    """
+    height, width = image.shape[1:]
+    scaled_height, scaled_width = max(1, round(height * scale)), max(1, round(width * scale))
+    if (scaled_height, scaled_width) == (height, width):
+        return image, (1.0, 1.0)
+    mode = "area" if scale < 1 else "bilinear"
+    align_corners = None if mode == "area" else False
+    scaled_image = torch.nn.functional.interpolate(
+        image.unsqueeze(0), size=(scaled_height, scaled_width), mode=mode, align_corners=align_corners
+    ).squeeze(0)
+    return scaled_image, (scaled_width / width, scaled_height / height)
+
+
+class ScaledCorrespondences:
+    """
+    ScaledCorrespondences wraps a CorrespondencePair.correspondences_torch function so it
+    can be queried with pixels of, and returns correspondences in, the rescaled images.
+    Pixel centers are mapped onto pixel centers, matching rescale_image.
+    """
+
+    def __init__(self, correspondence_func, image_1_scale_xy: Tuple[float, float],
+                 image_2_scale_xy: Tuple[float, float]):
+        self._correspondence_func = correspondence_func
+        self._image_1_scale_xy = image_1_scale_xy
+        self._image_2_scale_xy = image_2_scale_xy
+
+    def __call__(self, pixels_xy: torch.Tensor, inverse: bool = False) -> Tuple[torch.Tensor, torch.Tensor]:
+        source_scale_xy, target_scale_xy = self._image_1_scale_xy, self._image_2_scale_xy
+        if inverse:
+            source_scale_xy, target_scale_xy = target_scale_xy, source_scale_xy
+        source_scale_xy = torch.tensor(source_scale_xy, dtype=pixels_xy.dtype, device=pixels_xy.device)
+        target_scale_xy = torch.tensor(target_scale_xy, dtype=pixels_xy.dtype, device=pixels_xy.device)
+
+        full_pixels_xy = (pixels_xy + 0.5) / source_scale_xy[:, None] - 0.5
+        full_correspondences_xy, correspondences_mask = self._correspondence_func(full_pixels_xy, inverse=inverse)
+
+        target_scale_xy = target_scale_xy.to(full_correspondences_xy.dtype)
+        correspondences_xy = (full_correspondences_xy + 0.5) * target_scale_xy[:, None] - 0.5
+        # keep the missing correspondences zeroed
+        correspondences_xy[:, ~correspondences_mask] = 0
+        return correspondences_xy, correspondences_mask
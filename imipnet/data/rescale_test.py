@@ -0,0 +1,41 @@
+import unittest
+
+import numpy as np
+import torch
+
+from imipnet.data.planar import HomographyPair
+from imipnet.data.rescale import rescale_image, ScaledCorrespondences
+
+
+class TestRescale(unittest.TestCase):
+
+    def test_rescale_image_scale(self):
+        image = torch.rand(1, 48, 64)
+        scaled_image, scale_xy = rescale_image(image, 0.5)
+        self.assertEqual(scaled_image.shape, (1, 24, 32))
+        self.assertEqual(scale_xy, (0.5, 0.5))
+
+        same_image, scale_xy = rescale_image(image, 1.0)
+        self.assertIs(same_image, image)
+        self.assertEqual(scale_xy, (1.0, 1.0))
+
+    def test_scaled_correspondences_match_full_scale(self):
+        image = np.random.rand(48, 64).astype(np.float32)
+        homography = np.array([
+            [1.0, 0.05, 3.0],
+            [-0.02, 1.1, -2.0],
+            [0.0, 0.0, 1.0],
+        ])
+        pair = HomographyPair(image, image, homography, "test")
+        scale_xy = (0.5, 0.5)
+        scaled_correspondences = ScaledCorrespondences(pair.correspondences_torch, scale_xy, scale_xy)
+
+        full_pixels_xy = torch.tensor([[10.5, 20.5, 30.5], [8.5, 12.5, 20.5]], dtype=torch.float64)
+        scaled_pixels_xy = (full_pixels_xy + 0.5) * 0.5 - 0.5
+        for inverse in (False, True):
+            full_xy, full_mask = pair.correspondences_torch(full_pixels_xy, inverse=inverse)
+            scaled_xy, scaled_mask = scaled_correspondences(scaled_pixels_xy, inverse=inverse)
+            self.assertTrue(torch.equal(full_mask, scaled_mask))
+            expected_xy = (full_xy + 0.5) * 0.5 - 0.5
+            self.assertTrue(torch.allclose(scaled_xy[:, scaled_mask], expected_xy[:, full_mask]))
+            self.assertTrue((scaled_xy[:, ~scaled_mask] == 0).all())
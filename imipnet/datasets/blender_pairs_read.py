@@ -18,6 +18,8 @@ from typing import IO, List, Tuple
 import OpenEXR as exr
 import numpy as np
 
+from imipnet import timing
+
 # BlenderImage represents a loaded half of a stereo pair
 BlenderImage = collections.namedtuple("BlenderImage", [
     "image",  # numpy uint8 bgr image
@@ -77,11 +79,14 @@ class PairIndex:
 
         name_2 = "%s:%04d" % (self.camera_2, self.frame_2)
 
+        # the image and depth map are decoded together from one EXR file
         exr_path_1 = os.path.join(data_root, "EXR", self.camera_1, "%04d.exr" % self.frame_1)
-        img_1, depth_1 = read_exr_image(exr_path_1)
+        with timing.stage("data/exr_read"):
+            img_1, depth_1 = read_exr_image(exr_path_1)
 
         exr_path_2 = os.path.join(data_root, "EXR", self.camera_2, "%04d.exr" % self.frame_2)
-        img_2, depth_2 = read_exr_image(exr_path_2)
+        with timing.stage("data/exr_read"):
+            img_2, depth_2 = read_exr_image(exr_path_2)
 
         intrinsics_path_1 = os.path.join(data_root, "K", self.camera_1 + ".txt")
         K_1 = np.loadtxt(intrinsics_path_1)
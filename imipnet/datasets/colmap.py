@@ -8,6 +8,7 @@ import numpy as np
 import torch.utils.data
 
 from . import colmap_read
+from .. import timing
 from ..data import pairs, aflow, calibrated
 
 
@@ -81,7 +82,8 @@ class COLMAPStereoPairs(torch.utils.data.Dataset):
 
         # load image 1 depth map
         image_1_depth_map_path = os.path.join(self._depth_maps_folder, image_1_data.name + ".geometric.bin")
-        image_1_depth_map = colmap_read.read_depth_map(image_1_depth_map_path)
+        with timing.stage("data/depth_read"):
+            image_1_depth_map = colmap_read.read_depth_map(image_1_depth_map_path)
         image_1_depth_map[image_1_depth_map == 0] = float('nan')  # convert missing marker to NaN
 
         # load image 2 calibration
@@ -94,23 +96,26 @@ class COLMAPStereoPairs(torch.utils.data.Dataset):
 
         # load image 2 depth map
         image_2_depth_map_path = os.path.join(self._depth_maps_folder, image_2_data.name + ".geometric.bin")
-        image_2_depth_map = colmap_read.read_depth_map(image_2_depth_map_path)
+        with timing.stage("data/depth_read"):
+            image_2_depth_map = colmap_read.read_depth_map(image_2_depth_map_path)
         image_2_depth_map[image_2_depth_map == 0] = float('nan')
 
         # load the actual images
-        image_1 = cv2.imread(
-            os.path.join(self._images_folder, image_1_data.name),
-            cv2.IMREAD_COLOR if self._color else cv2.IMREAD_GRAYSCALE
-        )
-
-        image_2 = cv2.imread(
-            os.path.join(self._images_folder, image_2_data.name),
-            cv2.IMREAD_COLOR if self._color else cv2.IMREAD_GRAYSCALE
-        )
+        with timing.stage("data/image_decode"):
+            image_1 = cv2.imread(
+                os.path.join(self._images_folder, image_1_data.name),
+                cv2.IMREAD_COLOR if self._color else cv2.IMREAD_GRAYSCALE
+            )
+            if self._color:
+                image_1 = cv2.cvtColor(image_1, cv2.COLOR_BGR2RGB)
 
-        if self._color:
-            image_1 = cv2.cvtColor(image_1, cv2.COLOR_BGR2RGB)
-            image_2 = cv2.cvtColor(image_2, cv2.COLOR_BGR2RGB)
+        with timing.stage("data/image_decode"):
+            image_2 = cv2.imread(
+                os.path.join(self._images_folder, image_2_data.name),
+                cv2.IMREAD_COLOR if self._color else cv2.IMREAD_GRAYSCALE
+            )
+            if self._color:
+                image_2 = cv2.cvtColor(image_2, cv2.COLOR_BGR2RGB)
 
         # give the current pair a name
         pair_name = "COLMAP {0}: {1} {2}".format(self._colmap_project, image_1_data.name, image_2_data.name)
@@ -2,13 +2,13 @@ import bisect
 import os
 import pickle
 import shutil
-from typing import Optional, Dict, Tuple
+from typing import Optional, Dict, List, Sequence, Tuple
 
 import numpy as np
 import torch.utils.data
 import torchvision.datasets.utils as tv_data
 
-from imipnet.data import pairs, klt, calibrated
+from imipnet.data import pairs, klt, calibrated, flow_cache
 from imipnet.datasets import sequence
 
 
@@ -61,7 +61,8 @@ class KITTIMonocularStereoPairsSequence(torch.utils.data.Dataset):
                  download: Optional[bool] = True,
                  color: Optional[bool] = True,
                  minimum_KLT_overlap: Optional[float] = 0.3,
-                 f_matrix_algorithm: Optional[int] = None) -> None:
+                 f_matrix_algorithm: Optional[int] = None,
+                 use_flow_cache: Optional[bool] = False) -> None:
         self._root_folder = os.path.abspath(root)
         self._sequence = kitti_sequence
         self._color = color
@@ -101,6 +102,18 @@ class KITTIMonocularStereoPairsSequence(torch.utils.data.Dataset):
             overlapped_frames = seq_overlap.find_frames_with_overlap(i, minimum_KLT_overlap).size
             self._overlapped_frames_cum_sum.append(overlapped_frames + self._overlapped_frames_cum_sum[-1])
 
+        # with the flow cache, correspondences are composed from the adjacent frames' stored flow
+        self._flow_cache = None
+        if use_flow_cache:
+            flow_cache_path = os.path.join(self._processed_sequence_folder, "flow_cache")
+            if not flow_cache.FlowCache.exists(flow_cache_path):
+                print("Generating flow cache for KITTI sequence: {0}".format(kitti_sequence))
+                flow_cache.build_flow_cache(self._image_sequence, flow_cache_path)
+                print("Created flow cache for KITTI sequence {0} with {1} frames".format(
+                    kitti_sequence, len(self._image_sequence)
+                ))
+            self._flow_cache = flow_cache.FlowCache(flow_cache_path)
+
         if f_matrix_algorithm is None:
             f_matrix_algorithm = calibrated.PINV_F_MAT_ALGORITHM
 
@@ -123,9 +136,28 @@ class KITTIMonocularStereoPairsSequence(torch.utils.data.Dataset):
             img_2_index = 1 + index
 
         img_sequence = self._image_sequence[img_1_index:img_2_index + 1]  # Add 1 since the end of a slice is exclusive
+        return self.make_pair(img_1_index, img_2_index, img_sequence)
+
+    def overlapped_frame_counts(self) -> np.ndarray:
+        """
+        :return: for each first frame of a pair, how many of the following frames form a pair with it
+        """
+        return np.diff(self._overlapped_frames_cum_sum, prepend=0)
+
+    @property
+    def frames(self) -> sequence.ImageSequence:
+        return self._image_sequence
+
+    def make_pair(self, img_1_index: int, img_2_index: int,
+                  images: Sequence[np.ndarray]) -> pairs.CorrespondenceFundamentalMatrixPair:
+        # images are the frames from img_1_index to img_2_index inclusive
         pair_name = "KITTI ODOM {0}: {1} {2}".format(self._sequence, img_1_index, img_2_index)
 
-        klt_pair = klt.KLTPair(img_sequence, self._tracker, pair_name)
+        if self._flow_cache is not None:
+            klt_pair = flow_cache.FlowCachePair(images[0], images[-1], pair_name, self._flow_cache,
+                                                img_1_index, img_2_index)
+        else:
+            klt_pair = klt.KLTPair(images, self._tracker, pair_name)
 
         intrinsic_mat = self._intrinsic_matrix
         img_1_pose_mat = self._pose_matrices[img_1_index]
@@ -282,7 +314,8 @@ class KITTIMonocularStereoPairs(torch.utils.data.Dataset):
                  download: Optional[bool] = True,
                  color: Optional[bool] = True,
                  minimum_KLT_overlap: Optional[float] = 0.3,
-                 f_matrix_algorithm: Optional[int] = None) -> None:
+                 f_matrix_algorithm: Optional[int] = None,
+                 use_flow_cache: Optional[bool] = False) -> None:
         if split == "train" or split is None:
             split_sequences = KITTIMonocularStereoPairs.train_sequences
         elif split == "validation":
@@ -299,7 +332,8 @@ class KITTIMonocularStereoPairs(torch.utils.data.Dataset):
             download,
             color,
             minimum_KLT_overlap,
-            f_matrix_algorithm
+            f_matrix_algorithm,
+            use_flow_cache
         ) for seq in split_sequences]
 
         self._proxy = torch.utils.data.ConcatDataset(sequences)
@@ -307,5 +341,11 @@ class KITTIMonocularStereoPairs(torch.utils.data.Dataset):
     def __len__(self) -> int:
         return len(self._proxy)
 
+    def sequence_lengths(self) -> List[int]:
+        return [len(sequence_pairs) for sequence_pairs in self._proxy.datasets]
+
+    def sequences(self) -> List[KITTIMonocularStereoPairsSequence]:
+        return list(self._proxy.datasets)
+
     def __getitem__(self, index: int) -> pairs.CorrespondenceFundamentalMatrixPair:
         return self._proxy[index]
@@ -0,0 +1,35 @@
+from typing import List, Tuple
+
+import torch
+import torch.utils.data
+
+from imipnet.data.image import load_image_for_torch
+from imipnet.data.pairs import CorrespondencePair
+
+
+class MinedPairDataset(torch.utils.data.Dataset):
+    """
+    MinedPairDataset mines the labelled patch batches of each CorrespondencePair
+    in its dataset, so the mining happens in the DataLoader workers. The miner
+    is an imipnet.lightning_module.PatchMiner whose network should be kept in
+    shared memory for the workers to see its updates.
+    """
+
+    def __init__(self, dataset: torch.utils.data.Dataset, miner):
+        self._dataset = dataset
+        self._miner = miner
+
+    def __len__(self):
+        return len(self._dataset)
+
+    def __getitem__(self, index):
+        pair: CorrespondencePair = self._dataset[index]
+        with torch.no_grad():
+            img_1_mined, img_2_mined, inliers_outliers_logs = self._miner.mine_training_pair(
+                load_image_for_torch(pair.image_1), load_image_for_torch(pair.image_2), pair.correspondences_torch
+            )
+        return tuple(img_1_mined), tuple(img_2_mined), inliers_outliers_logs, pair.name
+
+    @staticmethod
+    def collate(mined_pairs: List[tuple]) -> Tuple[List[tuple], List[str]]:
+        return [mined_pair[:3] for mined_pair in mined_pairs], [mined_pair[3] for mined_pair in mined_pairs]
@@ -0,0 +1,113 @@
+import collections
+import multiprocessing
+import queue
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+import torch.utils.data
+
+from imipnet import timing
+from .source import dataset_source
+
+# log spaced histogram bin edges in milliseconds, from 10us to 100s
+histogram_bin_edges_ms = np.logspace(-2, 5, 29)
+
+
+class ProfiledDataset(torch.utils.data.Dataset):
+    """
+    ProfiledDataset turns stage timing on in whichever process loads its samples, usually a
+    DataLoader worker, and reports the "data/..." stages of each sample's load, such as image
+    decode, depth map reading, flow construction and fundamental matrix construction, along with
+    the whole load as "data/getitem", through a queue which the main process drains with drain().
+    Samples are reported with the class name of the dataset that served them.
+    """
+
+    def __init__(self, dataset: torch.utils.data.Dataset):
+        self._dataset = dataset
+        self._stage_samples = multiprocessing.Queue()
+
+    def __len__(self):
+        return len(self._dataset)
+
+    def __getitem__(self, index):
+        if not timing.is_enabled():
+            timing.enable()
+        timing.samples(clear=True)  # drop stages timed outside of this load
+
+        start = time.perf_counter()
+        sample = self._dataset[index]
+        getitem_seconds = time.perf_counter() - start
+
+        stage_samples = {name: samples for name, samples in timing.samples(clear=True).items()
+                         if name.startswith("data/")}
+        stage_samples["data/getitem"] = [getitem_seconds]
+        self._stage_samples.put((type(dataset_source(self._dataset, index)[0]).__name__, stage_samples))
+        return sample
+
+    def drain(self) -> List[Tuple[str, Dict[str, List[float]]]]:
+        """
+        :return: the (source name, {stage: seconds}) of every sample loaded since the last drain
+        """
+        stage_samples = []
+        while True:
+            try:
+                stage_samples.append(self._stage_samples.get_nowait())
+            except queue.Empty:
+                return stage_samples
+
+
+def aggregate_stage_samples(stage_samples: List[Tuple[str, Dict[str, List[float]]]]) \
+        -> Dict[str, Dict[str, np.ndarray]]:
+    """
+    :return: for each source, the seconds of every sample of each of its stages
+    """
+    aggregated = collections.defaultdict(lambda: collections.defaultdict(list))
+    for source, sample_stages in stage_samples:
+        for name, samples in sample_stages.items():
+            aggregated[source][name].extend(samples)
+    return {
+        source: {name: np.array(samples) for name, samples in stages.items()}
+        for source, stages in aggregated.items()
+    }
+
+
+def stage_histograms(aggregated: Dict[str, Dict[str, np.ndarray]]) -> Dict[str, Dict[str, Dict[str, List]]]:
+    """
+    :return: for each source and stage, the sample counts in each bin of histogram_bin_edges_ms
+             and the 50th, 90th and 99th percentile milliseconds, in a JSON serializable form
+    """
+    histograms = {}
+    for source, stages in aggregated.items():
+        histograms[source] = {}
+        for name, seconds in stages.items():
+            milliseconds = 1000 * seconds
+            counts, _ = np.histogram(np.clip(
+                milliseconds, histogram_bin_edges_ms[0], histogram_bin_edges_ms[-1]
+            ), histogram_bin_edges_ms)
+            histograms[source][name] = {
+                "counts": counts.tolist(),
+                "bin_edges_ms": histogram_bin_edges_ms.tolist(),
+                "percentiles_ms": np.percentile(milliseconds, [50, 90, 99]).tolist(),
+                "total_ms": float(milliseconds.sum()),
+            }
+    return histograms
+
+
+def format_stage_histograms(histograms: Dict[str, Dict[str, Dict[str, List]]], width: int = 40) -> str:
+    lines = []
+    for source, stages in sorted(histograms.items()):
+        lines.append(source)
+        getitem_ms = stages["data/getitem"]["total_ms"] if "data/getitem" in stages else 0
+        for name, histogram in sorted(stages.items(), key=lambda item: -item[1]["total_ms"]):
+            p50, p90, p99 = histogram["percentiles_ms"]
+            lines.append("  {0}: {1} samples, p50 {2:.2f} ms, p90 {3:.2f} ms, p99 {4:.2f} ms, {5:.0%} of load".format(
+                name, sum(histogram["counts"]), p50, p90, p99, histogram["total_ms"] / max(getitem_ms, 1e-9)
+            ))
+            counts, bin_edges = histogram["counts"], histogram["bin_edges_ms"]
+            nonzero = [i for i, count in enumerate(counts) if count > 0]
+            for i in range(nonzero[0], nonzero[-1] + 1):
+                lines.append("    {0:>10.3f} ms {1:<{2}} {3}".format(
+                    bin_edges[i], "#" * int(round(width * counts[i] / max(counts))), width, counts[i]
+                ))
+    return "\n".join(lines)
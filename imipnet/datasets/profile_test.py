@@ -0,0 +1,34 @@
+import unittest
+
+import torch.utils.data
+
+from imipnet import timing
+from imipnet.datasets.profile import ProfiledDataset, aggregate_stage_samples, stage_histograms
+from imipnet.datasets.shard_test import RangeDataset
+
+
+class DecodingRangeDataset(RangeDataset):
+    def __getitem__(self, index):
+        with timing.stage("data/image_decode"):
+            return super().__getitem__(index)
+
+
+class TestProfiledDataset(unittest.TestCase):
+
+    def tearDown(self):
+        timing.disable()
+        timing.samples(clear=True)
+
+    def test_stages_reported_per_source(self):
+        dataset = ProfiledDataset(torch.utils.data.ConcatDataset([DecodingRangeDataset(0, 3), RangeDataset(3, 5)]))
+        self.assertEqual([dataset[i] for i in range(len(dataset))], list(range(5)))
+
+        aggregated = aggregate_stage_samples(dataset.drain())
+        self.assertEqual(set(aggregated.keys()), {"DecodingRangeDataset", "RangeDataset"})
+        self.assertEqual(len(aggregated["DecodingRangeDataset"]["data/image_decode"]), 3)
+        self.assertEqual(len(aggregated["DecodingRangeDataset"]["data/getitem"]), 3)
+        self.assertEqual(set(aggregated["RangeDataset"].keys()), {"data/getitem"})
+
+        histograms = stage_histograms(aggregated)
+        self.assertEqual(sum(histograms["RangeDataset"]["data/getitem"]["counts"]), 2)
+        self.assertEqual(dataset.drain(), [])
@@ -0,0 +1,149 @@
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+import torch.utils.data
+
+from .shard import ShardedDataset
+from .shuffle import ShuffledDataset
+
+
+class ResumableRandomSampler(torch.utils.data.Sampler):
+    """
+    ResumableRandomSampler draws a random permutation of the dataset each epoch from its seed and
+    the epoch number, so an epoch's order can be recreated, and can start an epoch part way through.
+    With num_replicas > 1 each rank takes a strided share of the permutation, padded like
+    DistributedSampler so every rank yields the same number of samples. If epoch_length is given,
+    each rank's epoch is cut to at most that many samples.
+    The sampler can't see how far the DataLoader's workers have prefetched, so callers pass the
+    number of samples actually consumed from the current epoch to state_dict.
+    """
+
+    def __init__(self, num_samples: int, seed: int, num_replicas: int = 1, rank: int = 0,
+                 epoch_length: Optional[int] = None):
+        if not 0 <= rank < num_replicas:
+            raise ValueError("rank must be in [0, num_replicas)")
+        self._num_samples = num_samples
+        self._seed = seed
+        self._num_replicas = num_replicas
+        self._rank = rank
+        self._epoch_length = epoch_length
+
+        self._epoch = 0  # the epoch the next iteration draws
+        self._start = 0  # the position the next iteration starts at
+        self._iteration_epoch = 0
+        self._iteration_start = 0
+
+    def __len__(self) -> int:
+        # always the full epoch, a resumed epoch just ends early
+        replica_samples = (self._num_samples + self._num_replicas - 1) // self._num_replicas
+        if self._epoch_length is not None:
+            return min(replica_samples, self._epoch_length)
+        return replica_samples
+
+    def permutation(self, random_state: np.random.RandomState) -> np.ndarray:
+        return random_state.permutation(self._num_samples)
+
+    def epoch_indices(self, epoch: int) -> np.ndarray:
+        indices = self.permutation(np.random.RandomState((self._seed, epoch)))
+        replica_samples = (self._num_samples + self._num_replicas - 1) // self._num_replicas
+        padding = replica_samples * self._num_replicas - self._num_samples
+        indices = np.concatenate((indices, indices[:padding]))
+        return indices[self._rank::self._num_replicas][:len(self)]
+
+    def __iter__(self) -> Iterator[int]:
+        self._iteration_epoch, self._iteration_start = self._epoch, self._start
+        self._epoch, self._start = self._epoch + 1, 0
+        return iter(self.epoch_indices(self._iteration_epoch)[self._iteration_start:].tolist())
+
+    def state_dict(self, consumed: int) -> Dict[str, int]:
+        """
+        :param consumed: the samples consumed from the current iteration
+        :return: the state to resume after those samples from
+        """
+        start = self._iteration_start + consumed
+        if start >= len(self):
+            return {"epoch": self._iteration_epoch + 1, "start": 0}
+        return {"epoch": self._iteration_epoch, "start": start}
+
+    def load_state_dict(self, state: Dict[str, int]):
+        # takes effect on the next iteration
+        self._epoch, self._start = state["epoch"], state["start"]
+
+
+class BlockShuffleSampler(ResumableRandomSampler):
+    """
+    BlockShuffleSampler cuts each sequence of the dataset into blocks of block_size consecutive
+    indices, shuffles the order of the blocks and the order within each block, so the samples
+    drawn one after another come from one sequence and a window of its frames. Neighbouring KLT
+    pairs share most of their frames, so their files stay in the page cache and their decoded
+    frames can be reused, see sequence.set_frame_cache_size. Each epoch still covers every sample.
+    Replicas take strided shares as in ResumableRandomSampler, so each rank's share of a block stays together.
+    """
+
+    def __init__(self, sequence_lengths: Sequence[int], block_size: int, seed: int, num_replicas: int = 1,
+                 rank: int = 0, epoch_length: Optional[int] = None):
+        if block_size < 1:
+            raise ValueError("block_size must be positive")
+        super().__init__(sum(sequence_lengths), seed, num_replicas, rank, epoch_length)
+
+        # the block of every index, blocks never straddle two sequences
+        block_ids, num_blocks = [], 0
+        for length in sequence_lengths:
+            block_ids.append(num_blocks + np.arange(length) // block_size)
+            num_blocks += (length + block_size - 1) // block_size
+        self._block_ids = np.concatenate(block_ids) if len(block_ids) > 0 else np.zeros(0, dtype=int)
+        self._num_blocks = num_blocks
+
+    def permutation(self, random_state: np.random.RandomState) -> np.ndarray:
+        block_order = random_state.permutation(self._num_blocks)
+        within_block_order = random_state.random_sample(self._num_samples)
+        # sorts by the shuffled block order, then randomly within each block
+        return np.lexsort((within_block_order, block_order[self._block_ids]))
+
+
+def sequence_lengths(dataset: torch.utils.data.Dataset) -> List[int]:
+    """
+    :return: the lengths of the runs of consecutive indices of dataset that come from one sequence,
+             through ConcatDatasets, datasets with a sequence_lengths method and wrappers which keep
+             theirs in _dataset. ShuffledDatasets and ShardedDatasets reorder theirs, so are one run
+    """
+    if isinstance(dataset, torch.utils.data.ConcatDataset):
+        return [length for wrapped in dataset.datasets for length in sequence_lengths(wrapped)]
+    if hasattr(dataset, "sequence_lengths"):
+        return list(dataset.sequence_lengths())
+    if not isinstance(dataset, (ShuffledDataset, ShardedDataset)) and hasattr(dataset, "_dataset") \
+            and len(dataset._dataset) == len(dataset):
+        return sequence_lengths(dataset._dataset)
+    return [len(dataset)]
+
+
+def shuffled_datasets(dataset: torch.utils.data.Dataset) -> List[ShuffledDataset]:
+    """
+    :return: every ShuffledDataset in dataset, through wrappers which keep theirs in _dataset
+             and ConcatDatasets, in a deterministic order
+    """
+    found = []
+    pending = [dataset]
+    while len(pending) > 0:
+        dataset = pending.pop(0)
+        if isinstance(dataset, ShuffledDataset):
+            found.append(dataset)
+        if isinstance(dataset, torch.utils.data.ConcatDataset):
+            pending.extend(dataset.datasets)
+        elif hasattr(dataset, "_dataset"):
+            pending.append(dataset._dataset)
+    return found
+
+
+def dataset_permutations(dataset: torch.utils.data.Dataset) -> List[np.ndarray]:
+    return [np.array(shuffled._index_order) for shuffled in shuffled_datasets(dataset)]
+
+
+def load_dataset_permutations(dataset: torch.utils.data.Dataset, permutations: List[np.ndarray]):
+    shuffled = shuffled_datasets(dataset)
+    if len(shuffled) != len(permutations):
+        raise ValueError("expected {} permutations, got {}".format(len(shuffled), len(permutations)))
+    for shuffled_dataset, permutation in zip(shuffled, permutations):
+        if np.max(permutation, initial=-1) >= len(shuffled_dataset._dataset):
+            raise ValueError("a permutation indexes past the end of its dataset, was it built from other data?")
+        shuffled_dataset._index_order = np.array(permutation)
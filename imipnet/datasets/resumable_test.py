@@ -0,0 +1,93 @@
+import unittest
+
+import numpy as np
+import torch.utils.data
+
+from imipnet.datasets.resumable import BlockShuffleSampler, ResumableRandomSampler, dataset_permutations, \
+    load_dataset_permutations, sequence_lengths
+from imipnet.datasets.shard_test import RangeDataset
+from imipnet.datasets.shuffle import ShuffledDataset
+
+
+class TestResumableRandomSampler(unittest.TestCase):
+
+    def test_resumes_mid_epoch(self):
+        sampler = ResumableRandomSampler(20, seed=3)
+        first_epoch, second_epoch = list(sampler), list(sampler)
+        self.assertEqual(sorted(first_epoch), list(range(20)))
+        self.assertNotEqual(first_epoch, second_epoch)
+
+        resumed = ResumableRandomSampler(20, seed=3)
+        list(resumed)
+        iterator = iter(resumed)
+        [next(iterator) for _ in range(7)]
+        state = resumed.state_dict(consumed=7)
+
+        restarted = ResumableRandomSampler(20, seed=3)
+        restarted.load_state_dict(state)
+        self.assertEqual(list(restarted), second_epoch[7:])
+        self.assertEqual(list(restarted), list(ResumableRandomSampler(20, seed=3).epoch_indices(2)))
+
+    def test_consuming_the_epoch_resumes_at_the_next(self):
+        sampler = ResumableRandomSampler(10, seed=0, epoch_length=4)
+        self.assertEqual(len(list(sampler)), 4)
+        self.assertEqual(sampler.state_dict(consumed=4), {"epoch": 1, "start": 0})
+
+    def test_replicas_partition_epoch(self):
+        samplers = [ResumableRandomSampler(10, seed=1, num_replicas=3, rank=rank) for rank in range(3)]
+        epochs = [list(sampler) for sampler in samplers]
+        self.assertTrue(all(len(epoch) == 4 for epoch in epochs))
+        self.assertEqual(set(index for epoch in epochs for index in epoch), set(range(10)))
+
+
+class TestBlockShuffleSampler(unittest.TestCase):
+
+    def test_blocks_stay_together(self):
+        sampler = BlockShuffleSampler([10, 5], block_size=4, seed=2)
+        epoch = list(sampler)
+        self.assertEqual(sorted(epoch), list(range(15)))
+        self.assertNotEqual(epoch, list(range(15)))
+
+        blocks = [range(0, 4), range(4, 8), range(8, 10), range(10, 14), range(14, 15)]
+        block_of = {index: block for block, indices in enumerate(blocks) for index in indices}
+        drawn_blocks = [block_of[index] for index in epoch]
+        # each block's samples are drawn one after another
+        self.assertEqual(len([i for i in range(1, len(epoch)) if drawn_blocks[i] != drawn_blocks[i - 1]]), 4)
+
+    def test_resumes_mid_epoch(self):
+        sampler = BlockShuffleSampler([6, 9], block_size=3, seed=5)
+        iter(sampler)
+        state = sampler.state_dict(consumed=4)
+
+        restarted = BlockShuffleSampler([6, 9], block_size=3, seed=5)
+        restarted.load_state_dict(state)
+        self.assertEqual(list(restarted), list(sampler.epoch_indices(0)[4:]))
+
+    def test_sequence_lengths(self):
+        dataset = torch.utils.data.ConcatDataset([
+            RangeDataset(0, 3), torch.utils.data.ConcatDataset([RangeDataset(0, 4), RangeDataset(0, 2)]),
+            ShuffledDataset(torch.utils.data.ConcatDataset([RangeDataset(0, 4), RangeDataset(0, 2)]))
+        ])
+        self.assertEqual(sequence_lengths(dataset), [3, 4, 2, 6])
+
+
+class TestDatasetPermutations(unittest.TestCase):
+
+    def test_round_trip(self):
+        np.random.seed(0)
+        dataset = ShuffledDataset(torch.utils.data.ConcatDataset([
+            ShuffledDataset(RangeDataset(0, 10), 5), RangeDataset(10, 15)
+        ]))
+        permutations = dataset_permutations(dataset)
+        self.assertEqual(len(permutations), 2)
+        values = [dataset[i] for i in range(len(dataset))]
+
+        np.random.seed(1)
+        rebuilt = ShuffledDataset(torch.utils.data.ConcatDataset([
+            ShuffledDataset(RangeDataset(0, 10), 5), RangeDataset(10, 15)
+        ]))
+        load_dataset_permutations(rebuilt, permutations)
+        self.assertEqual([rebuilt[i] for i in range(len(rebuilt))], values)
+
+        with self.assertRaises(ValueError):
+            load_dataset_permutations(rebuilt, permutations[:1])
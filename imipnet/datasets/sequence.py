@@ -1,10 +1,70 @@
+import collections
 import glob
 from abc import ABC
-from typing import List, Callable, Sequence, Iterator
+from typing import Dict, List, Callable, Sequence, Iterator, Tuple
 
 import cv2
 import numpy as np
 
+from imipnet import timing
+
+
+# decoded frames by (path, grayscale), least recently used first. It's per process, so each DataLoader
+# worker keeps its own, and is off until set_frame_cache_size is called
+_frame_cache: 'collections.OrderedDict[Tuple[str, bool], np.ndarray]' = collections.OrderedDict()
+_frame_cache_size = 0
+_frame_cache_counts = {"hits": 0, "misses": 0}
+
+
+def set_frame_cache_size(size: int):
+    """
+    Keeps up to size decoded frames in memory, so pairs sharing frames, such as the overlapping
+    KLT pairs a locality aware sampler serves one after another, decode each frame once.
+    Cached frames are read only.
+    """
+    global _frame_cache_size
+    if size < 0:
+        raise ValueError("size must be non-negative")
+    _frame_cache_size = size
+    while len(_frame_cache) > _frame_cache_size:
+        _frame_cache.popitem(last=False)
+
+
+def frame_cache_counts() -> Dict[str, int]:
+    return dict(_frame_cache_counts)
+
+
+def _decode(file_path: str, convert_to_grayscale: bool) -> np.ndarray:
+    with timing.stage("data/image_decode"):
+        if convert_to_grayscale:
+            return cv2.imread(file_path, cv2.IMREAD_GRAYSCALE)
+        return cv2.cvtColor(
+            cv2.imread(file_path, cv2.IMREAD_COLOR),
+            cv2.COLOR_BGR2RGB
+        )
+
+
+def _cached_decode(file_path: str, convert_to_grayscale: bool) -> np.ndarray:
+    if _frame_cache_size == 0:
+        return _decode(file_path, convert_to_grayscale)
+
+    key = (file_path, convert_to_grayscale)
+    img = _frame_cache.get(key)
+    if img is not None:
+        _frame_cache_counts["hits"] += 1
+        _frame_cache.move_to_end(key)
+        return img
+
+    _frame_cache_counts["misses"] += 1
+    img = _decode(file_path, convert_to_grayscale)
+    if img is None:  # unreadable, left for the caller to handle as before
+        return img
+    img.setflags(write=False)  # shared with every later reader
+    _frame_cache[key] = img
+    if len(_frame_cache) > _frame_cache_size:
+        _frame_cache.popitem(last=False)
+    return img
+
 
 class ImageSequence(ABC, Sequence[np.ndarray]):
     pass
@@ -24,14 +84,7 @@ class FileListImageSequence(ImageSequence):
 
     def __getitem__(self, index):
         if isinstance(index, int):
-            if self._convert_to_grayscale:
-                img = cv2.imread(self._file_paths[index], cv2.IMREAD_GRAYSCALE)
-            else:
-                img = cv2.cvtColor(
-                    cv2.imread(self._file_paths[index], cv2.IMREAD_COLOR),
-                    cv2.COLOR_BGR2RGB
-                )
-            return img
+            return _cached_decode(self._file_paths[index], self._convert_to_grayscale)
         else:
             assert isinstance(index, slice)
             return FileListImageSequence(
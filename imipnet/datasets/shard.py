@@ -0,0 +1,19 @@
+import torch.utils.data
+
+
+class ShardedDataset(torch.utils.data.Dataset):
+    def __init__(self, dataset: torch.utils.data.Dataset, num_shards: int, shard_index: int):
+        if not 0 <= shard_index < num_shards:
+            raise ValueError("shard_index must be in [0, num_shards)")
+
+        self._dataset = dataset
+        # shards are strided rather than padded, so every sample belongs to exactly one shard
+        self._index_order = range(shard_index, len(self._dataset), num_shards)
+
+    def __len__(self):
+        return len(self._index_order)
+
+    def __getitem__(self, index):
+        if index >= len(self):
+            raise IndexError()
+        return self._dataset[self._index_order[index]]
@@ -0,0 +1,50 @@
+import unittest
+
+import numpy as np
+import torch.utils.data
+
+from imipnet.datasets.shard import ShardedDataset
+from imipnet.datasets.shuffle import ShuffledDataset
+
+
+class RangeDataset(torch.utils.data.Dataset):
+    def __init__(self, start: int, stop: int):
+        self._values = list(range(start, stop))
+
+    def __len__(self):
+        return len(self._values)
+
+    def __getitem__(self, index):
+        return self._values[index]
+
+
+class TestShardedDataset(unittest.TestCase):
+
+    def _assert_partitions(self, dataset: torch.utils.data.Dataset, num_shards: int):
+        shards = [ShardedDataset(dataset, num_shards, i) for i in range(num_shards)]
+        self.assertEqual(sum(len(shard) for shard in shards), len(dataset))
+
+        sharded_values = sorted(shard[i] for shard in shards for i in range(len(shard)))
+        self.assertEqual(sharded_values, sorted(dataset[i] for i in range(len(dataset))))
+
+    def test_shards_partition_dataset(self):
+        for num_shards in range(1, 6):
+            self._assert_partitions(RangeDataset(0, 17), num_shards)
+
+    def test_shards_partition_shuffled_concat_dataset(self):
+        np.random.seed(0)
+        dataset = torch.utils.data.ConcatDataset([
+            ShuffledDataset(RangeDataset(0, 10), 7),
+            ShuffledDataset(RangeDataset(100, 123), 9)
+        ])
+        for num_shards in range(1, 6):
+            self._assert_partitions(ShuffledDataset(dataset), num_shards)
+
+    def test_shards_past_end_are_empty(self):
+        self.assertEqual(len(ShardedDataset(RangeDataset(0, 2), 4, 3)), 0)
+        with self.assertRaises(ValueError):
+            ShardedDataset(RangeDataset(0, 2), 2, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
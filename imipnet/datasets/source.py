@@ -0,0 +1,63 @@
+import bisect
+import multiprocessing
+import queue
+import time
+from typing import Tuple
+
+import torch.utils.data
+
+from .shard import ShardedDataset
+from .shuffle import ShuffledDataset
+
+
+def dataset_source(dataset: torch.utils.data.Dataset, index: int) -> Tuple[torch.utils.data.Dataset, int]:
+    """
+    Follows index through ShuffledDataset, ShardedDataset and ConcatDataset wrappers.
+    :return: the wrapped dataset which serves the sample and the sample's index in it
+    """
+    while True:
+        if isinstance(dataset, (ShuffledDataset, ShardedDataset)):
+            index = dataset._index_order[index]
+            dataset = dataset._dataset
+        elif isinstance(dataset, torch.utils.data.ConcatDataset):
+            if index < 0:
+                index += len(dataset)
+            dataset_index = bisect.bisect_right(dataset.cumulative_sizes, index)
+            if dataset_index > 0:
+                index -= dataset.cumulative_sizes[dataset_index - 1]
+            dataset = dataset.datasets[dataset_index]
+        else:
+            return dataset, index
+
+
+class LoadTimedDataset(torch.utils.data.Dataset):
+    """
+    LoadTimedDataset times each sample's load in the DataLoader workers, and reports it with the
+    class name of the dataset that served it, e.g. TUMMonocularStereoPairs, through a queue which
+    the training process drains with drain().
+    """
+
+    def __init__(self, dataset: torch.utils.data.Dataset):
+        self._dataset = dataset
+        self._load_times = multiprocessing.Queue()
+
+    def __len__(self):
+        return len(self._dataset)
+
+    def __getitem__(self, index):
+        start = time.perf_counter()
+        sample = self._dataset[index]
+        source = type(dataset_source(self._dataset, index)[0]).__name__
+        self._load_times.put((source, time.perf_counter() - start))
+        return sample
+
+    def drain(self):
+        """
+        :return: the (source name, seconds) of every sample loaded since the last drain
+        """
+        load_times = []
+        while True:
+            try:
+                load_times.append(self._load_times.get_nowait())
+            except queue.Empty:
+                return load_times
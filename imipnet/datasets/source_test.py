@@ -0,0 +1,29 @@
+import unittest
+
+import numpy as np
+import torch.utils.data
+
+from imipnet.datasets.shard import ShardedDataset
+from imipnet.datasets.shard_test import RangeDataset
+from imipnet.datasets.shuffle import ShuffledDataset
+from imipnet.datasets.source import dataset_source
+
+
+class OtherRangeDataset(RangeDataset):
+    pass
+
+
+class TestDatasetSource(unittest.TestCase):
+
+    def test_source_follows_wrappers(self):
+        np.random.seed(0)
+        first, second = RangeDataset(0, 10), OtherRangeDataset(100, 123)
+        dataset = ShardedDataset(ShuffledDataset(torch.utils.data.ConcatDataset([
+            ShuffledDataset(first, 7),
+            ShuffledDataset(second, 9)
+        ])), 3, 1)
+
+        for i in range(len(dataset)):
+            source, source_index = dataset_source(dataset, i)
+            self.assertIn(source, (first, second))
+            self.assertEqual(source[source_index], dataset[i])
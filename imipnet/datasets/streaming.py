@@ -0,0 +1,149 @@
+import collections
+from typing import Iterable, Iterator, List, Tuple
+
+import numpy as np
+import torch.utils.data
+
+from imipnet.data.pairs import CorrespondencePair
+
+
+def streamable_sequences(dataset: torch.utils.data.Dataset) -> List:
+    """
+    :return: the sequences of dataset in index order, through ConcatDatasets and datasets with a
+             sequences method. A sequence has frames, overlapped_frame_counts and make_pair, like
+             KLTPairGenerator and KITTIMonocularStereoPairsSequence
+    """
+    if isinstance(dataset, torch.utils.data.ConcatDataset):
+        return [streamed for wrapped in dataset.datasets for streamed in streamable_sequences(wrapped)]
+    if hasattr(dataset, "sequences"):
+        return dataset.sequences()
+    if hasattr(dataset, "overlapped_frame_counts") and hasattr(dataset, "make_pair"):
+        return [dataset]
+    raise ValueError("{} can't be streamed, only KLT sequence datasets such as TUM and KITTI can".format(
+        type(dataset).__name__
+    ))
+
+
+def stream_sequence_pairs(sequence, first_frames: range) -> Iterator[CorrespondencePair]:
+    """
+    Yields every pair of sequence whose first frame is in first_frames, in index order, through a
+    window of decoded frames which slides along the sequence, so each frame is decoded once.
+    The window spans the first frame and every frame overlapping it by the sequence's minimum overlap.
+    """
+    overlapped_frame_counts = sequence.overlapped_frame_counts()
+    window = collections.deque()  # the decoded frames from window_start on
+    window_start = first_frames.start
+    for img_1_index in first_frames:
+        while len(window) > 0 and window_start < img_1_index:
+            window.popleft()
+            window_start += 1
+        if len(window) == 0:
+            window_start = img_1_index
+
+        last_frame = img_1_index + int(overlapped_frame_counts[img_1_index])
+        if last_frame == img_1_index:
+            continue
+        while window_start + len(window) <= last_frame:
+            window.append(sequence.frames[window_start + len(window)])
+
+        frames = list(window)
+        for img_2_index in range(img_1_index + 1, last_frame + 1):
+            yield sequence.make_pair(img_1_index, img_2_index, frames[:img_2_index - img_1_index + 1])
+
+
+def shuffle_stream(items: Iterable, buffer_size: int, random_state: np.random.RandomState) -> Iterator:
+    # yields a random item of a buffer of the upcoming items, replacing it with the next one
+    if buffer_size == 0:
+        yield from items
+        return
+    buffer = []
+    for item in items:
+        if len(buffer) < buffer_size:
+            buffer.append(item)
+            continue
+        i = random_state.randint(buffer_size)
+        yield buffer[i]
+        buffer[i] = item
+    random_state.shuffle(buffer)
+    yield from buffer
+
+
+class StreamingPairDataset(torch.utils.data.IterableDataset):
+    """
+    StreamingPairDataset streams the pairs of KLT sequence datasets rather than loading each pair
+    on its own, which decodes every frame between the pair's endpoints again for every pair. The
+    sequences are cut into chunks of chunk_frames first frames, which are shuffled each epoch and
+    dealt out to the DataLoader workers of every rank. A worker streams its chunks through a sliding
+    window of decoded frames and shuffles the pairs through a buffer of shuffle_buffer pairs.
+    Every rank yields len(self) pairs, so the gradient all-reduces line up, by repeating a worker's
+    chunks if it runs short. Call set_epoch before each epoch; epochs can't be resumed part way through.
+    """
+
+    def __init__(self, dataset: torch.utils.data.Dataset, seed: int = 0, num_replicas: int = 1, rank: int = 0,
+                 chunk_frames: int = 200, shuffle_buffer: int = 256):
+        if not 0 <= rank < num_replicas:
+            raise ValueError("rank must be in [0, num_replicas)")
+        if chunk_frames < 1:
+            raise ValueError("chunk_frames must be positive")
+        if shuffle_buffer < 0:
+            raise ValueError("shuffle_buffer must be non-negative")
+        self._sequences = streamable_sequences(dataset)
+        self._seed = seed
+        self._num_replicas = num_replicas
+        self._rank = rank
+        self._shuffle_buffer = shuffle_buffer
+        self._epoch = 0
+
+        # (sequence index, first frames, pairs) of every chunk
+        self._chunks: List[Tuple[int, range, int]] = []
+        for sequence_index, sequence in enumerate(self._sequences):
+            overlapped_frame_counts = sequence.overlapped_frame_counts()
+            for start in range(0, len(overlapped_frame_counts), chunk_frames):
+                first_frames = range(start, min(start + chunk_frames, len(overlapped_frame_counts)))
+                num_pairs = int(np.sum(overlapped_frame_counts[first_frames.start:first_frames.stop]))
+                if num_pairs > 0:
+                    self._chunks.append((sequence_index, first_frames, num_pairs))
+        self._num_pairs = sum(num_pairs for _, _, num_pairs in self._chunks)
+
+    def __len__(self) -> int:
+        return self._num_pairs // self._num_replicas
+
+    def set_epoch(self, epoch: int):
+        self._epoch = epoch
+
+    def worker_chunks(self, worker_id: int, num_workers: int) -> List[Tuple[int, range, int]]:
+        # deals the shuffled chunks out to whichever of every rank's workers has the fewest pairs
+        num_shards = self._num_replicas * num_workers
+        shard_chunks = [[] for _ in range(num_shards)]
+        shard_pairs = np.zeros(num_shards, dtype=int)
+        for chunk_index in np.random.RandomState((self._seed, self._epoch)).permutation(len(self._chunks)):
+            shard = int(np.argmin(shard_pairs))
+            shard_chunks[shard].append(self._chunks[chunk_index])
+            shard_pairs[shard] += self._chunks[chunk_index][2]
+
+        chunks = shard_chunks[self._rank * num_workers + worker_id]
+        if len(chunks) == 0:  # more shards than chunks, repeat the largest shard's
+            chunks = shard_chunks[int(np.argmax(shard_pairs))]
+        return chunks
+
+    def stream_chunks(self, chunks: List[Tuple[int, range, int]], num_pairs: int) -> Iterator[CorrespondencePair]:
+        streamed = 0
+        while len(chunks) > 0 and streamed < num_pairs:
+            for sequence_index, first_frames, _ in chunks:
+                for pair in stream_sequence_pairs(self._sequences[sequence_index], first_frames):
+                    yield pair
+                    streamed += 1
+                    if streamed == num_pairs:
+                        return
+
+    def __iter__(self) -> Iterator[CorrespondencePair]:
+        worker_info = torch.utils.data.get_worker_info()
+        worker_id, num_workers = (0, 1) if worker_info is None else (worker_info.id, worker_info.num_workers)
+
+        # the rank's pairs split evenly over its workers
+        num_pairs = len(self) // num_workers + (1 if worker_id < len(self) % num_workers else 0)
+        random_state = np.random.RandomState((self._seed, self._epoch, self._rank, worker_id))
+        return shuffle_stream(
+            self.stream_chunks(self.worker_chunks(worker_id, num_workers), num_pairs),
+            self._shuffle_buffer, random_state
+        )
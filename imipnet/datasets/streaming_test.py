@@ -0,0 +1,73 @@
+import collections
+import unittest
+
+import numpy as np
+import torch.utils.data
+
+from imipnet.datasets.streaming import StreamingPairDataset, shuffle_stream, stream_sequence_pairs
+
+
+class CountingFrames:
+    def __init__(self, num_frames: int):
+        self._num_frames = num_frames
+        self.decodes = collections.Counter()
+
+    def __len__(self):
+        return self._num_frames
+
+    def __getitem__(self, index):
+        self.decodes[index] += 1
+        return index
+
+
+class OverlapSequence(torch.utils.data.Dataset):
+    # a sequence whose frame i overlaps the following overlapped_frame_counts[i] frames
+    def __init__(self, overlapped_frame_counts, name=""):
+        self._name = name
+        self._overlapped_frame_counts = np.array(overlapped_frame_counts)
+        self.frames = CountingFrames(len(overlapped_frame_counts) + 1)
+
+    def __len__(self):
+        return int(self._overlapped_frame_counts.sum())
+
+    def overlapped_frame_counts(self):
+        return self._overlapped_frame_counts
+
+    def make_pair(self, img_1_index, img_2_index, images):
+        return self._name, img_1_index, img_2_index, list(images)
+
+
+class TestStreamSequencePairs(unittest.TestCase):
+
+    def test_every_pair_and_frame_decoded_once(self):
+        sequence = OverlapSequence([3, 2, 0, 2, 1, 1])
+        streamed = list(stream_sequence_pairs(sequence, range(6)))
+
+        expected = [(i, j) for i, count in enumerate([3, 2, 0, 2, 1, 1]) for j in range(i + 1, i + count + 1)]
+        self.assertEqual([(i, j) for _, i, j, _ in streamed], expected)
+        for _, i, j, images in streamed:
+            self.assertEqual(images, list(range(i, j + 1)))
+        self.assertEqual(max(sequence.frames.decodes.values()), 1)
+
+
+class TestStreamingPairDataset(unittest.TestCase):
+
+    def test_streams_every_pair(self):
+        sequences = torch.utils.data.ConcatDataset([
+            OverlapSequence([2, 2, 1, 3, 1, 1, 2, 1], "a"), OverlapSequence([1] * 5, "b")
+        ])
+        dataset = StreamingPairDataset(sequences, seed=1, chunk_frames=3, shuffle_buffer=4)
+        streamed = [(name, i, j) for name, i, j, _ in dataset]
+        self.assertEqual(len(dataset), 18)
+        self.assertEqual(len(set(streamed)), 18)
+        self.assertEqual(len(streamed), 18)
+
+    def test_replicas_yield_equally(self):
+        sequences = torch.utils.data.ConcatDataset([OverlapSequence([2, 2, 1, 3, 1]), OverlapSequence([1] * 4)])
+        replicas = [StreamingPairDataset(sequences, num_replicas=2, rank=rank, chunk_frames=2) for rank in range(2)]
+        self.assertEqual([len(list(replica)) for replica in replicas], [len(replicas[0])] * 2)
+
+    def test_shuffle_stream_keeps_items(self):
+        shuffled = list(shuffle_stream(range(20), 5, np.random.RandomState(0)))
+        self.assertEqual(sorted(shuffled), list(range(20)))
+        self.assertNotEqual(shuffled, list(range(20)))
@@ -2,12 +2,12 @@ import bisect
 import os
 import pickle
 import shutil
-from typing import Optional
+from typing import List, Optional
 
 import docker
 import torch.utils.data
 
-from imipnet.data import pairs, klt
+from imipnet.data import pairs, klt, flow_cache
 from imipnet.datasets import sequence
 
 
@@ -29,7 +29,8 @@ class TUMMonocularStereoPairs(torch.utils.data.Dataset):
     def __init__(self: 'TUMMonocularStereoPairs', root: str,
                  split: Optional[str] = None,
                  download: Optional[bool] = True,
-                 minimum_KLT_overlap: Optional[float] = 0.3) -> None:
+                 minimum_KLT_overlap: Optional[float] = 0.3,
+                 use_flow_cache: Optional[bool] = False) -> None:
         self.root_folder = os.path.abspath(root)
 
         self._tracker = klt.Tracker()
@@ -65,8 +66,18 @@ class TUMMonocularStereoPairs(torch.utils.data.Dataset):
             with open(os.path.join(seq_path, "overlap.pickle"), 'rb') as overlap_file:
                 seq_overlap = pickle.load(overlap_file)
 
+            # with the flow cache, correspondences are composed from the adjacent frames' stored flow
+            seq_flow_cache = None
+            if use_flow_cache:
+                flow_cache_path = os.path.join(seq_path, "flow_cache")
+                if not flow_cache.FlowCache.exists(flow_cache_path):
+                    print("Generating flow cache for TUM sequence: {0}".format(seq_name))
+                    flow_cache.build_flow_cache(img_seq, flow_cache_path)
+                    print("Created flow cache for TUM sequence {0} with {1} frames".format(seq_name, len(img_seq)))
+                seq_flow_cache = flow_cache.FlowCache(flow_cache_path)
+
             seq_pair_generator = klt.KLTPairGenerator(seq_name, img_seq, self._tracker, seq_overlap,
-                                                      minimum_KLT_overlap)
+                                                      minimum_KLT_overlap, seq_flow_cache)
             self._stereo_pair_generators.append(seq_pair_generator)
             self._generator_len_cum_sum.append(len(seq_pair_generator))
 
@@ -76,6 +87,12 @@ class TUMMonocularStereoPairs(torch.utils.data.Dataset):
     def __len__(self) -> int:
         return self._generator_len_cum_sum[-1]
 
+    def sequence_lengths(self) -> List[int]:
+        return [len(generator) for generator in self._stereo_pair_generators]
+
+    def sequences(self) -> List[klt.KLTPairGenerator]:
+        return list(self._stereo_pair_generators)
+
     def __getitem__(self, index: int) -> pairs.CorrespondencePair:
         if index >= len(self):
             raise IndexError()
@@ -1,15 +1,20 @@
+import collections
+import copy
 import multiprocessing
 import os.path
+import random
 import socket
 from argparse import ArgumentParser, Namespace
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
-from typing import Tuple, List, Dict
+from typing import Tuple, List, Dict, Optional
 
 import numpy as np
 import pytorch_lightning as pl
 import torch
 from torch.utils.data import DataLoader
 
+import imipnet.losses.linear
 import imipnet.losses.ohnm_1_classic
 import imipnet.losses.ohnm_outlier_balanced_bce
 import imipnet.losses.ohnm_outlier_balanced_classic
@@ -21,12 +26,23 @@ import imipnet.models.preprocess.normalize
 import imipnet.models.preprocess.preprocess
 import imipnet.models.resnet
 import imipnet.models.strided_conv
+from imipnet import timing
 from imipnet.data.pairs import CorrespondencePair
+from imipnet.data.replay import PatchReplayBuffer
+from imipnet.data.rescale import rescale_image, ScaledCorrespondences
 from imipnet.datasets.blender import BlenderStereoPairs
 from imipnet.datasets.colmap import COLMAPStereoPairs
 from imipnet.datasets.kitti import KITTIMonocularStereoPairs
+from imipnet.datasets.mined import MinedPairDataset
+from imipnet.datasets import sequence
+from imipnet.datasets.resumable import BlockShuffleSampler, ResumableRandomSampler, dataset_permutations, \
+    load_dataset_permutations, sequence_lengths
+from imipnet.datasets.shard import ShardedDataset
 from imipnet.datasets.shuffle import ShuffledDataset
+from imipnet.datasets.streaming import StreamingPairDataset
 from imipnet.datasets.tum_mono import TUMMonocularStereoPairs
+from imipnet.metrics.epipolar import count_epipolar_inliers
+from imipnet.metrics.inliers import count_unique_inliers
 
 colmap_max_image_bytes = 1750000
 
@@ -51,6 +67,18 @@ loss_registry = {
     "outlier-balanced-bce-bce-uml": imipnet.losses.ohnm_outlier_balanced_bce.OHNMBCELoss
 }
 
+# the same losses, gathering the aligned outputs in memory linear in the number of patches
+linear_loss_registry = {
+    "1-maxima-patch-classic": imipnet.losses.linear.LinearOHNM1ClassicImipLoss,
+    "outlier-balanced-classic": imipnet.losses.linear.LinearOHNMClassicImipLoss,
+    "outlier-balanced-bce-bce-uml": imipnet.losses.linear.LinearOHNMBCELoss
+}
+
+loss_engines = {
+    "dense": loss_registry,
+    "linear": linear_loss_registry,
+}
+
 train_dataset_registry = {
     "tum-mono": lambda data_root: TUMMonocularStereoPairs(data_root, "train", True, 0.3),
     "kitti-gray": lambda data_root: KITTIMonocularStereoPairs(data_root, "train", True, False, 0.3),
@@ -73,6 +101,11 @@ train_dataset_registry = {
     )),
     "blender-livingroom-color": lambda data_root: BlenderStereoPairs(data_root, "livingroom_1", True, True),
     "blender-livingroom-gray": lambda data_root: BlenderStereoPairs(data_root, "livingroom_1", True, False),
+    # correspondences composed from precomputed adjacent frame flow, built on first use
+    "tum-mono-flow-cache": lambda data_root: TUMMonocularStereoPairs(data_root, "train", True, 0.3,
+                                                                     use_flow_cache=True),
+    "kitti-gray-flow-cache": lambda data_root: KITTIMonocularStereoPairs(data_root, "train", True, False, 0.3,
+                                                                         use_flow_cache=True),
 }
 train_dataset_registry["tum-megadepth-blender-gray"] = lambda data_root: torch.utils.data.ConcatDataset([
     train_dataset_registry["tum-mono"](data_root),
@@ -135,8 +168,315 @@ validation_dataset_registry["tum-megadepth-blender-gray-balanced"] = lambda data
     ShuffledDataset(validation_dataset_registry["blender-livingroom-gray"](data_root), 2500)
 ])
 
+def available_cpus() -> int:
+    # the CPUs this process may run on, which a sweep restricts each of its trials to
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return multiprocessing.cpu_count()
+
+
+def trainer_device_kwargs(hparams) -> Dict:
+    # Trainer arguments selecting the devices and distributed backend for the current host.
+    # Multi-process runs use DDP over NCCL on GPU hosts and over gloo on CPU hosts.
+    num_processes = getattr(hparams, "num_processes", 1)
+    num_nodes = getattr(hparams, "num_nodes", 1)
+    use_gpu = torch.cuda.is_available()
+
+    if num_processes * num_nodes == 1:
+        return {"gpus": [0] if use_gpu else None}
+
+    # the module shards its own datasets, see IMIPLightning.train_dataloader
+    distributed_kwargs = {"num_nodes": num_nodes, "replace_sampler_ddp": False}
+    if use_gpu:
+        return {"gpus": num_processes, "distributed_backend": "ddp", **distributed_kwargs}
+    return {"num_processes": num_processes, "distributed_backend": "ddp_cpu", **distributed_kwargs}
+
+
+# PendingPair holds a training pair whose keypoints are known but whose correspondences may still be computing
+PendingPair = collections.namedtuple("PendingPair", [
+    "img_1",  # preprocessed image 1
+    "img_2",  # preprocessed image 2
+    "img_1_kp_candidates",  # 2xCxk top k keypoint candidates of image 1
+    "img_2_kp_candidates",  # 2xCxk top k keypoint candidates of image 2
+    "img_1_correspondences",  # Future of the correspondences in image 1 of image 2's maxima
+    "img_2_correspondences",  # Future of the correspondences in image 2 of image 1's maxima
+])
+
+# MinedPatches holds the patch batches and labels generated for one image of a training pair
+MinedPatches = collections.namedtuple("MinedPatches", [
+    "maxima_patches",  # (C*k)xDxPxP patches about the top k keypoint candidates of each channel
+    "correspondence_patches",  # CxDxPxP patches about each channel's correspondence, zeroed if missing
+    "inlier_labels",  # C, channels with an inlier amongst their top k candidates
+    "outlier_labels",  # C, channels with only outliers amongst their top k candidates
+    # When deduplicated, maxima_patches holds one patch per unique pixel, correspondence_patches is None
+    # and these index the unique patches in place of the two patch batches.
+    "maxima_index",  # C*k, or None
+    "correspondence_index",  # C, -1 where the correspondence is missing, or None
+], defaults=(None, None))
+
+
+class PatchMiner:
+    """
+    PatchMiner runs the gradient free half of single pass training: preprocessing,
+    top k keypoint extraction, correspondence lookups, label generation and patch cutting.
+    IMIPLightning mines with its own network, while actor-learner DataLoader workers
+    mine with a shared memory copy of it.
+    """
+
+    def __init__(self, network: torch.nn.Module, preprocess: torch.nn.Module,
+                 n_top_patches: int, inlier_radius: int, correspondence_workers: int = 0,
+                 deduplicate_patches: bool = False):
+        self.network = network
+        self.preprocess = preprocess
+        self._n_top_patches = n_top_patches
+        self._inlier_radius = inlier_radius
+        self._correspondence_workers = correspondence_workers
+        self._deduplicate_patches = deduplicate_patches
+        # the pool is created on first use so the miner can still be pickled, e.g. for spawned processes
+        self._correspondence_pool = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_correspondence_pool"] = None
+        return state
+
+    def mine_training_pair(self, img_1: torch.Tensor, img_2: torch.Tensor, correspondence_func) \
+            -> Tuple[MinedPatches, MinedPatches, Dict[str, torch.Tensor]]:
+        return self.finish_mining_pair(self.start_mining_pair(img_1, img_2, correspondence_func))
+
+    def start_mining_pair(self, img_1: torch.Tensor, img_2: torch.Tensor, correspondence_func) -> PendingPair:
+        # each image is preprocessed exactly once
+        with timing.stage("preprocess"):
+            img_1 = self.preprocess(img_1)
+            img_2 = self.preprocess(img_2)
+
+        # Find top k keypoints in each image
+        with timing.stage("extract_top_k_keypoints"):
+            img_1_kp_candidates, _ = self.network.extract_top_k_keypoints(img_1, self._n_top_patches)  # 2 x c x k
+            img_2_kp_candidates, _ = self.network.extract_top_k_keypoints(img_2, self._n_top_patches)
+
+        exclude_border_px = (self.network.receptive_field_diameter() - 1) // 2
+        find_correspondences = timing.timed("find_correspondences", self.find_correspondences)
+        return PendingPair(
+            img_1, img_2, img_1_kp_candidates, img_2_kp_candidates,
+            self.submit_correspondences(
+                find_correspondences, correspondence_func, img_2_kp_candidates[:, :, 0], img_1.shape,
+                inverse=True, exclude_border_px=exclude_border_px
+            ),
+            self.submit_correspondences(
+                find_correspondences, correspondence_func, img_1_kp_candidates[:, :, 0], img_2.shape,
+                inverse=False, exclude_border_px=exclude_border_px
+            )
+        )
+
+    def submit_correspondences(self, fn, *args, **kwargs) -> Future:
+        if self._correspondence_workers < 1:
+            future = Future()
+            future.set_result(fn(*args, **kwargs))
+            return future
+
+        # correspondence functions spend most of their time in numpy and OpenCV, which release the GIL
+        if self._correspondence_pool is None:
+            self._correspondence_pool = ThreadPoolExecutor(max_workers=self._correspondence_workers)
+        return self._correspondence_pool.submit(fn, *args, **kwargs)
+
+    def finish_mining_pair(self, pending_pair: PendingPair) \
+            -> Tuple[MinedPatches, MinedPatches, Dict[str, torch.Tensor]]:
+        img_1, img_2 = pending_pair.img_1, pending_pair.img_2
+        # only takes time if the correspondences are still computing on the thread pool
+        with timing.stage("correspondence_wait"):
+            img_1_correspondences, img_1_correspondences_mask = pending_pair.img_1_correspondences.result()  # 2 x c
+            img_2_correspondences, img_2_correspondences_mask = pending_pair.img_2_correspondences.result()  # 2 x c
+
+        with timing.stage("sort_candidates_and_generate_labels"):
+            (img_1_kp_candidates, img_1_inlier_channels_by_max, img_1_outlier_channels_by_max,
+             img_1_inlier_channels_by_top_k,
+             img_1_outlier_channels_by_top_k) = self.sort_candidates_and_generate_labels(
+                pending_pair.img_1_kp_candidates, img_1_correspondences, img_1_correspondences_mask,
+                self._inlier_radius
+            )
+            (img_2_kp_candidates, img_2_inlier_channels_by_max, img_2_outlier_channels_by_max,
+             img_2_inlier_channels_by_top_k,
+             img_2_outlier_channels_by_top_k) = self.sort_candidates_and_generate_labels(
+                pending_pair.img_2_kp_candidates, img_2_correspondences, img_2_correspondences_mask,
+                self._inlier_radius
+            )
+
+        inliers_outliers_logs = self.apparent_inlier_logs(
+            img_1_inlier_channels_by_max, img_1_outlier_channels_by_max,
+            img_1_inlier_channels_by_top_k, img_1_outlier_channels_by_top_k,
+            img_2_inlier_channels_by_max, img_2_outlier_channels_by_max,
+            img_2_inlier_channels_by_top_k, img_2_outlier_channels_by_top_k
+        )
+
+        with timing.stage("image_to_patch_batch"):
+            img_1_mined = self.generate_mined_patches(
+                img_1, img_1_kp_candidates, img_1_correspondences, img_1_correspondences_mask,
+                img_1_inlier_channels_by_top_k, img_1_outlier_channels_by_top_k
+            )
+            img_2_mined = self.generate_mined_patches(
+                img_2, img_2_kp_candidates, img_2_correspondences, img_2_correspondences_mask,
+                img_2_inlier_channels_by_top_k, img_2_outlier_channels_by_top_k
+            )
+        return img_1_mined, img_2_mined, inliers_outliers_logs
+
+    def generate_mined_patches(self, image: torch.Tensor, kp_candidates: torch.Tensor,
+                               correspondences: torch.Tensor, correspondences_mask: torch.Tensor,
+                               inlier_labels: torch.Tensor, outlier_labels: torch.Tensor) -> MinedPatches:
+        if not self._deduplicate_patches:
+            return MinedPatches(
+                *self.generate_patch_batches(image, kp_candidates, correspondences, correspondences_mask),
+                inlier_labels, outlier_labels
+            )
+
+        # many channels share maxima, and inlier maxima often share their correspondence's pixel
+        unique_patches, maxima_index, correspondence_index = self.generate_unique_patch_batch(
+            image, kp_candidates, correspondences, correspondences_mask
+        )
+        return MinedPatches(unique_patches, None, inlier_labels, outlier_labels, maxima_index, correspondence_index)
+
+    @staticmethod
+    def find_correspondences(correspondence_func,
+                             keypoints_xy: torch.Tensor,
+                             target_shape: torch.Size,
+                             inverse: bool = False,
+                             exclude_border_px: int = 0) \
+            -> Tuple[torch.Tensor, torch.Tensor]:
+        # correspondence_func is a CorrespondencePair.correspondences_torch
+        correspondences_xy, correspondences_mask = correspondence_func(keypoints_xy, inverse=inverse)
+
+        # remove correspondences in border area
+        correspondence_in_border = (
+                (correspondences_xy < exclude_border_px).sum(0).to(torch.bool) |
+                ((target_shape[2] - exclude_border_px) <= correspondences_xy[0, :]) |
+                ((target_shape[1] - exclude_border_px) <= correspondences_xy[1, :])
+        )
+        correspondences_xy[:, correspondence_in_border] = 0
+        correspondences_mask[correspondence_in_border] = False
+        return correspondences_xy, correspondences_mask
+
+    @staticmethod
+    def sort_candidates_and_generate_labels(kp_candidates: torch.Tensor, correspondences: torch.Tensor,
+                                            correspondences_mask: torch.Tensor, inlier_radius: int) \
+            -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+        # find the distance between the kp candidates and the correspondence for each heat map (cxkx1)
+        kp_distances = torch.cdist(
+            kp_candidates.permute(1, 2, 0),
+            correspondences.unsqueeze(-1).permute(1, 2, 0)
+        ).squeeze(-1)  # cxkx1 -> cxk
+
+        # determine if highest scoring keypoints are inliers or not for reporting
+        inlier_channels_by_max = (kp_distances[:, 0] < inlier_radius) & correspondences_mask
+        outlier_channels_by_max = (kp_distances[:, 0] >= inlier_radius) & correspondences_mask
+
+        # sort the keypoint candidates by their match distance to the correspondence
+        candidate_distances, candidate_rankings = kp_distances.topk(
+            k=kp_distances.shape[-1], largest=False, sorted=True, dim=-1
+        )  # cxk
+        kp_candidates = torch.gather(kp_candidates, -1, candidate_rankings.unsqueeze(0).expand(2, -1, -1))
+
+        # determine if any of the top k scoring keypoints would qualify as an inlier if it were the maximum response
+        inlier_channels_by_top_k = (candidate_distances[:, 0] < inlier_radius) & correspondences_mask
+        outlier_channels_by_top_k = (candidate_distances[:, 0] >= inlier_radius) & correspondences_mask
+
+        return (kp_candidates, inlier_channels_by_max, outlier_channels_by_max,
+                inlier_channels_by_top_k, outlier_channels_by_top_k)
+
+    @staticmethod
+    def apparent_inlier_logs(img_1_inlier_channels_by_max: torch.Tensor, img_1_outlier_channels_by_max: torch.Tensor,
+                             img_1_inlier_channels_by_top_k: torch.Tensor,
+                             img_1_outlier_channels_by_top_k: torch.Tensor,
+                             img_2_inlier_channels_by_max: torch.Tensor, img_2_outlier_channels_by_max: torch.Tensor,
+                             img_2_inlier_channels_by_top_k: torch.Tensor,
+                             img_2_outlier_channels_by_top_k: torch.Tensor) -> Dict[str, torch.Tensor]:
+        apparent_inliers = (img_1_inlier_channels_by_max & img_2_inlier_channels_by_max).sum()
+        apparent_outliers = (img_1_outlier_channels_by_max | img_2_outlier_channels_by_max).sum()
+
+        apparent_inliers_top_k = (img_1_inlier_channels_by_top_k & img_2_inlier_channels_by_top_k).sum()
+        apparent_outliers_top_k = (img_1_outlier_channels_by_top_k | img_2_outlier_channels_by_top_k).sum()
+
+        return {
+            "training/apparent inliers": apparent_inliers,
+            "training/apparent outliers": apparent_outliers,
+            "training/apparent inliers (top k)": apparent_inliers_top_k,
+            "training/apparent outliers (top k)": apparent_outliers_top_k,
+        }
+
+    def generate_patch_batches(self, image: torch.Tensor, kp_candidates: torch.Tensor,
+                               correspondences: torch.Tensor, correspondences_mask: torch.Tensor) \
+            -> Tuple[torch.Tensor, torch.Tensor]:
+        # returns the patches about the (sorted) keypoint candidates and the patches about the
+        # correspondences. Patches for correspondences which were not found are left zeroed.
+        patch_diameter = self.network.receptive_field_diameter()
+
+        maxima_patches = self.image_to_patch_batch(
+            image, kp_candidates.flatten(1),
+            patch_diameter
+        )
+        corr_patches = torch.zeros(
+            correspondences.shape[1], image.shape[0], patch_diameter, patch_diameter,
+            dtype=maxima_patches.dtype,
+            device=maxima_patches.device
+        )
+        corr_patches[correspondences_mask, :, :, :] = self.image_to_patch_batch(
+            image, correspondences[:, correspondences_mask], patch_diameter
+        )
+        return maxima_patches, corr_patches
+
+    def generate_unique_patch_batch(self, image: torch.Tensor, kp_candidates: torch.Tensor,
+                                    correspondences: torch.Tensor, correspondences_mask: torch.Tensor) \
+            -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        # returns one patch per unique integer pixel amongst the (sorted) keypoint candidates and the found
+        # correspondences, the index of each candidate's patch and the index of each correspondence's patch,
+        # -1 for correspondences which were not found
+        maxima_xy = kp_candidates.flatten(1).to(torch.long)  # truncated like image_to_patch_batch
+        correspondences_xy = correspondences[:, correspondences_mask].to(torch.long)
+        pixels_xy = torch.cat((maxima_xy, correspondences_xy), dim=1)
+
+        width = image.shape[2]
+        unique_keys, patch_index = torch.unique(pixels_xy[1] * width + pixels_xy[0], return_inverse=True)
+        unique_xy = torch.stack((unique_keys % width, unique_keys // width))
+
+        unique_patches = self.image_to_patch_batch(image, unique_xy, self.network.receptive_field_diameter())
+
+        correspondence_index = torch.full(
+            (correspondences.shape[1],), -1, dtype=patch_index.dtype, device=patch_index.device
+        )
+        correspondence_index[correspondences_mask] = patch_index[maxima_xy.shape[1]:]
+        return unique_patches, patch_index[:maxima_xy.shape[1]], correspondence_index
+
+    @staticmethod
+    def expand_mined_patches(mined: MinedPatches) -> MinedPatches:
+        # returns the per candidate and per correspondence patch batches of deduplicated patches
+        if mined.maxima_index is None:
+            return mined
+        correspondence_patches = mined.maxima_patches[mined.correspondence_index.clamp(min=0)]
+        correspondence_patches[mined.correspondence_index < 0] = 0
+        return MinedPatches(
+            mined.maxima_patches[mined.maxima_index], correspondence_patches,
+            mined.inlier_labels, mined.outlier_labels
+        )
+
+    @staticmethod
+    def image_to_patch_batch(image: torch.Tensor, keypoints_xy: torch.Tensor, diameter: int) -> torch.Tensor:
+        if diameter % 2 != 1:
+            raise ValueError("diameter must be odd")
+        assert len(keypoints_xy.shape) == 2 and keypoints_xy.shape[0] == 2
+        radius = (diameter - 1) // 2
+        keypoints_xy = keypoints_xy.to(torch.int)
+        batch = torch.zeros((keypoints_xy.shape[1], image.shape[0], diameter, diameter), device=keypoints_xy.device)
+        for point_idx in range(keypoints_xy.shape[1]):
+            keypoint_x = keypoints_xy[0, point_idx]
+            keypoint_y = keypoints_xy[1, point_idx]
+            batch[point_idx, :, :, :] = image[
+                                        :,
+                                        keypoint_y - radius: keypoint_y + radius + 1,
+                                        keypoint_x - radius: keypoint_x + radius + 1
+                                        ]
+        return batch
+
 
-class IMIPLightning(pl.LightningModule):
+class IMIPLightning(pl.LightningModule, PatchMiner):
 
     def __init__(self, hparams):
 
@@ -173,15 +513,95 @@ class IMIPLightning(pl.LightningModule):
         channels_in = self.preprocess.output_channels(hparams.channels_in)
 
         self.network = model_registry[hparams.model](hparams.n_convolutions, channels_in, hparams.channels_out)
-        self._loss = loss_registry[hparams.loss]()
+        self._loss = loss_engines[getattr(hparams, "loss_engine", "dense")][hparams.loss]()
         self._lr = hparams.learning_rate
 
         self._n_top_patches = hparams.n_top_patches
         self._inlier_radius = hparams.inlier_radius
 
+        # older checkpoints predate the single pass training mode and mini-batches
+        self._single_pass = getattr(hparams, "single_pass", False)
+        self._batch_size = getattr(hparams, "batch_size", 1)
+        self._eval_batch_size = getattr(hparams, "eval_batch_size", 1)
+        self._bf16 = getattr(hparams, "bf16", False)
+
+        self._correspondence_workers = getattr(hparams, "correspondence_workers", 0)
+        self._deduplicate_patches = getattr(hparams, "deduplicate_patches", False)
+        if self._deduplicate_patches and not self._single_pass:
+            raise ValueError("deduplicate_patches requires single_pass training")
+        self._actor_learner = getattr(hparams, "actor_learner", False)
+        self._actor_sync_steps = getattr(hparams, "actor_sync_steps", 50)
+
+        if self._batch_size > 1 and not self._single_pass:
+            raise ValueError("batch_size > 1 requires single_pass training")
+        if self._correspondence_workers > 0 and not self._single_pass:
+            raise ValueError("correspondence_workers > 0 requires single_pass training")
+        if self._actor_learner and not self._single_pass:
+            raise ValueError("actor_learner requires single_pass training")
+        if self._actor_learner and self._correspondence_workers > 0:
+            raise ValueError("actor_learner mines in the DataLoader workers and can't use correspondence_workers")
+
+        self._correspondence_pool = None
+        # the batch whose correspondences are computing while the previous batch trains
+        self.__pending_batch = None
+
+        self._dense = getattr(hparams, "dense", False)
+        if self._dense and not self._single_pass:
+            raise ValueError("dense training requires single_pass training")
+        if self._dense and (self._actor_learner or self._correspondence_workers > 0):
+            raise ValueError("dense training can't be combined with actor_learner or correspondence_workers")
+
+        self._replay_steps = getattr(hparams, "replay_steps", 0)
+        if self._replay_steps > 0 and self._dense:
+            raise ValueError("dense training has no patches to replay")
+        if self._replay_steps > 0 and not self._single_pass:
+            raise ValueError("replay_steps > 0 requires single_pass training")
+        self.__replay_buffer = None
+        if self._replay_steps > 0:
+            self.__replay_buffer = PatchReplayBuffer(
+                hparams.replay_capacity, hparams.replay_staleness, hparams.replay_eviction
+            )
+        # counts optimizer steps, which is what replay staleness is measured in
+        self.__replay_clock = 0
+
+        self._initial_scale = getattr(hparams, "initial_scale", 1.0)
+        self._scale_ramp_steps = getattr(hparams, "scale_ramp_steps", 0)
+        if not 0 < self._initial_scale <= 1:
+            raise ValueError("initial_scale must be in (0, 1]")
+        if self._initial_scale < 1 and self._actor_learner:
+            raise ValueError("actor_learner mines in the DataLoader workers, which can't follow the scale schedule")
+
+        # validations in between only compute the epipolar proxy, skipping the correspondence lookups
+        self._full_validation_interval = getattr(hparams, "full_validation_interval", 1)
+        if self._full_validation_interval < 1:
+            raise ValueError("full_validation_interval must be positive")
+        self.__validation_count = 0
+
+        # the DataLoader workers' miner, whose network is a shared memory copy of self.network
+        self.__actor_miner = None
+        self.__actor_steps_since_sync = 0
+
         # store data between training_step calls with different optimizer indices
         self.__training_step_cache = {}
 
+        # the data order, which resume_state records with the batches taken so far this epoch
+        self.__train_sampler: Optional[ResumableRandomSampler] = None
+        self.__train_sampler_state = None
+        self.__epoch_batches = 0
+        self._shuffle_block_size = getattr(hparams, "shuffle_block_size", 0)
+        self._frame_cache_size = getattr(hparams, "frame_cache_size", 0)
+        if self._shuffle_block_size < 0:
+            raise ValueError("shuffle_block_size must be non-negative")
+
+        # stream the training pairs through a sliding window of each sequence's frames
+        self._streaming_pairs = getattr(hparams, "streaming_pairs", False)
+        self._stream_chunk_frames = getattr(hparams, "stream_chunk_frames", 200)
+        self._stream_shuffle_buffer = getattr(hparams, "stream_shuffle_buffer", 256)
+        if self._streaming_pairs and (self._actor_learner or self._shuffle_block_size > 0):
+            raise ValueError("streaming_pairs orders the pairs itself, so can't be used with actor_learner "
+                             "or shuffle_block_size")
+        self.__streaming_train_set: Optional[StreamingPairDataset] = None
+
     @staticmethod
     def add_model_specific_args(parent_parser: ArgumentParser):
         parser = ArgumentParser(parents=[parent_parser], add_help=False)
@@ -196,11 +616,60 @@ class IMIPLightning(pl.LightningModule):
         parser.add_argument('--channels_in', type=int, default=1)
         parser.add_argument('--channels_out', type=int, default=128)
         parser.add_argument('--loss', choices=loss_registry.keys(), default="outlier-balanced-classic")
+        parser.add_argument('--loss_engine', choices=loss_engines.keys(), default="dense",
+                            help="linear computes the same losses without CxC masks, for large channel counts")
         parser.add_argument('--seed', type=int, default=0)
         parser.add_argument('--inlier_radius', type=float, default=3.0)
         parser.add_argument('--learning_rate', type=float, default=10e-6)
         parser.add_argument('--n_top_patches', type=int, default=1)
         parser.add_argument('--overfit_n', type=int, default=0)
+        parser.add_argument('--single_pass', action='store_true',
+                            help="train on both images of a pair with one forward, backward and optimizer step")
+        parser.add_argument('--batch_size', type=int, default=1,
+                            help="pairs per training step, requires --single_pass if greater than 1")
+        parser.add_argument('--eval_batch_size', type=int, default=1)
+        parser.add_argument('--accumulate_grad_batches', type=int, default=1)
+        parser.add_argument('--bf16', action='store_true',
+                            help="run the training patch forward passes and losses under bfloat16 autocast")
+        parser.add_argument('--correspondence_workers', type=int, default=0,
+                            help="threads computing correspondences while the previous batch trains, "
+                                 "0 computes them synchronously")
+        parser.add_argument('--actor_learner', action='store_true',
+                            help="mine patches in the DataLoader workers with a periodically synced network copy")
+        parser.add_argument('--actor_sync_steps', type=int, default=50,
+                            help="training steps between copies of the network to the DataLoader workers")
+        parser.add_argument('--deduplicate_patches', action='store_true',
+                            help="forward one patch per unique pixel amongst an image's candidates and correspondences")
+        parser.add_argument('--full_validation_interval', type=int, default=1,
+                            help="count true inliers every n validations, the others only count epipolar inliers")
+        parser.add_argument('--initial_scale', type=float, default=1.0,
+                            help="scale of the training images at the first step, ramping up to full scale")
+        parser.add_argument('--scale_ramp_steps', type=int, default=0,
+                            help="training steps over which the image scale ramps linearly up to full scale")
+        parser.add_argument('--dense', action='store_true',
+                            help="gather the training logits from one autograd forward of each full image "
+                                 "rather than forwarding patches, requires a model whose keepDim output at a "
+                                 "pixel equals its output on the patch about it")
+        parser.add_argument('--replay_steps', type=int, default=0,
+                            help="extra gradient steps on replayed patches per mined batch")
+        parser.add_argument('--replay_capacity', type=int, default=4096, help="mined images held for replay")
+        parser.add_argument('--replay_staleness', type=int, default=500,
+                            help="optimizer steps after which a mined image is no longer replayed")
+        parser.add_argument('--replay_eviction', choices=PatchReplayBuffer.evictions, default="fifo")
+        parser.add_argument('--shuffle_block_size', type=int, default=0,
+                            help="shuffle blocks of this many consecutive pairs of a sequence, and the pairs "
+                                 "within each block, for page cache and frame reuse. 0 shuffles every pair")
+        parser.add_argument('--frame_cache_size', type=int, default=0,
+                            help="decoded frames each DataLoader worker keeps for reuse by later pairs")
+        parser.add_argument('--streaming_pairs', action='store_true',
+                            help="stream the training pairs of each TUM or KITTI sequence through a sliding window "
+                                 "of frames, decoding each frame once, rather than loading pairs in random order")
+        parser.add_argument('--stream_chunk_frames', type=int, default=200,
+                            help="first frames per chunk of a sequence, the unit streamed pairs are shuffled by")
+        parser.add_argument('--stream_shuffle_buffer', type=int, default=256,
+                            help="streamed pairs each DataLoader worker shuffles amongst")
+        parser.add_argument('--num_processes', type=int, default=1, help="data parallel processes per node")
+        parser.add_argument('--num_nodes', type=int, default=1)
         return parser
 
     def get_name(self):
@@ -219,28 +688,143 @@ class IMIPLightning(pl.LightningModule):
 
     def configure_optimizers(self):
         optimizer = torch.optim.Adam(self.network.parameters(), self._lr)
+        if self._single_pass:
+            return optimizer
         # return optimizer twice so we get two train steps per minibatch
         return [optimizer, optimizer]
 
     def train_dataloader(self):
+        train_set, collate_fn = self.train_set, CorrespondencePair.collate_for_torch_unstacked
+        if self._actor_learner:
+            train_set, collate_fn = MinedPairDataset(self.train_set, self.actor_miner()), MinedPairDataset.collate
+
+        # epochs cut short by the trainer's limit_train_batches are cut short by the sampler too,
+        # so a resumed epoch ends where the uninterrupted one would have
+        limit_train_batches = getattr(self.trainer, "limit_train_batches", 1.0)
+        epoch_length = limit_train_batches * self._batch_size if isinstance(limit_train_batches, int) else None
+
+        # every rank steps through an equally sized shard so the gradient all-reduces line up
+        num_replicas, rank = 1, 0
+        if torch.distributed.is_available() and torch.distributed.is_initialized():
+            num_replicas, rank = torch.distributed.get_world_size(), torch.distributed.get_rank()
+        sequence.set_frame_cache_size(self._frame_cache_size)  # inherited by the forked workers
+        num_workers = 1 + available_cpus() // (2 * self.local_world_size())
+
+        if self._streaming_pairs:
+            self.__train_sampler = None
+            self.__streaming_train_set = StreamingPairDataset(
+                train_set, self.hparams.seed, num_replicas, rank,
+                chunk_frames=self._stream_chunk_frames, shuffle_buffer=self._stream_shuffle_buffer
+            )
+            return DataLoader(
+                self.__streaming_train_set, batch_size=self._batch_size, collate_fn=collate_fn,
+                num_workers=num_workers, pin_memory=True
+            )
+
+        if self._shuffle_block_size > 0:
+            self.__train_sampler = BlockShuffleSampler(
+                sequence_lengths(train_set), self._shuffle_block_size, self.hparams.seed, num_replicas, rank,
+                epoch_length=epoch_length
+            )
+        else:
+            self.__train_sampler = ResumableRandomSampler(
+                len(train_set), self.hparams.seed, num_replicas, rank, epoch_length=epoch_length
+            )
+        if self.__train_sampler_state is not None:
+            self.__train_sampler.load_state_dict(self.__train_sampler_state)
+            self.__train_sampler_state = None
+
         return DataLoader(
-            self.train_set, batch_size=1, collate_fn=CorrespondencePair.collate_for_torch,
-            num_workers=1 + multiprocessing.cpu_count() // 2,
-            shuffle=True,
+            train_set, batch_size=self._batch_size, collate_fn=collate_fn,
+            num_workers=num_workers,
+            sampler=self.__train_sampler,
             pin_memory=True
         )
 
+    def on_epoch_start(self):
+        self.__epoch_batches = 0
+        if self.__streaming_train_set is not None:
+            self.__streaming_train_set.set_epoch(self.current_epoch)
+
+    def on_batch_start(self, batch):
+        self.__epoch_batches += 1
+
+    def resume_state(self) -> Dict:
+        """
+        :return: what a step checkpoint needs beyond the weights and optimizer state to continue
+                 training exactly where it stopped: the sampler position, the dataset permutations,
+                 the replay buffer, the module's counters and the random number generator states
+        """
+        # a batch whose correspondences are still computing hasn't been trained on, so it's loaded again
+        trained_batches = self.__epoch_batches - (1 if self.__pending_batch is not None else 0)
+        return {
+            "train_sampler": None if self.__train_sampler is None else
+            self.__train_sampler.state_dict(trained_batches * self._batch_size),
+            "dataset_permutations": {
+                "train": dataset_permutations(self.train_set),
+                "train_eval": dataset_permutations(self.train_eval_set),
+                "eval": dataset_permutations(self.eval_set),
+            },
+            "replay_buffer": None if self.__replay_buffer is None else self.__replay_buffer.state_dict(),
+            "replay_clock": self.__replay_clock,
+            "validation_count": self.__validation_count,
+            "actor_steps_since_sync": self.__actor_steps_since_sync,
+            "rng": {
+                "python": random.getstate(),
+                "numpy": np.random.get_state(),
+                "torch": torch.get_rng_state(),
+                "cuda": torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+            },
+        }
+
+    def on_load_checkpoint(self, checkpoint):
+        # only step checkpoints carry a resume state
+        state = checkpoint.get("resume_state")
+        if state is None:
+            return
+        self.__train_sampler_state = state["train_sampler"]
+        load_dataset_permutations(self.train_set, state["dataset_permutations"]["train"])
+        load_dataset_permutations(self.train_eval_set, state["dataset_permutations"]["train_eval"])
+        load_dataset_permutations(self.eval_set, state["dataset_permutations"]["eval"])
+        if self.__replay_buffer is not None and state["replay_buffer"] is not None:
+            self.__replay_buffer.load_state_dict(state["replay_buffer"])
+        self.__replay_clock = state["replay_clock"]
+        self.__validation_count = state["validation_count"]
+        self.__actor_steps_since_sync = state["actor_steps_since_sync"]
+
+        random.setstate(state["rng"]["python"])
+        np.random.set_state(state["rng"]["numpy"])
+        torch.set_rng_state(state["rng"]["torch"])
+        if state["rng"]["cuda"] is not None and torch.cuda.is_available():
+            torch.cuda.set_rng_state_all(state["rng"]["cuda"])
+
+    def actor_miner(self) -> PatchMiner:
+        # The DataLoader workers mine on the CPU with a copy of the network in shared memory,
+        # which sync_actor_network overwrites in place so the workers see the new weights
+        if self.__actor_miner is None:
+            self.__actor_miner = PatchMiner(
+                copy.deepcopy(self.network).cpu().share_memory(), copy.deepcopy(self.preprocess).cpu(),
+                self._n_top_patches, self._inlier_radius, deduplicate_patches=self._deduplicate_patches
+            )
+        return self.__actor_miner
+
+    def sync_actor_network(self):
+        with torch.no_grad():
+            self.actor_miner().network.load_state_dict(self.network.state_dict())
+
     def val_dataloader(self):
         train_eval_loader = DataLoader(
-            self.train_eval_set, batch_size=1, collate_fn=CorrespondencePair.collate_for_torch,
-            num_workers=1 + multiprocessing.cpu_count() // 2,
+            self.shard_for_rank(self.train_eval_set), batch_size=self._eval_batch_size,
+            collate_fn=CorrespondencePair.collate_for_torch_unstacked,
+            num_workers=1 + available_cpus() // (2 * self.local_world_size()),
             shuffle=False,
             pin_memory=True
         )
 
         eval_loader = DataLoader(
-            self.eval_set, batch_size=1, collate_fn=CorrespondencePair.collate_for_torch,
-            num_workers=1 + multiprocessing.cpu_count() // 2,
+            self.shard_for_rank(self.eval_set), batch_size=self._eval_batch_size,
+            collate_fn=CorrespondencePair.collate_for_torch_unstacked,
+            num_workers=1 + available_cpus() // (2 * self.local_world_size()),
             shuffle=False,
             pin_memory=True
         )
@@ -249,49 +833,126 @@ class IMIPLightning(pl.LightningModule):
 
     def test_dataloader(self):
         return DataLoader(
-            self.test_set, batch_size=1, collate_fn=CorrespondencePair.collate_for_torch,
-            num_workers=1 + multiprocessing.cpu_count() // 2,
+            self.shard_for_rank(self.test_set), batch_size=self._eval_batch_size,
+            collate_fn=CorrespondencePair.collate_for_torch_unstacked,
+            num_workers=1 + available_cpus() // (2 * self.local_world_size()),
             shuffle=False,
             pin_memory=True
         )
 
+    def local_world_size(self) -> int:
+        # processes sharing this node's CPUs for their data loading workers
+        if not torch.distributed.is_available() or not torch.distributed.is_initialized():
+            return 1
+        return getattr(self.hparams, "num_processes", 1)
+
+    @staticmethod
+    def shard_for_rank(dataset: torch.utils.data.Dataset) -> torch.utils.data.Dataset:
+        # evaluation shards are unpadded so no sample is counted twice when the metrics are reduced
+        if not torch.distributed.is_available() or not torch.distributed.is_initialized():
+            return dataset
+        return ShardedDataset(dataset, torch.distributed.get_world_size(), torch.distributed.get_rank())
+
+    def reduce_means(self, values: Dict[str, List[torch.Tensor]]) -> Dict[str, torch.Tensor]:
+        # averages each list of per-pair values over every rank's shard. Every rank must pass the same keys
+        # in the same order, with empty lists where it has no values, keys no rank has values for are dropped
+        sums = torch.stack([
+            torch.cat(values[key]).to(dtype=torch.float64).sum() if len(values[key]) > 0
+            else torch.zeros([], dtype=torch.float64, device=self.device) for key in values
+        ]).to(self.device)
+        counts = torch.tensor(
+            [sum(x.numel() for x in values[key]) for key in values], dtype=torch.float64, device=self.device
+        )
+        if torch.distributed.is_available() and torch.distributed.is_initialized():
+            torch.distributed.all_reduce(sums)
+            torch.distributed.all_reduce(counts)
+
+        means = (sums / counts.clamp(min=1)).to(torch.float32)
+        return {key: means[i] for i, key in enumerate(values) if counts[i] > 0}
+
     def forward(self, patch_batch: torch.Tensor, keepDim: bool):
         return self.network(patch_batch, keepDim)
 
-    def training_step(self, batch, batch_idx, optimizer_idx):
+    def autocast(self):
+        # loss_with_log_data casts the outputs back to float32, so only the network runs in bfloat16
+        return torch.autocast(device_type=self.device.type, dtype=torch.bfloat16, enabled=self._bf16)
+
+    def loss_with_log_data(self, maximizer_outputs: torch.Tensor, correspondence_outputs: torch.Tensor,
+                           inlier_labels: torch.Tensor, outlier_labels: torch.Tensor) \
+            -> Tuple[torch.Tensor, Dict[str, torch.Tensor]]:
+        # the losses reduce in float32 even when the outputs come from a bfloat16 forward
+        with torch.autocast(device_type=self.device.type, enabled=False):
+            return self._loss.forward_with_log_data(
+                maximizer_outputs.to(torch.float32), correspondence_outputs.to(torch.float32),
+                inlier_labels, outlier_labels
+            )
+
+    def training_scale(self) -> float:
+        # early steps train on downscaled pairs, the mining forward's cost grows with the image area
+        if self._initial_scale >= 1 or self.global_step >= self._scale_ramp_steps:
+            return 1.0
+        return self._initial_scale + (1 - self._initial_scale) * self.global_step / self._scale_ramp_steps
+
+    @staticmethod
+    def rescale_batch(batch, scale: float):
+        # returns a copy of the batch with its images rescaled and its correspondence functions mapped through the scale
+        imgs_1, imgs_2, correspondence_funcs = [], [], []
+        for img_1, img_2, correspondence_func in zip(batch[0], batch[1], batch[3]):
+            img_1, img_1_scale_xy = rescale_image(img_1, scale)
+            img_2, img_2_scale_xy = rescale_image(img_2, scale)
+            imgs_1.append(img_1)
+            imgs_2.append(img_2)
+            correspondence_funcs.append(ScaledCorrespondences(correspondence_func, img_1_scale_xy, img_2_scale_xy))
+        return [imgs_1, imgs_2, batch[2], correspondence_funcs]
+
+    def training_step(self, batch, batch_idx, optimizer_idx=None):
+        if self._actor_learner:
+            return self.actor_learner_training_step(batch)
+        scale = self.training_scale()
+        if scale < 1:
+            batch = self.rescale_batch(batch, scale)
+        if self._dense:
+            return self.dense_training_step(batch)
+        if self._single_pass:
+            return self.single_pass_training_step(batch)
+
         # set modules to training mode
         self.network.train(True)
         self._loss.train(True)
 
-        # Run preprocess step and store the results for the next pass
-        batch[0] = torch.stack([self.preprocess(img) for img in batch[0]], dim=0)
-        batch[1] = torch.stack([self.preprocess(img) for img in batch[1]], dim=0)
+        # preprocess into locals, the batch is a tuple on the CPU and is passed again to the second optimizer's step
+        with timing.stage("preprocess"):
+            imgs_1 = torch.stack([self.preprocess(img) for img in batch[0]], dim=0)
+            imgs_2 = torch.stack([self.preprocess(img) for img in batch[1]], dim=0)
 
         # unpack data since batch size is 1
-        img_1 = batch[0][0]
-        img_2 = batch[1][0]
+        img_1 = imgs_1[0]
+        img_2 = imgs_2[0]
         # name = batch[2][0]
         correspondence_func = batch[3][0]
 
         if optimizer_idx == 0:  # train on image 1 of pair
             # Find top k keypoints in each image
-            img_1_kp_candidates, _ = self.network.extract_top_k_keypoints(img_1, self._n_top_patches)  # 2 x c x k
-            img_2_kp_candidates, _ = self.network.extract_top_k_keypoints(img_2, self._n_top_patches)
+            with timing.stage("extract_top_k_keypoints"):
+                img_1_kp_candidates, _ = self.network.extract_top_k_keypoints(img_1, self._n_top_patches)  # 2 x c x k
+                img_2_kp_candidates, _ = self.network.extract_top_k_keypoints(img_2, self._n_top_patches)
             self.__training_step_cache.update({
                 "img_1_kp_candidates": img_1_kp_candidates,
                 "img_2_kp_candidates": img_2_kp_candidates,
             })
 
-            img_1_correspondences, img_1_correspondences_mask = self.find_correspondences(
-                correspondence_func, img_2_kp_candidates[:, :, 0], img_1.shape, inverse=True,
-                exclude_border_px=(self.network.receptive_field_diameter() - 1) // 2
-            )  # 2 x c
-
-            (img_1_kp_candidates, img_1_inlier_channels_by_max, img_1_outlier_channels_by_max,
-             img_1_inlier_channels_by_top_k,
-             img_1_outlier_channels_by_top_k) = self.sort_candidates_and_generate_labels(
-                img_1_kp_candidates, img_1_correspondences, img_1_correspondences_mask, self._inlier_radius
-            )
+            with timing.stage("find_correspondences"):
+                img_1_correspondences, img_1_correspondences_mask = self.find_correspondences(
+                    correspondence_func, img_2_kp_candidates[:, :, 0], img_1.shape, inverse=True,
+                    exclude_border_px=(self.network.receptive_field_diameter() - 1) // 2
+                )  # 2 x c
+
+            with timing.stage("sort_candidates_and_generate_labels"):
+                (img_1_kp_candidates, img_1_inlier_channels_by_max, img_1_outlier_channels_by_max,
+                 img_1_inlier_channels_by_top_k,
+                 img_1_outlier_channels_by_top_k) = self.sort_candidates_and_generate_labels(
+                    img_1_kp_candidates, img_1_correspondences, img_1_correspondences_mask, self._inlier_radius
+                )
             self.__training_step_cache.update({
                 "img_1_inlier_channels_by_max": img_1_inlier_channels_by_max,
                 "img_1_outlier_channels_by_max": img_1_outlier_channels_by_max,
@@ -299,29 +960,22 @@ class IMIPLightning(pl.LightningModule):
                 "img_1_outlier_channels_by_top_k": img_1_outlier_channels_by_top_k
             })
 
-            patch_diameter = self.network.receptive_field_diameter()
-
             # Generate a loss for image 1
-            maxima_patches = self.image_to_patch_batch(
-                img_1, img_1_kp_candidates.flatten(1),
-                patch_diameter
-            )
-            corr_patches = torch.zeros(
-                img_1_correspondences.shape[1], img_1.shape[0], patch_diameter, patch_diameter,
-                dtype=maxima_patches.dtype,
-                device=self._device
-            )
-            corr_patches[img_1_correspondences_mask, :, :, :] = self.image_to_patch_batch(
-                img_1, img_1_correspondences[:, img_1_correspondences_mask], patch_diameter
-            )
-
-            maximizer_outputs: torch.Tensor = self(maxima_patches, False)
-            correspondence_outputs: torch.Tensor = self(corr_patches, False)
-
-            loss, img_1_loss_logs = self._loss.forward_with_log_data(
-                maximizer_outputs, correspondence_outputs,
-                img_1_inlier_channels_by_top_k, img_1_outlier_channels_by_top_k
-            )
+            with timing.stage("image_to_patch_batch"):
+                maxima_patches, corr_patches = self.generate_patch_batches(
+                    img_1, img_1_kp_candidates, img_1_correspondences, img_1_correspondences_mask
+                )
+
+            with self.autocast():
+                with timing.stage("patch_forward"):
+                    maximizer_outputs: torch.Tensor = self(maxima_patches, False)
+                    correspondence_outputs: torch.Tensor = self(corr_patches, False)
+
+                with timing.stage("loss"):
+                    loss, img_1_loss_logs = self.loss_with_log_data(
+                        maximizer_outputs, correspondence_outputs,
+                        img_1_inlier_channels_by_top_k, img_1_outlier_channels_by_top_k
+                    )
 
             img_1_loss_logs = {
                 "training/image 1/" + key: img_1_loss_logs[key] for key in img_1_loss_logs
@@ -334,58 +988,44 @@ class IMIPLightning(pl.LightningModule):
             img_1_kp_candidates = self.__training_step_cache["img_1_kp_candidates"]
             img_2_kp_candidates = self.__training_step_cache["img_2_kp_candidates"]
 
-            img_2_correspondences, img_2_correspondences_mask = self.find_correspondences(
-                correspondence_func, img_1_kp_candidates[:, :, 0], img_2.shape, inverse=False,
-                exclude_border_px=(self.network.receptive_field_diameter() - 1) // 2
-            )  # 2 x c
-
-            (img_2_kp_candidates, img_2_inlier_channels_by_max, img_2_outlier_channels_by_max,
-             img_2_inlier_channels_by_top_k,
-             img_2_outlier_channels_by_top_k) = self.sort_candidates_and_generate_labels(
-                img_2_kp_candidates, img_2_correspondences, img_2_correspondences_mask, self._inlier_radius
+            with timing.stage("find_correspondences"):
+                img_2_correspondences, img_2_correspondences_mask = self.find_correspondences(
+                    correspondence_func, img_1_kp_candidates[:, :, 0], img_2.shape, inverse=False,
+                    exclude_border_px=(self.network.receptive_field_diameter() - 1) // 2
+                )  # 2 x c
+
+            with timing.stage("sort_candidates_and_generate_labels"):
+                (img_2_kp_candidates, img_2_inlier_channels_by_max, img_2_outlier_channels_by_max,
+                 img_2_inlier_channels_by_top_k,
+                 img_2_outlier_channels_by_top_k) = self.sort_candidates_and_generate_labels(
+                    img_2_kp_candidates, img_2_correspondences, img_2_correspondences_mask, self._inlier_radius
+                )
+
+            inliers_outliers_logs = self.apparent_inlier_logs(
+                self.__training_step_cache["img_1_inlier_channels_by_max"],
+                self.__training_step_cache["img_1_outlier_channels_by_max"],
+                self.__training_step_cache["img_1_inlier_channels_by_top_k"],
+                self.__training_step_cache["img_1_outlier_channels_by_top_k"],
+                img_2_inlier_channels_by_max, img_2_outlier_channels_by_max,
+                img_2_inlier_channels_by_top_k, img_2_outlier_channels_by_top_k
             )
 
-            img_1_inlier_channels_by_max = self.__training_step_cache["img_1_inlier_channels_by_max"]
-            img_1_outlier_channels_by_max = self.__training_step_cache["img_1_outlier_channels_by_max"]
-            img_1_inlier_channels_by_top_k = self.__training_step_cache["img_1_inlier_channels_by_top_k"]
-            img_1_outlier_channels_by_top_k = self.__training_step_cache["img_1_outlier_channels_by_top_k"]
-
-            apparent_inliers = (img_1_inlier_channels_by_max & img_2_inlier_channels_by_max).sum()
-            apparent_outliers = (img_1_outlier_channels_by_max | img_2_outlier_channels_by_max).sum()
-
-            apparent_inliers_top_k = (img_1_inlier_channels_by_top_k & img_2_inlier_channels_by_top_k).sum()
-            apparent_outliers_top_k = (img_1_outlier_channels_by_top_k | img_2_outlier_channels_by_top_k).sum()
-
-            inliers_outliers_logs = {
-                "training/apparent inliers": apparent_inliers,
-                "training/apparent outliers": apparent_outliers,
-                "training/apparent inliers (top k)": apparent_inliers_top_k,
-                "training/apparent outliers (top k)": apparent_outliers_top_k,
-            }
-
-            patch_diameter = self.network.receptive_field_diameter()
-
             # Generate a loss for image 2
-            maxima_patches = self.image_to_patch_batch(
-                img_2, img_2_kp_candidates.flatten(1),
-                patch_diameter
-            )
-            corr_patches = torch.zeros(
-                img_2_correspondences.shape[1], img_2.shape[0], patch_diameter, patch_diameter,
-                dtype=maxima_patches.dtype,
-                device=self._device
-            )
-            corr_patches[img_2_correspondences_mask, :, :, :] = self.image_to_patch_batch(
-                img_2, img_2_correspondences[:, img_2_correspondences_mask], patch_diameter
-            )
-
-            maximizer_outputs: torch.Tensor = self(maxima_patches, False)
-            correspondence_outputs: torch.Tensor = self(corr_patches, False)
-
-            loss, img_2_loss_logs = self._loss.forward_with_log_data(
-                maximizer_outputs, correspondence_outputs,
-                img_2_inlier_channels_by_top_k, img_2_outlier_channels_by_top_k
-            )
+            with timing.stage("image_to_patch_batch"):
+                maxima_patches, corr_patches = self.generate_patch_batches(
+                    img_2, img_2_kp_candidates, img_2_correspondences, img_2_correspondences_mask
+                )
+
+            with self.autocast():
+                with timing.stage("patch_forward"):
+                    maximizer_outputs: torch.Tensor = self(maxima_patches, False)
+                    correspondence_outputs: torch.Tensor = self(corr_patches, False)
+
+                with timing.stage("loss"):
+                    loss, img_2_loss_logs = self.loss_with_log_data(
+                        maximizer_outputs, correspondence_outputs,
+                        img_2_inlier_channels_by_top_k, img_2_outlier_channels_by_top_k
+                    )
 
             img_2_loss_logs = {
                 "training/image 2/" + key: img_2_loss_logs[key] for key in img_2_loss_logs
@@ -400,172 +1040,355 @@ class IMIPLightning(pl.LightningModule):
             'log': loss_logs
         }
 
-    def validation_step(self, batch, batch_idx, dataloader_index):
-        # set modules to test mode
-        self.network.train(False)
-        self._loss.train(False)
+    def single_pass_training_step(self, batch):
+        # set modules to training mode
+        self.network.train(True)
+        self._loss.train(True)
+
+        # mine patches from each pair separately since the images may differ in size
+        pending_batch = [
+            self.start_mining_pair(img_1, img_2, correspondence_func)
+            for img_1, img_2, correspondence_func in zip(batch[0], batch[1], batch[3])
+        ]
+
+        if self._correspondence_workers > 0:
+            # Train on the previous batch while this batch's correspondences compute in the background,
+            # so the trained keypoints were extracted one optimizer step ago.
+            pending_batch, self.__pending_batch = self.__pending_batch, pending_batch
+            if pending_batch is None:
+                # nothing to train on until the pipeline fills
+                return {
+                    'loss': torch.zeros([], device=self.device, requires_grad=True),
+                    'log': {}
+                }
+
+        mined_pairs = [self.finish_mining_pair(pending_pair) for pending_pair in pending_batch]
+        return self.train_on_mined_pairs(mined_pairs)
+
+    def actor_learner_training_step(self, batch):
+        # set modules to training mode
+        self.network.train(True)
+        self._loss.train(True)
 
-        # Run preprocess step in place
-        batch[0] = torch.stack([self.preprocess(img) for img in batch[0]], dim=0)
-        batch[1] = torch.stack([self.preprocess(img) for img in batch[1]], dim=0)
+        # the workers may mine a few batches ahead, so their network lags by up to the loader's prefetch
+        if self.__actor_steps_since_sync >= self._actor_sync_steps:
+            self.sync_actor_network()
+            self.__actor_steps_since_sync = 0
+        self.__actor_steps_since_sync += 1
+
+        # batches hold plain tuples since lightning can't move namedtuples between devices
+        mined_pairs = [
+            (MinedPatches(*img_1_mined), MinedPatches(*img_2_mined), inliers_outliers_logs)
+            for img_1_mined, img_2_mined, inliers_outliers_logs in batch[0]
+        ]
+        return self.train_on_mined_pairs(mined_pairs)
+
+    def train_on_mined_pairs(self, mined_pairs: List[Tuple[MinedPatches, MinedPatches, Dict[str, torch.Tensor]]]):
+        # pack the patches of every image in the batch into one forward pass
+        mined_patches = [mined for img_1_mined, img_2_mined, _ in mined_pairs for mined in (img_1_mined, img_2_mined)]
+        losses, loss_logs = self.mined_patch_losses(mined_patches)
+
+        pair_losses = []
+        pair_logs = []
+        for i, (_, _, inliers_outliers_logs) in enumerate(mined_pairs):
+            pair_losses.append(losses[2 * i] + losses[2 * i + 1])
+            pair_logs.append(self.pair_training_logs(inliers_outliers_logs, loss_logs[2 * i], loss_logs[2 * i + 1]))
+
+        if self.__replay_buffer is not None:
+            for mined, loss in zip(mined_patches, losses):
+                self.__replay_buffer.add(
+                    *self.expand_mined_patches(mined)[:4], step=self.__replay_clock, priority=float(loss.detach())
+                )
+
+        # average over the pairs so the loss scale does not depend on the batch size
+        return {
+            'loss': torch.stack(pair_losses).mean(dim=0),
+            'log': self.mean_logs(pair_logs)
+        }
 
-        # unpack data since batch size is 1
-        img_1 = batch[0][0]
-        img_2 = batch[1][0]
-        # name = batch[2][0]
-        correspondence_func = batch[3][0]
+    def dense_training_step(self, batch):
+        # set modules to training mode
+        self.network.train(True)
+        self._loss.train(True)
 
-        img_1_kp_candidates, _ = self.network.extract_top_k_keypoints(img_1, self._n_top_patches)
-        img_2_kp_candidates, _ = self.network.extract_top_k_keypoints(img_2, self._n_top_patches)
+        pair_losses = []
+        pair_logs = []
+        for img_1, img_2, correspondence_func in zip(batch[0], batch[1], batch[3]):
+            with timing.stage("preprocess"):
+                img_1 = self.preprocess(img_1)
+                img_2 = self.preprocess(img_2)
+
+            # one autograd forward per image replaces the keypoint forward and the patch forward
+            with self.autocast(), timing.stage("image_forward"):
+                img_1_output = self(img_1.unsqueeze(0), True)  # 1 x c x h x w
+                img_2_output = self(img_2.unsqueeze(0), True)
+
+            with timing.stage("extract_top_k_keypoints"):
+                img_1_kp_candidates = self.dense_keypoint_candidates(img_1_output)  # 2 x c x k
+                img_2_kp_candidates = self.dense_keypoint_candidates(img_2_output)
+
+            exclude_border_px = (self.network.receptive_field_diameter() - 1) // 2
+            with timing.stage("find_correspondences"):
+                img_1_correspondences, img_1_correspondences_mask = self.find_correspondences(
+                    correspondence_func, img_2_kp_candidates[:, :, 0], img_1.shape, inverse=True,
+                    exclude_border_px=exclude_border_px
+                )  # 2 x c
+                img_2_correspondences, img_2_correspondences_mask = self.find_correspondences(
+                    correspondence_func, img_1_kp_candidates[:, :, 0], img_2.shape, inverse=False,
+                    exclude_border_px=exclude_border_px
+                )  # 2 x c
+
+            with timing.stage("sort_candidates_and_generate_labels"):
+                (img_1_kp_candidates, img_1_inlier_channels_by_max, img_1_outlier_channels_by_max,
+                 img_1_inlier_channels_by_top_k,
+                 img_1_outlier_channels_by_top_k) = self.sort_candidates_and_generate_labels(
+                    img_1_kp_candidates, img_1_correspondences, img_1_correspondences_mask, self._inlier_radius
+                )
+                (img_2_kp_candidates, img_2_inlier_channels_by_max, img_2_outlier_channels_by_max,
+                 img_2_inlier_channels_by_top_k,
+                 img_2_outlier_channels_by_top_k) = self.sort_candidates_and_generate_labels(
+                    img_2_kp_candidates, img_2_correspondences, img_2_correspondences_mask, self._inlier_radius
+                )
+
+            inliers_outliers_logs = self.apparent_inlier_logs(
+                img_1_inlier_channels_by_max, img_1_outlier_channels_by_max,
+                img_1_inlier_channels_by_top_k, img_1_outlier_channels_by_top_k,
+                img_2_inlier_channels_by_max, img_2_outlier_channels_by_max,
+                img_2_inlier_channels_by_top_k, img_2_outlier_channels_by_top_k
+            )
+
+            with self.autocast(), timing.stage("loss"):
+                img_1_loss, img_1_loss_logs = self.loss_with_log_data(
+                    self.gather_outputs(img_1_output, img_1_kp_candidates.flatten(1)),
+                    self.gather_outputs(img_1_output, img_1_correspondences, img_1_correspondences_mask),
+                    img_1_inlier_channels_by_top_k, img_1_outlier_channels_by_top_k
+                )
+                img_2_loss, img_2_loss_logs = self.loss_with_log_data(
+                    self.gather_outputs(img_2_output, img_2_kp_candidates.flatten(1)),
+                    self.gather_outputs(img_2_output, img_2_correspondences, img_2_correspondences_mask),
+                    img_2_inlier_channels_by_top_k, img_2_outlier_channels_by_top_k
+                )
+
+            pair_losses.append(img_1_loss + img_2_loss)
+            pair_logs.append(self.pair_training_logs(inliers_outliers_logs, img_1_loss_logs, img_2_loss_logs))
+
+        # average over the pairs so the loss scale does not depend on the batch size
+        return {
+            'loss': torch.stack(pair_losses).mean(dim=0),
+            'log': self.mean_logs(pair_logs)
+        }
 
-        num_apparent_inliers, num_true_inliers, num_inliers_by_top_k = self.count_inliers(
-            correspondence_func, img_1_kp_candidates, img_2_kp_candidates,
-            img_1.shape, img_2.shape, self._inlier_radius
+    def dense_keypoint_candidates(self, output: torch.Tensor) -> torch.Tensor:
+        # the non maxima suppression overwrites its input, so it gets a copy of the output the loss gathers from,
+        # .to alone returns the output itself when it's already float32
+        keypoints, _ = self.network.top_k_keypoints_from_output(
+            output.detach().to(torch.float32, copy=True), self._n_top_patches
         )
+        return keypoints
 
+    @staticmethod
+    def gather_outputs(output: torch.Tensor, keypoints_xy: torch.Tensor,
+                       keypoints_mask: Optional[torch.Tensor] = None) -> torch.Tensor:
+        # Gathers the 1xCxHxW keepDim output at N keypoints as an NxCx1x1 batch, the shape a
+        # patch forward returns. Masked out keypoints get zero outputs, like the zeroed patches.
+        keypoints_xy = keypoints_xy.to(torch.long)
+        gathered = output[0][:, keypoints_xy[1], keypoints_xy[0]].t()  # N x C
+        if keypoints_mask is not None:
+            gathered = torch.where(keypoints_mask[:, None], gathered, torch.zeros_like(gathered))
+        return gathered[:, :, None, None]
+
+    @staticmethod
+    def pair_training_logs(inliers_outliers_logs: Dict[str, torch.Tensor], img_1_loss_logs: Dict[str, torch.Tensor],
+                           img_2_loss_logs: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
         return {
-            "apparent inliers": num_apparent_inliers,
-            "true inliers": num_true_inliers,
-            "apparent inliers (top k)": num_inliers_by_top_k
+            **inliers_outliers_logs,
+            **{
+                "training/image 1/" + key: img_1_loss_logs[key] for key in img_1_loss_logs
+                if img_1_loss_logs[key] is not None
+            },
+            **{
+                "training/image 2/" + key: img_2_loss_logs[key] for key in img_2_loss_logs
+                if img_2_loss_logs[key] is not None
+            }
         }
 
-    def validation_epoch_end(self, outputs: List[List[Dict[str, torch.Tensor]]]):
+    def backward(self, trainer, loss, optimizer, optimizer_idx):
+        with timing.stage("backward"):
+            super(IMIPLightning, self).backward(trainer, loss, optimizer, optimizer_idx)
+
+    def optimizer_step(self, epoch, batch_idx, optimizer, optimizer_idx, *args, **kwargs):
+        super(IMIPLightning, self).optimizer_step(epoch, batch_idx, optimizer, optimizer_idx, *args, **kwargs)
+        self.__replay_clock += 1
+
+        for _ in range(self._replay_steps):
+            self.replay_step(optimizer)
+
+    def replay_step(self, optimizer: torch.optim.Optimizer):
+        # replay as many images as a mined batch holds
+        samples = self.__replay_buffer.sample(2 * self._batch_size, self.__replay_clock, self.device)
+        if len(samples) == 0:
+            return
+
+        optimizer.zero_grad()
+        losses, _ = self.mined_patch_losses([MinedPatches(*mined) for _, mined in samples])
+        # scale like the mined loss, which sums the two images of a pair and averages over pairs
+        loss = torch.stack(losses).sum() / max(1, len(samples) // 2)
+        loss.backward()
+
+        # the replay forward bypasses the DDP wrapper, so average the gradients across ranks by hand
+        if torch.distributed.is_available() and torch.distributed.is_initialized():
+            world_size = torch.distributed.get_world_size()
+            for parameter in self.network.parameters():
+                if parameter.grad is not None:
+                    torch.distributed.all_reduce(parameter.grad)
+                    parameter.grad /= world_size
+
+        optimizer.step()
+        optimizer.zero_grad()
+
+        for (slot, _), image_loss in zip(samples, losses):
+            self.__replay_buffer.update_priority(slot, float(image_loss.detach()))
+
+    def mined_patch_losses(self, mined_patches: List[MinedPatches]) \
+            -> Tuple[List[torch.Tensor], List[Dict[str, torch.Tensor]]]:
+        # Run a single forward pass over all of the patches, then split the outputs back up
+        # so each image's labels are applied to its own patches
+        patch_batches = [
+            patch_batch for mined in mined_patches
+            for patch_batch in (mined.maxima_patches, mined.correspondence_patches) if patch_batch is not None
+        ]
+        losses = []
+        loss_logs = []
+        with self.autocast():
+            with timing.stage("patch_forward"):
+                outputs: torch.Tensor = self(torch.cat(patch_batches, dim=0), False)
+            outputs = list(torch.split(outputs, [patch_batch.shape[0] for patch_batch in patch_batches], dim=0))
+
+            for mined in mined_patches:
+                if mined.maxima_index is None:
+                    maximizer_outputs = outputs.pop(0)
+                    correspondence_outputs = outputs.pop(0)
+                else:
+                    # scatter the unique outputs back to every candidate and correspondence,
+                    # indexing accumulates the gradients of shared patches
+                    unique_outputs = outputs.pop(0)
+                    maximizer_outputs = unique_outputs[mined.maxima_index]
+                    correspondence_outputs = unique_outputs[mined.correspondence_index.clamp(min=0)]
+                    correspondence_outputs = torch.where(
+                        (mined.correspondence_index >= 0)[:, None, None, None],
+                        correspondence_outputs, torch.zeros_like(correspondence_outputs)
+                    )
+
+                with timing.stage("loss"):
+                    loss, logs = self.loss_with_log_data(
+                        maximizer_outputs, correspondence_outputs,
+                        mined.inlier_labels, mined.outlier_labels
+                    )
+                losses.append(loss)
+                loss_logs.append(logs)
+        return losses, loss_logs
+
+    @staticmethod
+    def mean_logs(logs: List[Dict[str, torch.Tensor]]) -> Dict[str, torch.Tensor]:
+        # average each logged value over the dicts which contain it
+        keys = {key: None for log in logs for key in log}
         return {
-            "train_eval_true_inliers": torch.stack([x["true inliers"] for x in outputs[0]]).mean(),
-            "eval_true_inliers": torch.stack([x["true inliers"] for x in outputs[1]]).mean(),
-            "log": {
-                "training_evaluation/apparent inliers": torch.stack([x['apparent inliers'] for x in outputs[0]]).mean(),
-                "training_evaluation/true inliers": torch.stack([x["true inliers"] for x in outputs[0]]).mean(),
-                "training_evaluation/apparent inliers (top k)": torch.stack(
-                    [x["apparent inliers (top k)"] for x in outputs[0]]).mean(),
-
-                "evaluation/apparent inliers": torch.stack([x['apparent inliers'] for x in outputs[1]]).mean(),
-                "evaluation/true inliers": torch.stack([x["true inliers"] for x in outputs[1]]).mean(),
-                "evaluation/apparent inliers (top k)": torch.stack(
-                    [x["apparent inliers (top k)"] for x in outputs[1]]).mean()
-            }
+            key: torch.stack([log[key].to(torch.float32).reshape(-1) for log in logs if key in log]).mean()
+            for key in keys
         }
 
-    def test_step(self, batch, batch_idx):
+    def validation_step(self, batch, batch_idx, dataloader_index):
         # set modules to test mode
         self.network.train(False)
         self._loss.train(False)
 
-        # Run preprocess step in place
-        batch[0] = torch.stack([self.preprocess(img) for img in batch[0]], dim=0)
-        batch[1] = torch.stack([self.preprocess(img) for img in batch[1]], dim=0)
+        return self.evaluate_batch(batch, self.__validation_count % self._full_validation_interval == 0)
 
-        # unpack data since batch size is 1
-        img_1 = batch[0][0]
-        img_2 = batch[1][0]
-        # name = batch[2][0]
-        correspondence_func = batch[3][0]
+    def validation_epoch_end(self, outputs: List[List[Dict[str, torch.Tensor]]]):
+        full_validation = self.__validation_count % self._full_validation_interval == 0
+        self.__validation_count += 1
+
+        # the trainer only adds to its callback metrics, so after a proxy only validation the checkpoint monitor
+        # and the trial reports would read the last full validation's counts as this step's
+        if not full_validation and self.trainer is not None:
+            for key in ["train_eval_true_inliers", "eval_true_inliers"]:
+                self.trainer.callback_metrics.pop(key, None)
+
+        # the same keys on every rank whatever its shard produced, so the all reduces line up. Each metric
+        # is averaged over the pairs which produced it, e.g. the pairs with fundamental matrices
+        values = {}
+        for prefix, loader_outputs in zip(["training_evaluation/", "evaluation/"], outputs):
+            for key in ["apparent inliers", "true inliers", "apparent inliers (top k)", "epipolar inliers"]:
+                values[prefix + key] = [x[key] for x in loader_outputs if key in x]
+        means = self.reduce_means(values)
+
+        results = {"log": means}
+        if "training_evaluation/true inliers" in means:
+            results["train_eval_true_inliers"] = means["training_evaluation/true inliers"]
+        if "evaluation/true inliers" in means:
+            results["eval_true_inliers"] = means["evaluation/true inliers"]
+        if "evaluation/epipolar inliers" in means:
+            results["eval_epipolar_inliers"] = means["evaluation/epipolar inliers"]
+        return results
 
-        img_1_kp_candidates, _ = self.network.extract_top_k_keypoints(img_1, self._n_top_patches)
-        img_2_kp_candidates, _ = self.network.extract_top_k_keypoints(img_2, self._n_top_patches)
+    def test_step(self, batch, batch_idx):
+        # set modules to test mode
+        self.network.train(False)
+        self._loss.train(False)
 
-        num_apparent_inliers, num_true_inliers, num_inliers_by_top_k = self.count_inliers(
-            correspondence_func, img_1_kp_candidates, img_2_kp_candidates,
-            img_1.shape, img_2.shape, self._inlier_radius
-        )
-        return {
-            "apparent inliers": num_apparent_inliers,
-            "true inliers": num_true_inliers,
-            "apparent inliers (top k)": num_inliers_by_top_k
-        }
+        return self.evaluate_batch(batch)
 
     def test_epoch_end(self, outputs):
+        # the matching scores only cover this rank's shard, the means cover every rank
         return {
-            "log": {
-                "test/apparent inliers": torch.stack([x['apparent inliers'] for x in outputs]).mean(),
-                "test/true inliers": torch.stack([x["true inliers"] for x in outputs]).mean(),
-                "test/apparent inliers (top k)": torch.stack(
-                    [x["apparent inliers (top k)"] for x in outputs]).mean()
-            },
+            "log": self.reduce_means({
+                "test/apparent inliers": [x['apparent inliers'] for x in outputs],
+                "test/true inliers": [x["true inliers"] for x in outputs],
+                "test/apparent inliers (top k)": [x["apparent inliers (top k)"] for x in outputs]
+            }),
             "matching_scores": {
                 "apparent": torch.sort(
-                    torch.stack([x['apparent inliers'] for x in outputs])).values / self.hparams.channels_out,
+                    torch.cat([x['apparent inliers'] for x in outputs])).values / self.hparams.channels_out,
                 "true": torch.sort(
-                    torch.stack([x['true inliers'] for x in outputs])).values / self.hparams.channels_out,
+                    torch.cat([x['true inliers'] for x in outputs])).values / self.hparams.channels_out,
             }
         }
 
-    @staticmethod
-    def find_correspondences(correspondence_func,
-                             keypoints_xy: torch.Tensor,
-                             target_shape: torch.Size,
-                             inverse: bool = False,
-                             exclude_border_px: int = 0) \
-            -> Tuple[torch.Tensor, torch.Tensor]:
-        keypoints_np = keypoints_xy.cpu().numpy()
-        packed_correspondences_xy, correspondences_indices = correspondence_func(
-            keypoints_np,
-            inverse=inverse
-        )
-
-        unpacked_correspondences_xy = np.zeros(keypoints_np.shape, dtype=packed_correspondences_xy.dtype)
-        unpacked_correspondences_xy[:, correspondences_indices] = packed_correspondences_xy
-
-        correspondences_mask = np.zeros(keypoints_np.shape[1], dtype=np.bool)
-        correspondences_mask[correspondences_indices] = True
-
-        correspondences_xy = torch.tensor(unpacked_correspondences_xy, device=keypoints_xy.device)
-        correspondences_mask = torch.tensor(correspondences_mask, device=keypoints_xy.device)
-
-        # remove correspondences in border area
-        correspondence_in_border = (
-                (correspondences_xy < exclude_border_px).sum(0).to(torch.bool) |
-                ((target_shape[2] - exclude_border_px) <= correspondences_xy[0, :]) |
-                ((target_shape[1] - exclude_border_px) <= correspondences_xy[1, :])
-        )
-        correspondences_xy[:, correspondence_in_border] = 0
-        correspondences_mask[correspondence_in_border] = False
-        return correspondences_xy, correspondences_mask
-
-    @staticmethod
-    def sort_candidates_and_generate_labels(kp_candidates: torch.Tensor, correspondences: torch.Tensor,
-                                            correspondences_mask: torch.Tensor, inlier_radius: int) \
-            -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
-        # find the distance between the kp candidates and the correspondence for each heat map (cxkx1)
-        kp_distances = torch.cdist(
-            kp_candidates.permute(1, 2, 0),
-            correspondences.unsqueeze(-1).permute(1, 2, 0)
-        ).squeeze(-1)  # cxkx1 -> cxk
-
-        # determine if highest scoring keypoints are inliers or not for reporting
-        inlier_channels_by_max = (kp_distances[:, 0] < inlier_radius) & correspondences_mask
-        outlier_channels_by_max = (kp_distances[:, 0] >= inlier_radius) & correspondences_mask
-
-        # sort the keypoint candidates by their match distance to the correspondence
-        candidate_distances, candidate_rankings = kp_distances.topk(
-            k=kp_distances.shape[-1], largest=False, sorted=True, dim=-1
-        )  # cxk
-        kp_candidates = torch.gather(kp_candidates, -1, candidate_rankings.unsqueeze(0).expand(2, -1, -1))
-
-        # determine if any of the top k scoring keypoints would qualify as an inlier if it were the maximum response
-        inlier_channels_by_top_k = (candidate_distances[:, 0] < inlier_radius) & correspondences_mask
-        outlier_channels_by_top_k = (candidate_distances[:, 0] >= inlier_radius) & correspondences_mask
+    def evaluate_batch(self, batch, count_true_inliers: bool = True) -> Dict[str, torch.Tensor]:
+        # returns the inlier counts for each pair in the batch, and the epipolar inlier counts
+        # if every pair has a fundamental matrix
+        results = collections.defaultdict(list)
+        f_mats_forward = batch[4] if len(batch) > 4 else [None] * len(batch[0])
+
+        # pairs are evaluated one at a time since the images may differ in size
+        for img_1, img_2, correspondence_func, f_mat_forward in zip(batch[0], batch[1], batch[3], f_mats_forward):
+            with timing.stage("evaluation/preprocess"):
+                img_1 = self.preprocess(img_1)
+                img_2 = self.preprocess(img_2)
+
+            with timing.stage("evaluation/extract_top_k_keypoints"):
+                img_1_kp_candidates, _ = self.network.extract_top_k_keypoints(img_1, self._n_top_patches)
+                img_2_kp_candidates, _ = self.network.extract_top_k_keypoints(img_2, self._n_top_patches)
+
+            if count_true_inliers:
+                with timing.stage("evaluation/count_inliers"):
+                    pair_apparent_inliers, pair_true_inliers, pair_inliers_by_top_k = self.count_inliers(
+                        correspondence_func, img_1_kp_candidates, img_2_kp_candidates,
+                        img_1.shape, img_2.shape, self._inlier_radius
+                    )
+                results["apparent inliers"].append(pair_apparent_inliers.reshape(1))
+                results["true inliers"].append(pair_true_inliers.reshape(1))
+                results["apparent inliers (top k)"].append(pair_inliers_by_top_k.reshape(1))
+
+            if f_mat_forward is not None:
+                with timing.stage("evaluation/count_epipolar_inliers"):
+                    results["epipolar inliers"].append(count_epipolar_inliers(
+                        f_mat_forward, img_1_kp_candidates[:, :, 0], img_2_kp_candidates[:, :, 0], self._inlier_radius
+                    ).to(torch.float32).reshape(1))
 
-        return (kp_candidates, inlier_channels_by_max, outlier_channels_by_max,
-                inlier_channels_by_top_k, outlier_channels_by_top_k)
-
-    @staticmethod
-    def image_to_patch_batch(image: torch.Tensor, keypoints_xy: torch.Tensor, diameter: int) -> torch.Tensor:
-        if diameter % 2 != 1:
-            raise ValueError("diameter must be odd")
-        assert len(keypoints_xy.shape) == 2 and keypoints_xy.shape[0] == 2
-        radius = (diameter - 1) // 2
-        keypoints_xy = keypoints_xy.to(torch.int)
-        batch = torch.zeros((keypoints_xy.shape[1], image.shape[0], diameter, diameter), device=keypoints_xy.device)
-        for point_idx in range(keypoints_xy.shape[1]):
-            keypoint_x = keypoints_xy[0, point_idx]
-            keypoint_y = keypoints_xy[1, point_idx]
-            batch[point_idx, :, :, :] = image[
-                                        :,
-                                        keypoint_y - radius: keypoint_y + radius + 1,
-                                        keypoint_x - radius: keypoint_x + radius + 1
-                                        ]
-        return batch
+        return {
+            key: torch.cat(values) for key, values in results.items() if len(values) == len(batch[0])
+        }
 
     @staticmethod
     def count_inliers(correspondence_func,
@@ -601,15 +1424,9 @@ class IMIPLightning(pl.LightningModule):
         ).sum().to(torch.float32)
 
         apparent_inlier_img_1_keypoints_xy = img_1_kp_candidates[:, apparent_inliers_by_max, 0]
-        num_true_inliers_by_max = torch.zeros([1], device=img_1_kp_candidates.device)
-        if num_apparent_inliers_by_max > 0:
-            max_inlier_distance = torch.tensor([inlier_radius], device=img_1_kp_candidates.device)
-            unique_inlier_img_1_keypoints_xy = apparent_inlier_img_1_keypoints_xy[:, 0:1]
-            num_true_inliers_by_max += 1  # on Apr 22nd 2020, an off by one error was discovered +1, to old results
-            for i in range(1, int(num_apparent_inliers_by_max)):
-                test_inlier = apparent_inlier_img_1_keypoints_xy[:, i:i + 1]
-                if (torch.norm(unique_inlier_img_1_keypoints_xy - test_inlier, p=2, dim=0) > max_inlier_distance).all():
-                    unique_inlier_img_1_keypoints_xy = torch.cat((unique_inlier_img_1_keypoints_xy, test_inlier), dim=1)
-                    num_true_inliers_by_max += 1
+        # the first apparent inlier always counts (on Apr 22nd 2020, an off by one error was discovered)
+        num_true_inliers_by_max = count_unique_inliers(
+            apparent_inlier_img_1_keypoints_xy, inlier_radius
+        ).to(torch.float32).reshape(1)
 
         return num_apparent_inliers_by_max, num_true_inliers_by_max, num_apparent_inliers_by_top_k
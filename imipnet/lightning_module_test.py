@@ -0,0 +1,83 @@
+import unittest
+from argparse import ArgumentParser
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+
+from imipnet import lightning_module
+from imipnet.data.pairs import CorrespondencePair
+from imipnet.data.planar import HomographyPair
+from imipnet.lightning_module import IMIPLightning
+
+
+def shifted_pairs(num_pairs: int):
+    # textured images and their copies shifted 2 pixels right and 1 down
+    random_state = np.random.RandomState(0)
+    pairs = []
+    for i in range(num_pairs):
+        image = (random_state.rand(48, 48) * 255).astype(np.uint8)
+        shifted = np.roll(image, (1, 2), axis=(0, 1))
+        pairs.append(HomographyPair(image, shifted, np.array([[1., 0, 2], [0, 1, 1], [0, 0, 1]]), "shift {}".format(i)))
+    return pairs
+
+
+registries = (lightning_module.train_dataset_registry, lightning_module.validation_dataset_registry,
+              lightning_module.test_dataset_registry)
+
+
+class ShiftedPairsTestCase(unittest.TestCase):
+    # registers the shifted pairs as test-shifted for the duration of each test
+
+    def setUp(self):
+        for registry in registries:
+            registry["test-shifted"] = lambda data_root: shifted_pairs(2)
+
+    def tearDown(self):
+        for registry in registries:
+            del registry["test-shifted"]
+
+    def make_module(self, *args: str) -> IMIPLightning:
+        parser = IMIPLightning.add_model_specific_args(ArgumentParser())
+        return IMIPLightning(parser.parse_args([
+            "--train_set", "test-shifted", "--eval_set", "test-shifted", "--test_set", "test-shifted",
+            "--n_eval_samples", "1", "--n_convolutions", "4", "--channels_out", "8", *args
+        ]))
+
+
+class TestDenseTraining(ShiftedPairsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.module = self.make_module("--single_pass", "--dense")
+
+    def test_keypoint_extraction_leaves_output(self):
+        image = torch.rand(1, 1, 32, 32)
+        output = self.module(image, True)
+        original_output = output.detach().clone()
+        self.module.dense_keypoint_candidates(output)
+        self.assertTrue(torch.equal(output.detach(), original_output))
+
+    def test_fp32_loss_is_finite(self):
+        batch = CorrespondencePair.collate_for_torch_unstacked(shifted_pairs(2))
+        loss = self.module.dense_training_step(batch)["loss"]
+        self.assertTrue(torch.isfinite(loss).all())
+        loss.sum().backward()  # no in place modification of the outputs saved for backward
+
+
+class TestFullValidationInterval(ShiftedPairsTestCase):
+
+    def test_true_inliers_only_from_full_validations(self):
+        module = self.make_module("--full_validation_interval", "2")
+        module.freeze()
+        module.trainer = SimpleNamespace(callback_metrics={})
+        batch = CorrespondencePair.collate_for_torch_unstacked(shifted_pairs(2))
+
+        monitored = []
+        for _ in range(2):
+            outputs = [[module.validation_step(batch, 0, dataloader_index)] for dataloader_index in range(2)]
+            results = module.validation_epoch_end(outputs)
+            # as the trainer does with the results
+            module.trainer.callback_metrics.update({key: value for key, value in results.items() if key != "log"})
+            monitored.append("eval_true_inliers" in module.trainer.callback_metrics)
+        self.assertEqual(monitored, [True, False])
@@ -1,3 +1,4 @@
+import math
 import os
 from argparse import ArgumentParser
 
@@ -6,7 +7,8 @@ from pytorch_lightning import Trainer
 from pytorch_lightning.utilities import move_data_to_device
 
 from imipnet.datasets.shuffle import ShuffledDataset
-from imipnet.lightning_module import IMIPLightning, test_dataset_registry
+from imipnet.lightning_module import IMIPLightning, test_dataset_registry, trainer_device_kwargs
+from imipnet.perf_log import PerfLogCallback
 
 parser = ArgumentParser()
 parser.add_argument("checkpoint", type=str)
@@ -14,6 +16,11 @@ parser.add_argument('test_set', choices=test_dataset_registry.keys())
 parser.add_argument('--data_root', default="./data")
 parser.add_argument('--n_eval_samples', type=int, default=-1)
 parser.add_argument("--output_dir", type=str, default="./test_results")
+parser.add_argument("--perf_log", type=str, default=None,
+                    help="append the test throughput, stage timings and peak RSS to this JSONL file")
+parser.add_argument("--num_processes", type=int, default=1,
+                    help="evaluate with this many processes per node, whatever the checkpoint was trained with")
+parser.add_argument("--num_nodes", type=int, default=1)
 
 params = parser.parse_args()
 run_name = os.path.basename(os.path.dirname(params.checkpoint))
@@ -31,13 +38,21 @@ if params.test_set is not None:
 
 print("Evaluating {} on {}".format(checkpoint_net.get_name(), checkpoint_net.hparams.test_set))
 
-# TODO: load device from params
+# evaluate on the first GPU if there is one, otherwise on the CPU, unless asked for more processes
+device_kwargs = trainer_device_kwargs(params)
+# throughput is measured without synchronizing CUDA around stages
+callbacks = [] if params.perf_log is None else [
+    PerfLogCallback(params.perf_log, checkpoint_net.hparams, synchronize=False)
+]
 if checkpoint_net.hparams.n_eval_samples > 0:
     print("Number of samples: {}".format(checkpoint_net.hparams.n_eval_samples))
-    trainer = Trainer(gpus=[0], limit_test_batches=checkpoint_net.hparams.n_eval_samples)
+    # older checkpoints predate batched evaluation
+    eval_batch_size = getattr(checkpoint_net.hparams, "eval_batch_size", 1)
+    trainer = Trainer(**device_kwargs, callbacks=callbacks,
+                      limit_test_batches=math.ceil(checkpoint_net.hparams.n_eval_samples / eval_batch_size))
 else:
     print("Number of samples: {}".format(len(checkpoint_net.test_set)))
-    trainer = Trainer(gpus=[0], limit_test_batches=1.0)
+    trainer = Trainer(**device_kwargs, callbacks=callbacks, limit_test_batches=1.0)
 
 results = move_data_to_device(trainer.test(checkpoint_net)[0], torch.device("cpu"))
 
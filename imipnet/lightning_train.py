@@ -5,20 +5,56 @@ from pytorch_lightning import Trainer
 from pytorch_lightning.callbacks import ModelCheckpoint
 from pytorch_lightning.loggers import TensorBoardLogger
 
-from imipnet.lightning_module import IMIPLightning
+from imipnet import timing
+from imipnet.async_validation import AsyncValidation
+from imipnet.datasets.source import LoadTimedDataset
+from imipnet.lightning_module import IMIPLightning, trainer_device_kwargs
+from imipnet.perf_log import PerfLogCallback
+from imipnet.starvation import StarvationDetector
+from imipnet.step_checkpoint import StepCheckpoint
+from imipnet.trial_reporter import TrialReporter
 
 parser = ArgumentParser()
+parser.add_argument('--async_validation', action='store_true',
+                    help="validate spooled snapshots in a separate process instead of pausing training")
+parser.add_argument('--async_validation_device', type=str, default="cpu")
+parser.add_argument('--stage_timing', action='store_true',
+                    help="log per stage wall-clock percentiles to tensorboard and stage_timing.jsonl")
+parser.add_argument('--stage_timing_no_sync', action='store_true',
+                    help="don't synchronize CUDA around timed stages, kernel time is charged to later stages")
+parser.add_argument('--perf_log', action='store_true',
+                    help="append throughput, stage timings, peak RSS and the config hash to perf_log.jsonl, "
+                         "compare runs with python -m imipnet.perf_log")
+parser.add_argument('--step_checkpoint_interval', type=int, default=0,
+                    help="steps between asynchronous writes of resume.ckpt, which restarts mid-epoch, 0 disables")
+parser.add_argument('--resume', type=str, default=None,
+                    help="a resume.ckpt to continue training from, in its own checkpoint directory")
+parser.add_argument('--run_name', type=str, default=None,
+                    help="name of the run's log and checkpoint directories, by default from the arguments and time")
+parser.add_argument('--report_file', type=str, default=None,
+                    help="append eval_true_inliers after each full validation to this JSONL file, as sweep trials do")
+parser.add_argument('--starvation_detector', action='store_true',
+                    help="log DataLoader wait time per step and warn when training is starved for data")
+parser.add_argument('--starvation_threshold', type=float, default=0.1,
+                    help="fraction of step time spent waiting on the DataLoader above which to warn")
 parser = IMIPLightning.add_model_specific_args(parser)
 args = parser.parse_args()
 
 imip_module = IMIPLightning(args)
-name = imip_module.get_new_run_name()
+# a resumed run continues in the checkpoint directory it stopped in
+if args.resume is not None:
+    name = os.path.basename(os.path.dirname(args.resume))
+elif args.run_name is not None:
+    name = args.run_name
+else:
+    name = imip_module.get_new_run_name()
 
 # TODO: load run dir from params
 logger = TensorBoardLogger("./runs", name)
 
 # TODO: load checkpoint dir from params
-checkpoint_dir = os.path.join(".", "checkpoints", "simple-conv", name)
+checkpoint_dir = os.path.join(".", "checkpoints", "simple-conv", name) if args.resume is None else \
+    os.path.dirname(args.resume)
 os.makedirs(checkpoint_dir, exist_ok=True)
 checkpoint_callback = ModelCheckpoint(
     filepath=checkpoint_dir,
@@ -31,9 +67,48 @@ checkpoint_callback = ModelCheckpoint(
 
 overfit_val = args.overfit_n
 
-# TODO: load device from params
-trainer = Trainer(logger=logger, gpus=[0], val_check_interval=250 if overfit_val == 0 else overfit_val,
+trainer_kwargs = {"val_check_interval": 250 if overfit_val == 0 else overfit_val}
+if args.async_validation:
+    # the evaluator process scores snapshots and keeps the best checkpoint instead
+    trainer_kwargs = {
+        "limit_val_batches": 0,
+        "checkpoint_callback": False,
+        "callbacks": [AsyncValidation(
+            os.path.join(checkpoint_dir, "spool"), checkpoint_dir, trainer_kwargs["val_check_interval"],
+            evaluator_device=args.async_validation_device
+        )],
+    }
+else:
+    trainer_kwargs["checkpoint_callback"] = checkpoint_callback
+
+if args.perf_log:
+    # the perf log includes the stage timings
+    trainer_kwargs["callbacks"] = trainer_kwargs.get("callbacks", []) + [PerfLogCallback(
+        os.path.join(checkpoint_dir, "perf_log.jsonl"), imip_module.hparams, synchronize=not args.stage_timing_no_sync
+    )]
+elif args.stage_timing:
+    trainer_kwargs["callbacks"] = trainer_kwargs.get("callbacks", []) + [timing.StageTimingCallback(
+        os.path.join(checkpoint_dir, "stage_timing.jsonl"), synchronize=not args.stage_timing_no_sync
+    )]
+
+if args.step_checkpoint_interval > 0:
+    trainer_kwargs["callbacks"] = trainer_kwargs.get("callbacks", []) + [StepCheckpoint(
+        os.path.join(checkpoint_dir, "resume.ckpt"), args.step_checkpoint_interval
+    )]
+
+if args.report_file is not None:
+    trainer_kwargs["callbacks"] = trainer_kwargs.get("callbacks", []) + [TrialReporter(args.report_file)]
+
+if args.starvation_detector:
+    # attributes the wait to the dataset types behind the shuffled and concatenated training set
+    imip_module.train_set = LoadTimedDataset(imip_module.train_set)
+    trainer_kwargs["callbacks"] = trainer_kwargs.get("callbacks", []) + [StarvationDetector(
+        imip_module.train_set, threshold=args.starvation_threshold
+    )]
+
+# use the first GPU if there is one, otherwise the CPU, or DDP with --num_processes/--num_nodes
+trainer = Trainer(logger=logger, **trainer_device_kwargs(args), **trainer_kwargs,
                   max_steps=20000 * 5, limit_train_batches=20000 if overfit_val == 0 else 1.0,
-                  reload_dataloaders_every_epoch=False,
-                  checkpoint_callback=checkpoint_callback)
+                  reload_dataloaders_every_epoch=False, resume_from_checkpoint=args.resume,
+                  accumulate_grad_batches=args.accumulate_grad_batches)
 trainer.fit(imip_module)
@@ -0,0 +1,222 @@
+from typing import Tuple, Dict
+
+import torch
+
+from .ohnm_1_classic import OHNM1ClassicImipLoss
+from .ohnm_outlier_balanced_bce import OHNMBCELoss
+from .ohnm_outlier_balanced_classic import OHNMClassicImipLoss
+
+
+# The losses below compute the same values and logs as their dense counterparts, but gather the
+# channel aligned outputs rather than masking with CxC and BNxC index matrices. Apart from the
+# network outputs themselves, memory is linear in the number of patches, except for the rows of
+# the inlier maxima patches that the unaligned loss reduces.
+
+def center_outputs(outputs: torch.Tensor) -> torch.Tensor:
+    # BxCxHxW -> BxC, taking the center values if h and w are not 1
+    center_px = (outputs.shape[2] - 1) // 2
+    return outputs[:, :, center_px, center_px]
+
+
+def aligned_maximizer_outputs(maximizer_outputs: torch.Tensor) -> torch.Tensor:
+    # BNxC -> BxN, each channel's outputs on its own N sorted candidate patches
+    num_channels = maximizer_outputs.shape[1]
+    num_patches_per_channel = maximizer_outputs.shape[0] // num_channels
+    channels = torch.arange(num_channels, device=maximizer_outputs.device).repeat_interleave(num_patches_per_channel)
+    return maximizer_outputs.gather(1, channels[:, None]).reshape(num_channels, num_patches_per_channel)
+
+
+def unaligned_inlier_losses(maximizer_outputs: torch.Tensor, inlier_labels: torch.Tensor,
+                            elementwise_loss) -> Tuple[torch.Tensor, int]:
+    # sums elementwise_loss over every other channel's output on each inlier channel's maximum patch
+    # returns the sum and the number of summed outputs
+    num_channels = maximizer_outputs.shape[1]
+    num_patches_per_channel = maximizer_outputs.shape[0] // num_channels
+    inlier_channels = torch.nonzero(inlier_labels, as_tuple=True)[0]
+    inlier_maxima_outputs = maximizer_outputs.index_select(0, inlier_channels * num_patches_per_channel)
+    # zero the losses of the aligned outputs rather than masking them out
+    losses = elementwise_loss(inlier_maxima_outputs).scatter(1, inlier_channels[:, None], 0)
+    return losses.sum(), inlier_channels.shape[0] * (num_channels - 1)
+
+
+class LinearOHNMClassicImipLoss(OHNMClassicImipLoss):
+
+    def forward_with_log_data(self, maximizer_outputs: torch.Tensor, correspondence_outputs: torch.Tensor,
+                              inlier_labels: torch.Tensor, outlier_labels: torch.Tensor) \
+            -> Tuple[torch.Tensor, Dict[str, torch.Tensor]]:
+        maximizer_outputs = center_outputs(maximizer_outputs)  # BNxC
+        correspondence_outputs = center_outputs(correspondence_outputs)  # BxC
+        assert (maximizer_outputs.shape[0] % maximizer_outputs.shape[1] == 0)
+
+        inlier_labels = inlier_labels.to(torch.bool)
+        outlier_labels = outlier_labels.to(torch.bool)
+        num_patches_per_channel = maximizer_outputs.shape[0] // maximizer_outputs.shape[1]
+
+        aligned_outlier_corr_outputs = torch.sigmoid(correspondence_outputs.diagonal()[outlier_labels])
+        if aligned_outlier_corr_outputs.numel() == 0:
+            outlier_correspondence_loss = None
+        else:
+            outlier_correspondence_loss = torch.sum(-1 * torch.log(
+                torch.max(aligned_outlier_corr_outputs, self._epsilon)))
+
+        # the inlier is the first patch of an inlier channel, every other patch of a channel with data is an outlier
+        aligned_maxima_outputs = torch.sigmoid(aligned_maximizer_outputs(maximizer_outputs))  # BxN
+        maxima_inlier_labels = torch.zeros_like(aligned_maxima_outputs, dtype=torch.bool)
+        maxima_inlier_labels[:, 0] = inlier_labels
+        maxima_outlier_labels = (inlier_labels | outlier_labels)[:, None] & ~maxima_inlier_labels
+
+        aligned_outlier_maximizer_scores = aligned_maxima_outputs[maxima_outlier_labels]
+        if aligned_outlier_maximizer_scores.numel() == 0:
+            outlier_maximizer_loss = None
+        else:
+            outlier_maximizer_loss = self._get_bce_maxima_outlier_weight(num_patches_per_channel) * torch.sum(
+                -1 * torch.log(torch.max(-1 * aligned_outlier_maximizer_scores + 1, self._epsilon)))
+
+        aligned_inlier_maximizer_scores = aligned_maxima_outputs[maxima_inlier_labels]
+        if aligned_inlier_maximizer_scores.numel() == 0:
+            inlier_loss = None
+        else:
+            inlier_loss = torch.sum(-1 * torch.log(
+                torch.max(aligned_inlier_maximizer_scores, self._epsilon)))
+
+        unaligned_maximizer_loss, num_unaligned = unaligned_inlier_losses(
+            maximizer_outputs, inlier_labels, torch.sigmoid
+        )
+        if num_unaligned == 0:
+            unaligned_maximizer_loss = torch.zeros([1], requires_grad=True, device=unaligned_maximizer_loss.device)
+
+        total_loss = torch.zeros(1, device=maximizer_outputs.device, dtype=maximizer_outputs.dtype, requires_grad=True)
+
+        # imips just adds the unaligned scores to the loss directly
+        total_loss = self._add_if_not_none(total_loss, outlier_correspondence_loss)
+        total_loss = self._add_if_not_none(total_loss, outlier_maximizer_loss)
+        total_loss = self._add_if_not_none(total_loss, inlier_loss)
+        total_loss = self._add_if_not_none(total_loss, unaligned_maximizer_loss)
+
+        return total_loss, {
+            "loss": total_loss.detach(),
+            "outlier_correspondence_loss": self._detach_if_not_none(outlier_correspondence_loss),
+            "outlier_maximizer_loss": self._detach_if_not_none(outlier_maximizer_loss),
+            "inlier_maximizer_loss": self._detach_if_not_none(inlier_loss),
+            "unaligned_maximizer_loss": self._detach_if_not_none(unaligned_maximizer_loss),
+        }
+
+
+class LinearOHNMBCELoss(OHNMBCELoss):
+
+    def forward_with_log_data(self, maximizer_outputs: torch.Tensor, correspondence_outputs: torch.Tensor,
+                              inlier_labels: torch.Tensor, outlier_labels: torch.Tensor) \
+            -> Tuple[torch.Tensor, Dict[str, torch.Tensor]]:
+        maximizer_outputs = center_outputs(maximizer_outputs)  # BNxC
+        correspondence_outputs = center_outputs(correspondence_outputs)  # BxC
+        assert (maximizer_outputs.shape[0] % maximizer_outputs.shape[1] == 0)
+
+        inlier_labels = inlier_labels.to(torch.bool)
+        outlier_labels = outlier_labels.to(torch.bool)
+        num_patches_per_channel = maximizer_outputs.shape[0] // maximizer_outputs.shape[1]
+
+        # Boost responses to correspondence patches if the channel returned all outliers
+        aligned_outlier_corr_outputs = correspondence_outputs.diagonal()[outlier_labels]
+        if aligned_outlier_corr_outputs.numel() == 0:
+            aligned_corr_losses = None
+        else:
+            aligned_corr_losses = torch.nn.functional.binary_cross_entropy_with_logits(
+                aligned_outlier_corr_outputs, torch.ones_like(aligned_outlier_corr_outputs), reduction="sum"
+            )
+
+        # every patch of a channel with data is labelled, the first patch of an inlier channel as an inlier
+        has_data_labels = inlier_labels | outlier_labels
+        maxima_outputs = aligned_maximizer_outputs(maximizer_outputs)[has_data_labels]  # DxN
+        if maxima_outputs.numel() == 0:
+            maxima_losses = None
+        else:
+            maxima_bce_labels = torch.zeros_like(maxima_outputs)
+            maxima_bce_labels[:, 0] = inlier_labels[has_data_labels].to(dtype=maxima_outputs.dtype)
+            maxima_weights = torch.where(
+                maxima_bce_labels.to(dtype=torch.bool), torch.ones_like(maxima_outputs),
+                self._get_bce_maxima_outlier_weight(num_patches_per_channel).to(maxima_outputs.device).expand_as(
+                    maxima_outputs)
+            )
+            maxima_losses = torch.nn.functional.binary_cross_entropy_with_logits(
+                maxima_outputs.flatten(), maxima_bce_labels.flatten(), maxima_weights.flatten(), reduction="sum"
+            )
+
+        unaligned_maxima_losses, num_unaligned = unaligned_inlier_losses(
+            maximizer_outputs, inlier_labels,
+            lambda outputs: torch.nn.functional.binary_cross_entropy_with_logits(
+                outputs, torch.zeros_like(outputs), reduction="none"
+            )
+        )
+        if num_unaligned == 0:
+            unaligned_maxima_losses = None
+
+        total_loss = torch.zeros(1, device=maximizer_outputs.device, dtype=maximizer_outputs.dtype, requires_grad=True)
+
+        total_loss = self._add_if_not_none(total_loss, maxima_losses)
+        total_loss = self._add_if_not_none(total_loss, aligned_corr_losses)
+        total_loss = self._add_if_not_none(total_loss, unaligned_maxima_losses)
+
+        return total_loss, {
+            "loss": total_loss.detach(),
+            "bce_maximizer_loss": self._detach_if_not_none(maxima_losses),
+            "outlier_correspondence_loss": self._detach_if_not_none(aligned_corr_losses),
+            "unaligned_maximizer_loss": self._detach_if_not_none(unaligned_maxima_losses)
+        }
+
+
+class LinearOHNM1ClassicImipLoss(OHNM1ClassicImipLoss):
+
+    def forward_with_log_data(self, maximizer_outputs: torch.Tensor, correspondence_outputs: torch.Tensor,
+                              inlier_labels: torch.Tensor, outlier_labels: torch.Tensor) \
+            -> Tuple[torch.Tensor, Dict[str, torch.Tensor]]:
+        assert (maximizer_outputs.shape[0] == maximizer_outputs.shape[1] ==
+                correspondence_outputs.shape[0] == correspondence_outputs.shape[1])
+
+        assert (maximizer_outputs.shape[2] == maximizer_outputs.shape[3] ==
+                correspondence_outputs.shape[2] == correspondence_outputs.shape[3])
+
+        maximizer_outputs = center_outputs(maximizer_outputs)  # BxC
+        correspondence_outputs = center_outputs(correspondence_outputs)  # BxC
+
+        inlier_labels = inlier_labels.to(torch.bool)
+        outlier_labels = outlier_labels.to(torch.bool)
+
+        aligned_correspondence_scores = torch.sigmoid(correspondence_outputs.diagonal())
+        aligned_maximizer_scores = torch.sigmoid(maximizer_outputs.diagonal())
+
+        aligned_outlier_correspondence_scores = aligned_correspondence_scores[outlier_labels]
+        outlier_correspondence_loss = torch.sum(-1 * torch.log(
+            torch.max(aligned_outlier_correspondence_scores, self._epsilon)))
+        if aligned_outlier_correspondence_scores.nelement() == 0:
+            outlier_correspondence_loss = torch.zeros([1], requires_grad=True,
+                                                      device=outlier_correspondence_loss.device)
+
+        aligned_outlier_maximizer_scores = aligned_maximizer_scores[outlier_labels]
+        outlier_maximizer_loss = torch.sum(
+            -1 * torch.log(torch.max(-1 * aligned_outlier_maximizer_scores + 1, self._epsilon)))
+        if aligned_outlier_maximizer_scores.nelement() == 0:
+            outlier_maximizer_loss = torch.zeros([1], requires_grad=True, device=outlier_maximizer_loss.device)
+
+        outlier_loss = outlier_correspondence_loss + outlier_maximizer_loss
+
+        aligned_inlier_maximizer_scores = aligned_maximizer_scores[inlier_labels]
+        inlier_loss = torch.sum(-1 * torch.log(torch.max(aligned_inlier_maximizer_scores, self._epsilon)))
+        if aligned_inlier_maximizer_scores.nelement() == 0:
+            inlier_loss = torch.zeros([1], requires_grad=True, device=inlier_loss.device)
+
+        unaligned_maximizer_loss, num_unaligned = unaligned_inlier_losses(
+            maximizer_outputs, inlier_labels, torch.sigmoid
+        )
+        if num_unaligned == 0:
+            unaligned_maximizer_loss = torch.zeros([1], requires_grad=True, device=unaligned_maximizer_loss.device)
+
+        # imips just adds the unaligned scores to the loss directly
+        loss = outlier_loss + inlier_loss + unaligned_maximizer_loss
+
+        return loss, {
+            "loss": loss.detach(),
+            "outlier_correspondence_loss": outlier_correspondence_loss.detach(),
+            "inlier_maximizer_loss": inlier_loss.detach(),
+            "outlier_maximizer_loss": outlier_maximizer_loss.detach(),
+            "unaligned_maximizer_loss": unaligned_maximizer_loss.detach(),
+        }
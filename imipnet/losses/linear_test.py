@@ -0,0 +1,61 @@
+import unittest
+
+import torch
+
+from imipnet.losses.linear import LinearOHNM1ClassicImipLoss, LinearOHNMBCELoss, LinearOHNMClassicImipLoss
+from imipnet.losses.ohnm_1_classic import OHNM1ClassicImipLoss
+from imipnet.losses.ohnm_outlier_balanced_bce import OHNMBCELoss
+from imipnet.losses.ohnm_outlier_balanced_classic import OHNMClassicImipLoss
+
+
+class TestLinearLosses(unittest.TestCase):
+
+    @staticmethod
+    def _random_inputs(channels: int, k: int, patch_size: int, inlier_fraction: float, outlier_fraction: float):
+        maximizer_outputs = (torch.randn(channels * k, channels, patch_size, patch_size) * 3).requires_grad_()
+        correspondence_outputs = (torch.randn(channels, channels, patch_size, patch_size) * 3).requires_grad_()
+        inlier_labels = torch.rand(channels) < inlier_fraction
+        outlier_labels = ~inlier_labels & (torch.rand(channels) < outlier_fraction)
+        return maximizer_outputs, correspondence_outputs, inlier_labels, outlier_labels
+
+    def _assert_equivalent(self, dense_loss, linear_loss, channels: int, k: int, patch_size: int = 1):
+        for inlier_fraction, outlier_fraction in [(0.3, 0.5), (0, 0.5), (0.3, 0), (0, 0), (1, 0)]:
+            inputs = self._random_inputs(channels, k, patch_size, inlier_fraction, outlier_fraction)
+
+            dense_total, dense_logs = dense_loss.forward_with_log_data(*inputs)
+            dense_grads = torch.autograd.grad(dense_total.sum(), inputs[:2], allow_unused=True)
+
+            linear_total, linear_logs = linear_loss.forward_with_log_data(*inputs)
+            linear_grads = torch.autograd.grad(linear_total.sum(), inputs[:2], allow_unused=True)
+
+            self.assertEqual(dense_total.shape, linear_total.shape)
+            self.assertTrue(torch.allclose(dense_total, linear_total, rtol=1e-5, atol=1e-5))
+            self.assertEqual(dense_logs.keys(), linear_logs.keys())
+            for key in dense_logs:
+                if dense_logs[key] is None:
+                    self.assertIsNone(linear_logs[key], key)
+                else:
+                    self.assertEqual(dense_logs[key].shape, linear_logs[key].shape, key)
+                    self.assertTrue(torch.allclose(dense_logs[key], linear_logs[key], rtol=1e-5, atol=1e-5), key)
+            for dense_grad, linear_grad, output in zip(dense_grads, linear_grads, inputs[:2]):
+                # outputs which no term uses have no gradient
+                dense_grad = torch.zeros_like(output) if dense_grad is None else dense_grad
+                linear_grad = torch.zeros_like(output) if linear_grad is None else linear_grad
+                self.assertTrue(torch.allclose(dense_grad, linear_grad, rtol=1e-5, atol=1e-6))
+
+    def test_classic(self):
+        torch.manual_seed(0)
+        for k in [1, 2, 4]:
+            self._assert_equivalent(OHNMClassicImipLoss(), LinearOHNMClassicImipLoss(), 16, k)
+        self._assert_equivalent(OHNMClassicImipLoss(), LinearOHNMClassicImipLoss(), 8, 2, patch_size=3)
+
+    def test_bce(self):
+        torch.manual_seed(0)
+        for k in [1, 2, 4]:
+            self._assert_equivalent(OHNMBCELoss(), LinearOHNMBCELoss(), 16, k)
+        self._assert_equivalent(OHNMBCELoss(), LinearOHNMBCELoss(), 8, 2, patch_size=3)
+
+    def test_1_classic(self):
+        torch.manual_seed(0)
+        self._assert_equivalent(OHNM1ClassicImipLoss(), LinearOHNM1ClassicImipLoss(), 16, 1)
+        self._assert_equivalent(OHNM1ClassicImipLoss(), LinearOHNM1ClassicImipLoss(), 8, 1, patch_size=3)
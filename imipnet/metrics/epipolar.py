@@ -0,0 +1,41 @@
+import torch
+
+from imipnet.metrics.inliers import unique_inliers_mask
+
+
+def symmetric_epipolar_distance(f_matrix: torch.Tensor, points_1_xy: torch.Tensor,
+                                points_2_xy: torch.Tensor) -> torch.Tensor:
+    """
+    symmetric_epipolar_distance measures how far each match is from satisfying the epipolar
+    constraint x_2^T F x_1 = 0, as the mean of the distance from point 1 to the epipolar line
+    of point 2 in image 1 and from point 2 to the epipolar line of point 1 in image 2.
+
+    :param f_matrix: 3x3 fundamental matrix mapping image 1 points to image 2 epipolar lines
+    :param points_1_xy: 2xN points in image 1
+    :param points_2_xy: 2xN points in image 2, matched to points_1_xy by column
+    :return: N distances in pixels
+    """
+    f_matrix = f_matrix.to(torch.float64)
+    ones = torch.ones((1, points_1_xy.shape[1]), dtype=torch.float64, device=points_1_xy.device)
+    points_1_h = torch.cat((points_1_xy.to(torch.float64), ones), dim=0)
+    points_2_h = torch.cat((points_2_xy.to(torch.float64), ones), dim=0)
+
+    lines_2 = f_matrix @ points_1_h  # 3xN epipolar lines in image 2
+    lines_1 = f_matrix.t() @ points_2_h  # 3xN epipolar lines in image 1
+    residuals = (points_2_h * lines_2).sum(dim=0).abs()
+
+    distances_2 = residuals / torch.norm(lines_2[:2], p=2, dim=0)
+    distances_1 = residuals / torch.norm(lines_1[:2], p=2, dim=0)
+    return ((distances_1 + distances_2) / 2).to(points_1_xy.dtype)
+
+
+def count_epipolar_inliers(f_matrix: torch.Tensor, points_1_xy: torch.Tensor, points_2_xy: torch.Tensor,
+                           inlier_radius: float) -> torch.Tensor:
+    """
+    count_epipolar_inliers is a cheap proxy for the true inlier count which needs no
+    correspondence lookups. Channel aligned matches are inliers if they are within inlier_radius
+    of each other's epipolar lines, and are deduplicated by their image 1 location like true inliers.
+    Points anywhere along the epipolar line pass, so it overestimates the true inlier count.
+    """
+    inliers_mask = symmetric_epipolar_distance(f_matrix, points_1_xy, points_2_xy) <= inlier_radius
+    return unique_inliers_mask(points_1_xy[:, inliers_mask], inlier_radius).sum()
@@ -0,0 +1,59 @@
+import unittest
+
+import numpy as np
+import torch
+
+from imipnet.metrics.epipolar import count_epipolar_inliers, symmetric_epipolar_distance
+from imipnet.metrics.inliers import count_unique_inliers
+
+
+class TestEpipolar(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(0)
+        torch.manual_seed(0)
+        intrinsics = np.array([[500.0, 0, 320], [0, 500.0, 240], [0, 0, 1]])
+        angle = 0.1
+        rotation = np.array([
+            [np.cos(angle), 0, np.sin(angle)],
+            [0, 1, 0],
+            [-np.sin(angle), 0, np.cos(angle)],
+        ])
+        translation = np.array([1.0, 0.2, 0.1])
+        translation_cross = np.array([
+            [0, -translation[2], translation[1]],
+            [translation[2], 0, -translation[0]],
+            [-translation[1], translation[0], 0],
+        ])
+        intrinsics_inv = np.linalg.inv(intrinsics)
+        self.f_matrix = torch.tensor(intrinsics_inv.T @ translation_cross @ rotation @ intrinsics_inv)
+
+        points = np.random.uniform([-2, -2, 5], [2, 2, 10], size=(40, 3)).T
+        points_1_h = intrinsics @ points
+        points_2_h = intrinsics @ (rotation @ points + translation[:, None])
+        self.points_1_xy = torch.tensor(points_1_h[:2] / points_1_h[2])
+        self.points_2_xy = torch.tensor(points_2_h[:2] / points_2_h[2])
+
+    def test_true_matches_are_on_epipolar_lines(self):
+        distances = symmetric_epipolar_distance(self.f_matrix, self.points_1_xy, self.points_2_xy)
+        self.assertTrue((distances < 1e-6).all())
+
+    def test_distance_along_line_normal(self):
+        # moving point 2 off its epipolar line by d pixels moves it d pixels from the line in image 2
+        ones = torch.ones(1, self.points_1_xy.shape[1], dtype=torch.float64)
+        line_2 = self.f_matrix @ torch.cat((self.points_1_xy, ones))
+        normal_2 = line_2[:2] / torch.norm(line_2[:2], dim=0)
+        distances_2 = symmetric_epipolar_distance(self.f_matrix, self.points_1_xy, self.points_2_xy + 5 * normal_2)
+        self.assertTrue((distances_2 > 1).all())
+
+    def test_count_epipolar_inliers(self):
+        # every true match is an inlier, so only the deduplication removes any
+        self.assertEqual(
+            int(count_epipolar_inliers(self.f_matrix, self.points_1_xy, self.points_2_xy, 3)),
+            int(count_unique_inliers(self.points_1_xy, 3))
+        )
+        shuffled_points_2_xy = self.points_2_xy[:, torch.randperm(self.points_2_xy.shape[1])]
+        self.assertLess(
+            int(count_epipolar_inliers(self.f_matrix, self.points_1_xy, shuffled_points_2_xy, 3)),
+            int(count_epipolar_inliers(self.f_matrix, self.points_1_xy, self.points_2_xy, 3))
+        )
@@ -0,0 +1,33 @@
+import torch
+
+
+def unique_inliers_mask(inliers_xy: torch.Tensor, inlier_radius: float) -> torch.Tensor:
+    """
+    unique_inliers_mask greedily deduplicates inliers in their given order. An inlier is kept
+    unless it lies within inlier_radius of an earlier inlier that was kept.
+
+    :param inliers_xy: 2xN inlier keypoints, ordered by priority
+    :param inlier_radius: inliers closer than or at this distance to a kept inlier are duplicates
+    :return: N boolean mask of the unique inliers
+    """
+    n = inliers_xy.shape[1]
+    unique = torch.ones(n, dtype=torch.bool, device=inliers_xy.device)
+    if n < 2:
+        return unique
+
+    distances = torch.norm(inliers_xy[:, :, None] - inliers_xy[:, None, :], p=2, dim=0)  # NxN
+    # suppressors[i, j] is set if an earlier inlier j would make inlier i a duplicate
+    suppressors = torch.tril(distances <= inlier_radius, diagonal=-1)
+
+    # The greedy result is the fixed point of unique[i] = no kept j < i suppresses i.
+    # Iteration k settles unique[k], so this converges in at most n iterations, usually a few.
+    for _ in range(n):
+        next_unique = ~(suppressors & unique[None, :]).any(dim=1)
+        if torch.equal(next_unique, unique):
+            break
+        unique = next_unique
+    return unique
+
+
+def count_unique_inliers(inliers_xy: torch.Tensor, inlier_radius: float) -> torch.Tensor:
+    return unique_inliers_mask(inliers_xy, inlier_radius).sum()
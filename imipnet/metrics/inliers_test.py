@@ -0,0 +1,39 @@
+import unittest
+
+import numpy as np
+import torch
+
+from imipnet.metrics.inliers import count_unique_inliers, unique_inliers_mask
+
+
+def greedy_unique_inliers(inliers_xy: np.ndarray, inlier_radius: float) -> np.ndarray:
+    # the original loop used by count_inliers and the SIFT baseline
+    unique_inliers_xy = inliers_xy[:, 0:1]
+    for i in range(1, inliers_xy.shape[1]):
+        test_inlier = inliers_xy[:, i:i + 1]
+        if np.all(np.linalg.norm(unique_inliers_xy - test_inlier, ord=2, axis=0) > inlier_radius):
+            unique_inliers_xy = np.hstack((unique_inliers_xy, test_inlier))
+    return unique_inliers_xy
+
+
+class TestUniqueInliers(unittest.TestCase):
+
+    def test_matches_greedy_loop(self):
+        np.random.seed(0)
+        for n in [0, 1, 2, 5, 32, 128]:
+            for extent in [5, 20, 100]:
+                # integer keypoints so that many distances fall exactly on the radius
+                inliers_xy = np.random.randint(0, extent, size=(2, n)).astype(np.float32)
+                expected = greedy_unique_inliers(inliers_xy, 3)
+                mask = unique_inliers_mask(torch.from_numpy(inliers_xy), 3)
+                self.assertEqual(int(count_unique_inliers(torch.from_numpy(inliers_xy), 3)), expected.shape[1])
+                np.testing.assert_array_equal(inliers_xy[:, mask.numpy()], expected)
+
+    def test_chain(self):
+        # each inlier only suppresses its successor, so every other inlier survives
+        inliers_xy = torch.stack((torch.arange(10, dtype=torch.float32) * 2, torch.zeros(10)))
+        self.assertEqual(unique_inliers_mask(inliers_xy, 3).tolist(), [True, False] * 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
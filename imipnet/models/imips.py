@@ -113,6 +113,18 @@ class ImipNet(torch.nn.Module, metaclass=abc.ABCMeta):
             defer_set_train = True
 
         output: torch.Tensor = self.__call__(img.unsqueeze(0), keepDim=True)
+        keypoints_2ck, topk_scores = self.top_k_keypoints_from_output(output, k)
+
+        if defer_set_train:
+            self.train(True)
+
+        return keypoints_2ck, topk_scores
+
+    @staticmethod
+    @torch.no_grad()
+    def top_k_keypoints_from_output(output: torch.Tensor, k: int):
+        # output is a 1xCxHxW keepDim response map, which is overwritten by the non maxima suppression
+        width = output.shape[3]
 
         # non maxima suppression
         output_nms_mask = ~(output == torch.nn.functional.max_pool2d(output, 3, stride=1, padding=1))
@@ -128,11 +140,8 @@ class ImipNet(torch.nn.Module, metaclass=abc.ABCMeta):
 
         keypoints_2ck = torch.zeros((2, output.shape[0], k), device=output.device, dtype=topk_scores.dtype)
         # return values in x, y format
-        keypoints_2ck[0, :, :] = topk_keypoints % img.shape[2]
-        keypoints_2ck[1, :, :] = topk_keypoints // img.shape[2]
-
-        if defer_set_train:
-            self.train(True)
+        keypoints_2ck[0, :, :] = topk_keypoints % width
+        keypoints_2ck[1, :, :] = topk_keypoints // width
 
         return keypoints_2ck, topk_scores
 
@@ -0,0 +1,208 @@
+import argparse
+import collections
+import hashlib
+import json
+import resource
+import sys
+import time
+from typing import Dict, List, Union
+
+import numpy as np
+
+from imipnet import timing
+
+
+def config_hash(hparams: Union[argparse.Namespace, Dict]) -> str:
+    # identifies the configuration a perf log record was measured with, so runs can be matched up
+    if isinstance(hparams, argparse.Namespace):
+        hparams = vars(hparams)
+    return hashlib.sha1(json.dumps(hparams, sort_keys=True, default=str).encode()).hexdigest()[:12]
+
+
+def peak_rss_bytes() -> Dict[str, int]:
+    # ru_maxrss is in kilobytes on Linux, children covers the DataLoader workers which have exited
+    return {
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "peak_children_rss_bytes": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024,
+    }
+
+
+def append_record(output_file: str, record: Dict):
+    with open(output_file, "a") as output_file:
+        output_file.write(json.dumps(record) + "\n")
+
+
+def read_records(perf_log_file: str) -> List[Dict]:
+    with open(perf_log_file, "r") as perf_log:
+        return [json.loads(line) for line in perf_log if len(line.strip()) > 0]
+
+
+class PerfLogCallback(timing.StageTimingCallback):
+    """
+    PerfLogCallback extends the stage timing JSON lines into a performance log, adding the phase,
+    the throughput in pairs per second and mined patches per second since the last record, the peak
+    resident set size and a hash of the hyperparameters. Validation runs don't count against the
+    training throughput. Compare two logs with python -m imipnet.perf_log.
+    """
+
+    def __init__(self, output_file: str, hparams: argparse.Namespace, log_interval: int = 50,
+                 synchronize: bool = True):
+        super().__init__(output_file, log_interval, synchronize)
+        self._config_hash = config_hash(hparams)
+        self._phase = "train"
+        self._pairs_per_batch = getattr(hparams, "batch_size", 1)
+        # every pair yields a maximizer patch per channel and top k candidate, and a correspondence
+        # patch per channel, in each image. Dense training forwards whole images instead
+        self._patches_per_pair = 0 if getattr(hparams, "dense", False) else \
+            2 * hparams.channels_out * (hparams.n_top_patches + 1)
+
+        self._interval_start = 0.0
+        self._interval_paused_seconds = 0.0
+        self._interval_batches = 0
+        self._validation_start = 0.0
+
+    def start_interval(self):
+        self._interval_start = time.perf_counter()
+        self._interval_paused_seconds = 0.0
+        self._interval_batches = 0
+
+    def on_train_start(self, trainer, pl_module):
+        super().on_train_start(trainer, pl_module)
+        self._phase = "train"
+        self.start_interval()
+
+    def on_test_start(self, trainer, pl_module):
+        super().on_test_start(trainer, pl_module)
+        self._phase = "test"
+        self._pairs_per_batch = getattr(pl_module.hparams, "eval_batch_size", 1)
+        self._patches_per_pair = 0
+        self.start_interval()
+
+    def on_batch_end(self, trainer, pl_module):
+        self._interval_batches += 1
+        super().on_batch_end(trainer, pl_module)
+
+    def on_test_batch_end(self, trainer, pl_module):
+        self._interval_batches += 1
+
+    def on_validation_start(self, trainer, pl_module):
+        self._validation_start = time.perf_counter()
+
+    def on_validation_end(self, trainer, pl_module):
+        self._interval_paused_seconds += time.perf_counter() - self._validation_start
+        super().on_validation_end(trainer, pl_module)
+
+    def log_record(self, trainer, pl_module, stats: Dict[str, Dict[str, float]]) -> Dict:
+        seconds = max(time.perf_counter() - self._interval_start - self._interval_paused_seconds, 1e-9)
+        pairs_per_second = self._interval_batches * self._pairs_per_batch / seconds
+        record = super().log_record(trainer, pl_module, stats)
+        record.update({
+            "phase": self._phase,
+            "time": time.time(),
+            "config_hash": self._config_hash,
+            "world_size": trainer.world_size,
+            "pairs_per_second": pairs_per_second,
+            "patches_per_second": pairs_per_second * self._patches_per_pair,
+            **peak_rss_bytes()
+        })
+        if pl_module.logger is not None:
+            pl_module.logger.log_metrics({
+                "perf/pairs per second": record["pairs_per_second"],
+                "perf/patches per second": record["patches_per_second"],
+                "perf/peak rss MiB": record["peak_rss_bytes"] / 2 ** 20,
+            }, step=trainer.global_step)
+        self.start_interval()
+        return record
+
+
+def summarize(records: List[Dict], skip_records: int = 1) -> Dict[str, Dict[str, float]]:
+    """
+    Summarizes the records of each phase of a perf log: the median of each throughput, keys
+    ending in _per_second, the maximum of each peak RSS, and the mean seconds of each stage
+    over all of its samples. The first skip_records records of each phase are warm up.
+    """
+    phase_records = collections.defaultdict(list)
+    for record in records:
+        phase_records[record.get("phase", "train")].append(record)
+
+    summaries = {}
+    for phase, records in phase_records.items():
+        records = records[skip_records:] if len(records) > skip_records else records
+        summary = {}
+        for key in sorted({key for record in records for key in record}):
+            values = [record[key] for record in records if key in record]
+            if key.endswith("_per_second"):
+                summary[key] = float(np.median(values))
+            elif key.endswith("_rss_bytes"):
+                summary[key] = float(max(values))
+
+        stage_totals, stage_counts = collections.defaultdict(float), collections.defaultdict(int)
+        for record in records:
+            for name, stage_stats in record.get("stages", {}).items():
+                stage_totals[name] += stage_stats["total"]
+                stage_counts[name] += stage_stats["count"]
+        for name in stage_totals:
+            summary["stage/%s mean seconds" % name] = stage_totals[name] / stage_counts[name]
+
+        summary["config_hashes"] = sorted({record["config_hash"] for record in records if "config_hash" in record})
+        summaries[phase] = summary
+    return summaries
+
+
+def find_regressions(baseline: Dict[str, Dict[str, float]], candidate: Dict[str, Dict[str, float]],
+                     threshold: float) -> List[str]:
+    """
+    :return: a description of each metric where candidate is worse than baseline by more than the threshold
+             fraction, throughputs are worse when lower, peak RSS and stage times when higher
+    """
+    regressions = []
+    for phase in sorted(baseline.keys() & candidate.keys()):
+        for key in sorted(baseline[phase].keys() & candidate[phase].keys()):
+            if key == "config_hashes":
+                continue
+            baseline_value, candidate_value = baseline[phase][key], candidate[phase][key]
+            if baseline_value == 0:
+                continue
+            change = (candidate_value - baseline_value) / baseline_value
+            if key.endswith("_per_second"):
+                change = -change
+            if change > threshold:
+                regressions.append("{0} {1}: {2:.6g} -> {3:.6g} ({4:+.1%} worse)".format(
+                    phase, key, baseline_value, candidate_value, change
+                ))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the perf logs of two runs and flag regressions")
+    parser.add_argument("baseline", type=str, help="perf log JSONL of the reference run")
+    parser.add_argument("candidate", type=str, help="perf log JSONL of the run to check")
+    parser.add_argument("--threshold", type=float, default=0.05,
+                        help="fraction by which a metric may get worse before it is flagged")
+    parser.add_argument("--skip_records", type=int, default=1, help="warm up records to skip in each phase")
+    params = parser.parse_args()
+
+    baseline = summarize(read_records(params.baseline), params.skip_records)
+    candidate = summarize(read_records(params.candidate), params.skip_records)
+
+    for phase in sorted(baseline.keys() | candidate.keys()):
+        print(phase)
+        baseline_summary, candidate_summary = baseline.get(phase, {}), candidate.get(phase, {})
+        if baseline_summary.get("config_hashes") != candidate_summary.get("config_hashes"):
+            print("  configurations differ: {} vs {}".format(
+                baseline_summary.get("config_hashes"), candidate_summary.get("config_hashes")))
+        for key in sorted((baseline_summary.keys() | candidate_summary.keys()) - {"config_hashes"}):
+            print("  {0}: {1:.6g} -> {2:.6g}".format(
+                key, baseline_summary.get(key, float("nan")), candidate_summary.get(key, float("nan"))))
+
+    regressions = find_regressions(baseline, candidate, params.threshold)
+    if len(regressions) > 0:
+        print("Regressions beyond {:.0%}:".format(params.threshold))
+        for regression in regressions:
+            print("  " + regression)
+        sys.exit(1)
+    print("No regressions beyond {:.0%}".format(params.threshold))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+import argparse
+import unittest
+
+from imipnet.perf_log import config_hash, find_regressions, summarize
+
+
+def _record(phase: str, pairs_per_second: float, loss_seconds: float, peak_rss_bytes: int):
+    return {
+        "phase": phase, "config_hash": "abc", "pairs_per_second": pairs_per_second, "peak_rss_bytes": peak_rss_bytes,
+        "stages": {"loss": {"count": 2, "total": 2 * loss_seconds}},
+    }
+
+
+class TestPerfLog(unittest.TestCase):
+
+    def test_config_hash(self):
+        self.assertEqual(config_hash(argparse.Namespace(a=1, b="x")), config_hash({"b": "x", "a": 1}))
+        self.assertNotEqual(config_hash({"a": 1}), config_hash({"a": 2}))
+
+    def test_summarize_skips_warm_up(self):
+        summary = summarize([
+            _record("train", 1, 10, 100), _record("train", 4, 1, 100), _record("train", 6, 3, 300),
+            _record("test", 8, 2, 50)
+        ])
+        self.assertEqual(summary["train"]["pairs_per_second"], 5)
+        self.assertEqual(summary["train"]["peak_rss_bytes"], 300)
+        self.assertEqual(summary["train"]["stage/loss mean seconds"], 2)
+        self.assertEqual(summary["test"]["pairs_per_second"], 8)
+        self.assertEqual(summary["train"]["config_hashes"], ["abc"])
+
+    def test_find_regressions(self):
+        baseline = summarize([_record("train", 10, 1, 100)], skip_records=0)
+        self.assertEqual(find_regressions(baseline, summarize([_record("train", 9.8, 1.04, 103)], 0), 0.05), [])
+
+        regressions = find_regressions(baseline, summarize([_record("train", 9, 1.2, 100)], 0), 0.05)
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(regressions[0].startswith("train pairs_per_second"))
+        self.assertTrue(regressions[1].startswith("train stage/loss mean seconds"))
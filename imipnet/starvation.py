@@ -0,0 +1,107 @@
+import collections
+import time
+
+from pytorch_lightning import Callback
+from pytorch_lightning.utilities import rank_zero_warn
+
+from imipnet.datasets.source import LoadTimedDataset
+
+
+class FetchTimedLoader:
+    """
+    FetchTimedLoader wraps a DataLoader, passes the seconds spent in each next() on its iterator
+    to on_fetch, and passes every other attribute through to the DataLoader.
+    """
+
+    def __init__(self, loader, on_fetch):
+        self._loader = loader
+        self._on_fetch = on_fetch
+
+    def __len__(self):
+        return len(self._loader)
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+    def __iter__(self):
+        iterator = iter(self._loader)
+        while True:
+            start = time.perf_counter()
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                return
+            self._on_fetch(time.perf_counter() - start)
+            yield batch
+
+
+class StarvationDetector(Callback):
+    """
+    StarvationDetector measures how long each training step waited on the DataLoader, timing
+    next() on the training DataLoader's iterator, against how long the step computed, from
+    on_batch_start to on_batch_end, so logging, checkpointing and validation count as neither. Every
+    log_interval steps it logs the fraction of time spent waiting, and splits the wait between
+    the dataset types of the loaded samples in proportion to their load time in the workers,
+    as measured by the LoadTimedDataset wrapping the training set. It warns if the wait
+    fraction exceeds threshold.
+    """
+
+    def __init__(self, train_set: LoadTimedDataset, threshold: float = 0.1, log_interval: int = 50):
+        self._train_set = train_set
+        self._threshold = threshold
+        self._log_interval = log_interval
+
+        self._batch_start = 0.0
+        self._wait_seconds = 0.0
+        self._compute_seconds = 0.0
+        self._steps = 0
+
+    def on_epoch_start(self, trainer, pl_module):
+        # the trainer takes the epoch's DataLoader from trainer.train_dataloader after this
+        if not isinstance(trainer.train_dataloader, FetchTimedLoader):
+            trainer.train_dataloader = FetchTimedLoader(trainer.train_dataloader, self.add_wait)
+
+    def add_wait(self, seconds: float):
+        self._wait_seconds += seconds
+
+    def on_batch_start(self, trainer, pl_module):
+        self._batch_start = time.perf_counter()
+
+    def on_batch_end(self, trainer, pl_module):
+        self._compute_seconds += time.perf_counter() - self._batch_start
+        self._steps += 1
+        if self._steps % self._log_interval == 0:
+            self.log_starvation(trainer, pl_module)
+
+    def log_starvation(self, trainer, pl_module):
+        load_seconds = collections.defaultdict(float)
+        load_counts = collections.defaultdict(int)
+        for source, seconds in self._train_set.drain():
+            load_seconds[source] += seconds
+            load_counts[source] += 1
+        total_load_seconds = sum(load_seconds.values())
+
+        wait_fraction = self._wait_seconds / max(self._wait_seconds + self._compute_seconds, 1e-9)
+        metrics = {
+            "data/wait fraction": wait_fraction,
+            "data/wait ms per step": 1000 * self._wait_seconds / self._log_interval,
+            "data/compute ms per step": 1000 * self._compute_seconds / self._log_interval,
+        }
+        for source in load_seconds:
+            metrics["data/%s/load ms per sample" % source] = 1000 * load_seconds[source] / load_counts[source]
+            metrics["data/%s/attributed wait fraction" % source] = (
+                    wait_fraction * load_seconds[source] / max(total_load_seconds, 1e-9)
+            )
+
+        if pl_module.logger is not None:
+            pl_module.logger.log_metrics(metrics, step=trainer.global_step)
+        if wait_fraction > self._threshold:
+            rank_zero_warn("Training waited on the DataLoader for {:.0%} of the last {} steps, {}".format(
+                wait_fraction, self._log_interval, ", ".join(
+                    "{} loads take {:.1f} ms".format(source, 1000 * load_seconds[source] / load_counts[source])
+                    for source in sorted(load_seconds, key=load_seconds.get, reverse=True)
+                ) or "no sample load times were reported"
+            ))
+
+        self._wait_seconds = 0.0
+        self._compute_seconds = 0.0
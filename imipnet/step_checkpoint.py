@@ -0,0 +1,72 @@
+import collections
+import functools
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+
+import numpy as np
+import torch
+from pytorch_lightning import Callback
+
+from imipnet.async_validation import write_atomically
+
+
+def snapshot_state(state):
+    # copies every tensor to the CPU and every array, so training can go on updating them while the copy is written
+    if isinstance(state, torch.Tensor):
+        return state.detach().to("cpu", copy=True)
+    if isinstance(state, np.ndarray):
+        return np.copy(state)
+    if isinstance(state, dict):
+        copied = collections.OrderedDict() if isinstance(state, collections.OrderedDict) else {}
+        for key, value in state.items():
+            copied[key] = snapshot_state(value)
+        if hasattr(state, "_metadata"):  # module state dicts carry their modules' versions
+            copied._metadata = state._metadata
+        return copied
+    if isinstance(state, (list, tuple)) and not hasattr(state, "_fields"):
+        return type(state)(snapshot_state(value) for value in state)
+    return state
+
+
+class StepCheckpoint(Callback):
+    """
+    StepCheckpoint overwrites one resumable checkpoint every interval optimizer steps, holding the
+    trainer's checkpoint and the module's resume_state, i.e. the sampler position, dataset permutations,
+    replay buffer and random number generator states, so a job killed mid-epoch restarts where it stopped
+    with Trainer(resume_from_checkpoint=path). The checkpoint is copied to the CPU on the training thread
+    and written on a background thread, only waiting for the previous write to finish.
+    """
+
+    def __init__(self, path: str, interval: int):
+        if interval < 1:
+            raise ValueError("interval must be positive")
+        self._path = path
+        self._interval = interval
+        self._last_step = 0
+        self._writer = ThreadPoolExecutor(max_workers=1)
+        self._pending_write: Optional[Future] = None
+
+    def on_batch_end(self, trainer, pl_module):
+        # with gradient accumulation several batches end on the same step
+        step = trainer.global_step
+        if trainer.global_rank != 0 or step == self._last_step or step % self._interval != 0:
+            return
+        self._last_step = step
+
+        self.wait()
+        checkpoint = trainer.dump_checkpoint()
+        checkpoint["resume_state"] = pl_module.resume_state()
+        checkpoint = snapshot_state(checkpoint)
+        os.makedirs(os.path.dirname(os.path.abspath(self._path)), exist_ok=True)
+        self._pending_write = self._writer.submit(
+            write_atomically, self._path, functools.partial(torch.save, checkpoint)
+        )
+
+    def on_train_end(self, trainer, pl_module):
+        self.wait()
+
+    def wait(self):
+        if self._pending_write is not None:
+            self._pending_write.result()  # raises any error from the write
+            self._pending_write = None
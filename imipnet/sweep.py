@@ -0,0 +1,368 @@
+import csv
+import itertools
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser, Namespace
+from typing import Dict, List, Optional, Tuple
+
+
+def parse_grid(grid_specs: List[str], parser: ArgumentParser) -> Dict[Tuple[str, ...], List[Tuple[str, ...]]]:
+    """
+    :param grid_specs: one name=value,value,... per swept argument of parser, e.g. preprocess=center,harris.
+                       Arguments which vary together are joined by colons, in names and in values, e.g.
+                       train_set:eval_set=tum-mono:kitti-gray-0.5,megadepth-gray:megadepth-gray
+    :return: the values of each swept argument or group of arguments, in the order given
+    """
+    known = {action.dest for action in parser._actions}
+    grid = {}
+    for spec in grid_specs:
+        names, _, values = spec.partition("=")
+        names = tuple(name.lstrip("-") for name in names.split(":"))
+        for name in names:
+            if name not in known:
+                raise ValueError("{} is not an argument of IMIPLightning".format(name))
+        if len(values) == 0:
+            raise ValueError("{} has no values, expected {}=value,value,...".format(spec, spec))
+        grid[names] = [tuple(value.split(":")) for value in values.split(",")]
+        for value in grid[names]:
+            if len(value) != len(names):
+                raise ValueError("{} has {} values for {} arguments".format(":".join(value), len(value), len(names)))
+    return grid
+
+
+def expand_grid(grid: Dict[Tuple[str, ...], List[Tuple[str, ...]]]) -> List[Dict[str, str]]:
+    trials = []
+    for group_values in itertools.product(*grid.values()):
+        trials.append({
+            name: value for names, values in zip(grid.keys(), group_values) for name, value in zip(names, values)
+        })
+    return trials
+
+
+def grid_args(params: Dict[str, str]) -> List[str]:
+    args = []
+    for name, value in params.items():
+        # store_true flags are swept as true or false
+        if value.lower() == "true":
+            args.append("--" + name)
+        elif value.lower() != "false":
+            args.extend(["--" + name, value])
+    return args
+
+
+def prepare_datasets(trial_args: List[List[str]]):
+    """
+    Builds every dataset the trials use once, before any trial starts, so downloads and preprocessed
+    caches such as the KLT overlap indices are written once and the trials share them read only.
+    """
+    from imipnet.lightning_module import IMIPLightning, test_dataset_registry, train_dataset_registry, \
+        validation_dataset_registry
+
+    parser = IMIPLightning.add_model_specific_args(ArgumentParser())
+    prepared = set()
+    for args in trial_args:
+        hparams, _ = parser.parse_known_args(args)
+        for registry, name in [(train_dataset_registry, hparams.train_set),
+                               (validation_dataset_registry, hparams.eval_set),
+                               (test_dataset_registry, hparams.test_set)]:
+            if (id(registry), name, hparams.data_root) not in prepared:
+                print("Preparing {} in {}".format(name, hparams.data_root))
+                registry[name](hparams.data_root)
+                prepared.add((id(registry), name, hparams.data_root))
+
+
+class Trial:
+    def __init__(self, index: int, params: Dict[str, str], args: List[str], trial_dir: str):
+        self.index = index
+        self.params = params
+        self.args = args
+        self.dir = trial_dir
+        self.status = "pending"
+        self.process: Optional[subprocess.Popen] = None
+        self.slot: Optional[int] = None
+        self.start_time: Optional[float] = None
+        self.end_time: Optional[float] = None
+
+    @property
+    def report_file(self) -> str:
+        return os.path.join(self.dir, "report.jsonl")
+
+    def reports(self) -> List[Dict[str, float]]:
+        if not os.path.exists(self.report_file):
+            return []
+        with open(self.report_file, "r") as report_file:
+            # the last line may still be being written
+            lines = report_file.read().split("\n")[:-1]
+        return [json.loads(line) for line in lines]
+
+
+class Slot:
+    """
+    A Slot is the share of the host one trial runs in: a set of CPUs, which bounds the trial's
+    threads and DataLoader workers, an optional GPU and an optional address space limit.
+    """
+
+    def __init__(self, cpus: List[int], gpu: Optional[str], memory_limit_bytes: Optional[int]):
+        self.cpus = cpus
+        self.gpu = gpu
+        self.memory_limit_bytes = memory_limit_bytes
+
+    def environment(self) -> Dict[str, str]:
+        env = dict(os.environ)
+        env["OMP_NUM_THREADS"] = str(len(self.cpus))
+        env["MKL_NUM_THREADS"] = str(len(self.cpus))
+        env["CUDA_VISIBLE_DEVICES"] = "" if self.gpu is None else self.gpu
+        return env
+
+    def restrict(self):
+        # runs in the trial's process before it starts
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, self.cpus)
+        if self.memory_limit_bytes is not None:
+            resource.setrlimit(resource.RLIMIT_AS, (self.memory_limit_bytes, self.memory_limit_bytes))
+
+
+def make_slots(max_parallel: int, cpus_per_trial: int, gpus: List[str],
+               memory_limit_bytes: Optional[int]) -> List[Slot]:
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count()))
+    if max_parallel * cpus_per_trial > len(cpus):
+        raise ValueError("{} trials of {} CPUs need more than the {} available".format(
+            max_parallel, cpus_per_trial, len(cpus)))
+    return [
+        Slot(cpus[i * cpus_per_trial:(i + 1) * cpus_per_trial], gpus[i % len(gpus)] if len(gpus) > 0 else None,
+             memory_limit_bytes)
+        for i in range(max_parallel)
+    ]
+
+
+class LocalScheduler:
+    """
+    LocalScheduler runs trials of lightning_train.py as subprocesses, one per free slot, in the order
+    given, logging each trial's output to its directory. Subclasses decide whether a running trial
+    should be stopped early with should_stop, which is checked whenever the trial reports.
+    """
+
+    def __init__(self, trials: List[Trial], slots: List[Slot], poll_interval: float = 5.0):
+        self.trials = trials
+        self.slots = slots
+        self.poll_interval = poll_interval
+        self._report_counts: Dict[int, int] = {}
+
+    def run(self):
+        free_slots = list(range(len(self.slots)))
+        try:
+            while any(trial.status in ["pending", "running"] for trial in self.trials):
+                for trial in self.trials:
+                    if trial.status == "running":
+                        if trial.process.poll() is not None:
+                            self.finish(trial, "completed" if trial.process.returncode == 0 else "failed")
+                            free_slots.append(trial.slot)
+                        elif self.has_new_reports(trial) and self.should_stop(trial):
+                            self.stop(trial)
+                            free_slots.append(trial.slot)
+
+                for trial in self.trials:
+                    if trial.status == "pending" and len(free_slots) > 0:
+                        self.launch(trial, free_slots.pop(0))
+                time.sleep(self.poll_interval)
+        finally:
+            # don't leave trials running if the sweep itself is interrupted
+            for trial in self.trials:
+                if trial.status == "running":
+                    self.stop(trial)
+
+    def has_new_reports(self, trial: Trial) -> bool:
+        count = len(trial.reports())
+        is_new = count > self._report_counts.get(trial.index, 0)
+        self._report_counts[trial.index] = count
+        return is_new
+
+    def should_stop(self, trial: Trial) -> bool:
+        return False
+
+    def launch(self, trial: Trial, slot_index: int):
+        os.makedirs(trial.dir, exist_ok=True)
+        if os.path.exists(trial.report_file):  # from an earlier sweep in the same directory
+            os.remove(trial.report_file)
+        slot = self.slots[slot_index]
+        # trials starting together would otherwise get the same timestamped run name
+        command = [sys.executable, "-m", "imipnet.lightning_train"] + trial.args + [
+            "--report_file", trial.report_file,
+            "--run_name", "{}-trial-{:03d}".format(os.path.basename(os.path.abspath(os.path.dirname(trial.dir))),
+                                                    trial.index)
+        ]
+        with open(os.path.join(trial.dir, "command.json"), "w") as command_file:
+            json.dump({"command": command, "params": trial.params, "cpus": slot.cpus, "gpu": slot.gpu},
+                      command_file, indent=2)
+        log_file = open(os.path.join(trial.dir, "train.log"), "w")
+        trial.process = subprocess.Popen(command, stdout=log_file, stderr=subprocess.STDOUT,
+                                         env=slot.environment(), preexec_fn=slot.restrict)
+        log_file.close()  # the child holds its own descriptor
+        trial.slot, trial.status, trial.start_time = slot_index, "running", time.time()
+        print("Trial {} started on CPUs {}{}: {}".format(
+            trial.index, slot.cpus, "" if slot.gpu is None else " and GPU " + slot.gpu, trial.params))
+
+    def stop(self, trial: Trial):
+        trial.process.terminate()
+        try:
+            trial.process.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            trial.process.kill()
+            trial.process.wait()
+        self.finish(trial, "stopped")
+
+    def finish(self, trial: Trial, status: str):
+        trial.status, trial.end_time = status, time.time()
+        print("Trial {} {}".format(trial.index, status))
+
+
+class SuccessiveHalvingScheduler(LocalScheduler):
+    """
+    SuccessiveHalvingScheduler stops unpromising trials early, asynchronously, as in ASHA
+    (Li et al., A System for Massively Parallel Hyperparameter Tuning). Rungs are placed at
+    min_step * reduction_factor^k steps. When a trial reports past a rung, its best score so far
+    is recorded there, and the trial is stopped if it falls below the top 1 / reduction_factor of
+    the scores recorded at that rung, once at least reduction_factor trials have been. Stopped
+    trials free their slot for the next pending trial, so a sweep should hold more trials than slots.
+    """
+
+    def __init__(self, trials: List[Trial], slots: List[Slot], min_step: int, max_step: int,
+                 reduction_factor: int = 3, monitor: str = "eval_true_inliers", poll_interval: float = 5.0):
+        super().__init__(trials, slots, poll_interval)
+        if min_step < 1 or reduction_factor < 2:
+            raise ValueError("min_step must be positive and reduction_factor at least 2")
+        self.rungs = [min_step]
+        while self.rungs[-1] * reduction_factor <= max_step:
+            self.rungs.append(self.rungs[-1] * reduction_factor)
+        self._reduction_factor = reduction_factor
+        self._monitor = monitor
+        # rung step -> trial index -> best score at the rung
+        self.rung_scores: Dict[int, Dict[int, float]] = {rung: {} for rung in self.rungs}
+
+    def should_stop(self, trial: Trial) -> bool:
+        reports = [report for report in trial.reports() if self._monitor in report]
+        for rung in self.rungs:
+            if trial.index in self.rung_scores[rung] or len(reports) == 0 or reports[-1]["step"] < rung:
+                continue
+            score = max(report[self._monitor] for report in reports if report["step"] <= rung)
+            self.rung_scores[rung][trial.index] = score
+
+            scores = sorted(self.rung_scores[rung].values(), reverse=True)
+            if len(scores) < self._reduction_factor:
+                continue
+            cutoff = scores[max(len(scores) // self._reduction_factor - 1, 0)]
+            if score < cutoff:
+                print("Trial {} stopped at rung {}: {} {:.2f} is below the cutoff {:.2f}".format(
+                    trial.index, rung, self._monitor, score, cutoff))
+                return True
+        return False
+
+
+def results_table(trials: List[Trial], monitor: str = "eval_true_inliers") -> List[Dict]:
+    rows = []
+    for trial in trials:
+        reports = [report for report in trial.reports() if monitor in report]
+        best = max(reports, key=lambda report: report[monitor]) if len(reports) > 0 else {}
+        rows.append({
+            "trial": trial.index,
+            **trial.params,
+            "status": trial.status,
+            "steps": reports[-1]["step"] if len(reports) > 0 else 0,
+            "best " + monitor: best.get(monitor, ""),
+            "best step": best.get("step", ""),
+            "last " + monitor: reports[-1][monitor] if len(reports) > 0 else "",
+            "hours": "" if trial.end_time is None else round((trial.end_time - trial.start_time) / 3600, 2),
+            "dir": trial.dir,
+        })
+    return rows
+
+
+def write_results(rows: List[Dict], results_file: str):
+    with open(results_file, "w", newline="") as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+
+    columns = [key for key in rows[0].keys() if key != "dir"]
+    widths = [max(len(str(column)), *(len(str(row[column])) for row in rows)) for column in columns]
+    print("  ".join(str(column).ljust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(str(row[column]).ljust(width) for column, width in zip(columns, widths)))
+
+
+def sweep_parser() -> ArgumentParser:
+    parser = ArgumentParser(description="Run a grid of lightning_train.py trials in parallel on this host, e.g. "
+                                        "python -m imipnet.sweep sweeps/paper --grid preprocess=center,harris "
+                                        "--grid n_top_patches=1,16 --grid train_set:eval_set:test_set="
+                                        "tum-mono:kitti-gray-0.5:kitti-gray-0.5,megadepth-gray:megadepth-gray:"
+                                        "megadepth-gray -- --loss outlier-balanced-bce-bce-uml")
+    parser.add_argument("sweep_dir", type=str, help="each trial's log and reports go in a subdirectory")
+    parser.add_argument("--grid", type=str, action="append", default=[],
+                        help="name=value,value,... of an IMIPLightning argument to sweep, may be repeated")
+    parser.add_argument("--max_parallel", type=int, default=None,
+                        help="trials run at once, by default as many as the CPUs allow")
+    parser.add_argument("--cpus_per_trial", type=int, default=4)
+    parser.add_argument("--gpus", type=str, default="", help="comma separated GPU ids, assigned to slots in turn, without any trials train on the CPU")
+    parser.add_argument("--memory_limit_gb", type=float, default=None, help="address space limit of each trial")
+    parser.add_argument("--poll_interval", type=float, default=5.0)
+    parser.add_argument("--asha_min_step", type=int, default=0,
+                        help="step of the first successive halving rung, where the worst trials are stopped, "
+                             "0 runs every trial to the end")
+    parser.add_argument("--asha_max_step", type=int, default=20000 * 5, help="the trials' max_steps")
+    parser.add_argument("--asha_reduction_factor", type=int, default=3,
+                        help="rungs are this factor apart, and 1 / factor of the trials at each rung continue")
+    parser.add_argument("--skip_prepare", action="store_true", help="don't build the datasets before the trials")
+    return parser
+
+
+def make_trials(params: Namespace, fixed_args: List[str]) -> List[Trial]:
+    from imipnet.lightning_module import IMIPLightning
+
+    grid = parse_grid(params.grid, IMIPLightning.add_model_specific_args(ArgumentParser()))
+    return [
+        Trial(index, trial_params, fixed_args + grid_args(trial_params),
+              os.path.join(params.sweep_dir, "trial-%03d" % index))
+        for index, trial_params in enumerate(expand_grid(grid))
+    ]
+
+
+def split_argv(argv: List[str]):
+    # arguments after -- are passed to every trial
+    if "--" in argv:
+        return argv[:argv.index("--")], argv[argv.index("--") + 1:]
+    return argv, []
+
+
+def make_slots_from_params(params: Namespace) -> List[Slot]:
+    cpu_count = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    max_parallel = params.max_parallel or max(1, cpu_count // params.cpus_per_trial)
+    gpus = [gpu for gpu in params.gpus.split(",") if len(gpu) > 0]
+    memory_limit_bytes = None if params.memory_limit_gb is None else int(params.memory_limit_gb * 2 ** 30)
+    return make_slots(max_parallel, params.cpus_per_trial, gpus, memory_limit_bytes)
+
+
+def main():
+    sweep_argv, fixed_args = split_argv(sys.argv[1:])
+    params = sweep_parser().parse_args(sweep_argv)
+
+    trials = make_trials(params, fixed_args)
+    os.makedirs(params.sweep_dir, exist_ok=True)
+    if not params.skip_prepare:
+        prepare_datasets([trial.args for trial in trials])
+
+    slots = make_slots_from_params(params)
+    if params.asha_min_step > 0:
+        scheduler = SuccessiveHalvingScheduler(trials, slots, params.asha_min_step, params.asha_max_step,
+                                               params.asha_reduction_factor, poll_interval=params.poll_interval)
+    else:
+        scheduler = LocalScheduler(trials, slots, params.poll_interval)
+    scheduler.run()
+    write_results(results_table(trials), os.path.join(params.sweep_dir, "results.csv"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import json
+import os
+import tempfile
+import unittest
+from argparse import ArgumentParser
+
+from imipnet.sweep import SuccessiveHalvingScheduler, Trial, expand_grid, grid_args, parse_grid
+
+
+class TestSweepGrid(unittest.TestCase):
+
+    @staticmethod
+    def _parser() -> ArgumentParser:
+        parser = ArgumentParser()
+        parser.add_argument('--preprocess')
+        parser.add_argument('--n_top_patches', type=int)
+        parser.add_argument('--train_set')
+        parser.add_argument('--eval_set')
+        parser.add_argument('--single_pass', action='store_true')
+        return parser
+
+    def test_expand_grid(self):
+        grid = parse_grid([
+            "preprocess=center,harris", "train_set:eval_set=tum-mono:kitti-gray,megadepth-gray:megadepth-gray"
+        ], self._parser())
+        trials = expand_grid(grid)
+        self.assertEqual(len(trials), 4)
+        self.assertEqual(trials[0], {"preprocess": "center", "train_set": "tum-mono", "eval_set": "kitti-gray"})
+        self.assertEqual(trials[3], {
+            "preprocess": "harris", "train_set": "megadepth-gray", "eval_set": "megadepth-gray"
+        })
+
+    def test_invalid_grid(self):
+        with self.assertRaises(ValueError):
+            parse_grid(["learning_rat=0.1"], self._parser())
+        with self.assertRaises(ValueError):
+            parse_grid(["train_set:eval_set=tum-mono"], self._parser())
+        with self.assertRaises(ValueError):
+            parse_grid(["preprocess="], self._parser())
+
+    def test_grid_args(self):
+        self.assertEqual(grid_args({"n_top_patches": "16", "single_pass": "true"}),
+                         ["--n_top_patches", "16", "--single_pass"])
+        self.assertEqual(grid_args({"single_pass": "False"}), [])
+
+
+class TestSuccessiveHalving(unittest.TestCase):
+
+    def test_stops_below_rung_cutoff(self):
+        with tempfile.TemporaryDirectory() as sweep_dir:
+            trials = [Trial(i, {}, [], os.path.join(sweep_dir, str(i))) for i in range(4)]
+            scheduler = SuccessiveHalvingScheduler(trials, [], min_step=100, max_step=1000, reduction_factor=2)
+            self.assertEqual(scheduler.rungs, [100, 200, 400, 800])
+
+            def report(trial: Trial, step: int, score: float):
+                os.makedirs(trial.dir, exist_ok=True)
+                with open(trial.report_file, "a") as report_file:
+                    report_file.write(json.dumps({"step": step, "eval_true_inliers": score}) + "\n")
+
+            report(trials[0], 100, 5)
+            self.assertFalse(scheduler.should_stop(trials[0]))  # alone at the rung
+            report(trials[1], 100, 3)
+            self.assertTrue(scheduler.should_stop(trials[1]))
+            report(trials[2], 50, 1)
+            report(trials[2], 100, 9)
+            self.assertFalse(scheduler.should_stop(trials[2]))
+            report(trials[3], 100, 4)
+            self.assertTrue(scheduler.should_stop(trials[3]))  # below the top half of 9, 5, 4, 3
+            self.assertEqual(scheduler.rung_scores[100], {0: 5, 1: 3, 2: 9, 3: 4})
@@ -0,0 +1,163 @@
+import collections
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+from typing import Dict, List
+
+import numpy as np
+import torch
+from pytorch_lightning import Callback
+
+# Stage timing is off by default, when off stage() costs one branch and returns a shared null context
+_enabled = False
+_synchronize = False
+_lock = threading.Lock()
+_durations: Dict[str, List[float]] = collections.defaultdict(list)
+_null_context = contextlib.nullcontext()
+
+
+def enable(synchronize: bool = False):
+    """
+    Turns stage timing on. CUDA kernels run asynchronously, so with synchronize each stage
+    waits for the device on entry and exit and is charged for its own kernels, at the cost
+    of the overlap between host and device.
+    """
+    global _enabled, _synchronize
+    _enabled = True
+    _synchronize = synchronize and torch.cuda.is_available()
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def _reset_after_fork():
+    # forked DataLoader workers start with timing off and no samples, see imipnet.datasets.profile
+    global _enabled, _lock
+    _enabled = False
+    _lock = threading.Lock()
+    _durations.clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+@contextlib.contextmanager
+def _timed_stage(name: str):
+    if _synchronize:
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if _synchronize:
+            torch.cuda.synchronize()
+        duration = time.perf_counter() - start
+        with _lock:
+            _durations[name].append(duration)
+
+
+def stage(name: str):
+    # times the with block as one sample of the named stage
+    if not _enabled:
+        return _null_context
+    return _timed_stage(name)
+
+
+def timed(name: str, fn):
+    # wraps fn so every call is timed as the named stage, e.g. for functions run on a thread pool
+    @functools.wraps(fn)
+    def timed_fn(*args, **kwargs):
+        with stage(name):
+            return fn(*args, **kwargs)
+
+    return timed_fn
+
+
+def samples(clear: bool = True) -> Dict[str, List[float]]:
+    """
+    :return: for each stage, the wall-clock seconds of every timed sample
+    """
+    with _lock:
+        durations = {name: list(stage_samples) for name, stage_samples in _durations.items() if len(stage_samples) > 0}
+        if clear:
+            _durations.clear()
+    return durations
+
+
+def collect(clear: bool = True) -> Dict[str, Dict[str, float]]:
+    """
+    :return: for each stage, the count, total and mean of its wall-clock seconds
+             and their 50th, 90th and 99th percentiles
+    """
+    stats = {}
+    for name, stage_samples in samples(clear).items():
+        stage_samples = np.array(stage_samples)
+        p50, p90, p99 = np.percentile(stage_samples, [50, 90, 99])
+        stats[name] = {
+            "count": int(stage_samples.size),
+            "total": float(stage_samples.sum()),
+            "mean": float(stage_samples.mean()),
+            "p50": float(p50),
+            "p90": float(p90),
+            "p99": float(p99),
+        }
+    return stats
+
+
+class StageTimingCallback(Callback):
+    """
+    StageTimingCallback turns stage timing on in the training process, which may be a spawned
+    worker, and logs the stage timings collected since its last log every log_interval training
+    batches and after each validation and test run, both to the module's logger and as JSON lines
+    of {"step", "stages"} appended to output_file.
+    """
+
+    def __init__(self, output_file: str, log_interval: int = 50, synchronize: bool = True):
+        self._output_file = output_file
+        self._log_interval = log_interval
+        self._synchronize = synchronize
+        self._batches = 0
+
+    def on_train_start(self, trainer, pl_module):
+        enable(self._synchronize)
+
+    def on_test_start(self, trainer, pl_module):
+        enable(self._synchronize)
+
+    def on_batch_end(self, trainer, pl_module):
+        self._batches += 1
+        if self._batches % self._log_interval == 0:
+            self.log_stages(trainer, pl_module)
+
+    def on_validation_end(self, trainer, pl_module):
+        self.log_stages(trainer, pl_module)
+
+    def on_test_end(self, trainer, pl_module):
+        self.log_stages(trainer, pl_module)
+
+    def log_stages(self, trainer, pl_module):
+        stats = collect()
+        if len(stats) == 0 or trainer.global_rank != 0:
+            return
+
+        if pl_module.logger is not None:
+            pl_module.logger.log_metrics({
+                "timing/%s/%s" % (name, key): stage_stats[key]
+                for name, stage_stats in stats.items() for key in ["mean", "p50", "p90", "p99"]
+            }, step=trainer.global_step)
+
+        with open(self._output_file, "a") as output_file:
+            output_file.write(json.dumps(self.log_record(trainer, pl_module, stats)) + "\n")
+
+    def log_record(self, trainer, pl_module, stats: Dict[str, Dict[str, float]]) -> Dict:
+        # the JSON line written for each log, subclasses may add to it
+        return {"step": trainer.global_step, "stages": stats}
@@ -0,0 +1,23 @@
+import json
+
+from pytorch_lightning import Callback
+
+
+class TrialReporter(Callback):
+    """
+    TrialReporter appends {"step", monitor} to report_file after every validation which produced
+    the monitored metric, for the sweep scheduler to read.
+    """
+
+    def __init__(self, report_file: str, monitor: str = "eval_true_inliers"):
+        self._report_file = report_file
+        self._monitor = monitor
+
+    def on_validation_end(self, trainer, pl_module):
+        if trainer.global_rank != 0 or self._monitor not in trainer.callback_metrics:
+            return
+        with open(self._report_file, "a") as report_file:
+            report_file.write(json.dumps({
+                "step": trainer.global_step,
+                self._monitor: float(trainer.callback_metrics[self._monitor]),
+            }) + "\n")
@@ -0,0 +1,52 @@
+import json
+from argparse import ArgumentParser
+
+import torch.utils.data
+import tqdm
+
+from imipnet.datasets.profile import ProfiledDataset, aggregate_stage_samples, format_stage_histograms, \
+    stage_histograms
+from imipnet.datasets.shuffle import ShuffledDataset
+from imipnet.lightning_module import test_dataset_registry, train_dataset_registry, validation_dataset_registry
+
+dataset_registries = {
+    "train": train_dataset_registry,
+    "validation": validation_dataset_registry,
+    "test": test_dataset_registry,
+}
+
+parser = ArgumentParser(description="Profile dataset sample loads in DataLoader workers, with latency histograms "
+                                    "of image decode, depth map reading, flow and fundamental matrix construction")
+parser.add_argument('split', choices=dataset_registries.keys())
+parser.add_argument('datasets', nargs="+", help="dataset names in the split's registry")
+parser.add_argument('--data_root', default="./data")
+parser.add_argument('--n_samples', type=int, default=200, help="samples drawn at random from each dataset")
+parser.add_argument('--num_workers', type=int, default=4)
+parser.add_argument('--output', type=str, default=None, help="also write the histograms to this JSON file")
+params = parser.parse_args()
+
+registry = dataset_registries[params.split]
+for dataset_name in params.datasets:
+    if dataset_name not in registry:
+        parser.error("{} is not one of the {} datasets: {}".format(dataset_name, params.split, ", ".join(registry)))
+
+histograms = {}
+for dataset_name in params.datasets:
+    dataset = ProfiledDataset(ShuffledDataset(
+        registry[dataset_name](params.data_root), None if params.n_samples < 1 else params.n_samples
+    ))
+    loader = torch.utils.data.DataLoader(dataset, batch_size=1, num_workers=params.num_workers,
+                                         collate_fn=lambda pairs: None)  # only the load is profiled
+
+    stage_samples = []
+    for _ in tqdm.tqdm(loader, desc=dataset_name):
+        stage_samples.extend(dataset.drain())
+    stage_samples.extend(dataset.drain())
+
+    histograms[dataset_name] = stage_histograms(aggregate_stage_samples(stage_samples))
+    print(dataset_name)
+    print(format_stage_histograms(histograms[dataset_name]))
+
+if params.output is not None:
+    with open(params.output, "w") as output_file:
+        json.dump(histograms, output_file, indent=2)
@@ -10,6 +10,7 @@ from pytorch_lightning import seed_everything
 from imipnet.data.pairs import CorrespondencePair
 from imipnet.datasets.shuffle import ShuffledDataset
 from imipnet.lightning_module import test_dataset_registry
+from imipnet.metrics.inliers import count_unique_inliers
 
 inlier_radius = 3
 n_points = 128
@@ -73,14 +74,10 @@ for pair in tqdm.tqdm(test_set):  # type: CorrespondencePair
 
     apparent_inliers = (img_1_inliers & img_2_inliers)
     apparent_inliers_img_1_kp = img_1_match_kps[:, apparent_inliers]
-    uniq_inliers_img_1_kp = apparent_inliers_img_1_kp[:, 0:1]
-    for i in range(1, apparent_inliers_img_1_kp.shape[1]):
-        test_inlier = apparent_inliers_img_1_kp[:, i:i + 1]
-        if np.all(np.linalg.norm(uniq_inliers_img_1_kp - test_inlier, ord=2, axis=0) > inlier_radius):
-            uniq_inliers_img_1_kp = np.hstack((uniq_inliers_img_1_kp, test_inlier))
+    num_uniq_inliers = int(count_unique_inliers(torch.from_numpy(apparent_inliers_img_1_kp), inlier_radius))
 
     apparent_matching_scores.append(apparent_inliers_img_1_kp.shape[1] / n_points)
-    true_matching_scores.append(uniq_inliers_img_1_kp.shape[1] / n_points)
+    true_matching_scores.append(num_uniq_inliers / n_points)
 
 result_dict = {
     "matching_scores": {